@@ -0,0 +1,353 @@
+"""
+ This module contains the asyncio download backend.
+
+ The search pages and the images are fetched as coroutines on a single
+ event loop with aiohttp; a semaphore bounds the number of requests in
+ flight, so a single core can keep hundreds of transfers going without
+ paying for a thread (and the GIL) per transfer. The disk and sqlite
+ work (part files, renames, the page cache and the indexes) runs in the
+ default executor of the loop, so a slow disk never stalls the transfers.
+
+"""
+
+import os, logging, asyncio, time
+import aiohttp
+from contextlib import nullcontext
+from logger import mainlogger
+from downloader import AlphaDownloader
+from workerpool import AIMDController
+
+# get module logger
+asyncLogger = logging.getLogger('main.async_downloader')
+
+class AsyncAdaptiveLimiter(AIMDController):
+    """
+    AIMD controller gating the image coroutines; use as an async context
+    manager around a transfer, waits while the current limit is reached
+    """
+    def __init__(self, *args, **kw):
+        AIMDController.__init__(self, *args, **kw)
+        self.active = 0
+        self._slotFree = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._slotFree:
+            await self._slotFree.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+        return self
+
+    async def __aexit__(self, *excinfo):
+        async with self._slotFree:
+            self.active -= 1
+            self._slotFree.notify_all()     # the limit may have grown
+
+"""
+Asyncio Wallpaper Downloader for https://wall.alphacoders.com;
+same contract as AlphaDownloader, only the engine differs
+"""
+class AsyncAlphaDownloader(AlphaDownloader):
+    numWorkers = 100    # default number of requests in flight
+    transientErrors = AlphaDownloader.transientErrors + (
+                            aiohttp.ClientConnectionError,
+                            aiohttp.ClientPayloadError, asyncio.TimeoutError)
+    congestionErrors = AlphaDownloader.congestionErrors + (
+                            aiohttp.ServerDisconnectedError,
+                            aiohttp.ClientConnectorError, asyncio.TimeoutError)
+
+    def __init__(self, *args, **kw):
+        AlphaDownloader.__init__(self, *args, **kw)
+        self._connStats = dict(newConnections=0, reusedConnections=0)
+
+    def _runDownload(self, numWorkers=None):
+        " Run the asynchronous download to completion on a fresh event loop "
+        asyncio.run(self._runDownloadAsync(numWorkers or self.numWorkers))
+
+    def restoreMetadata(self, imageMetaDict, numWorkers=None, downloadDir=None):
+        """
+        Download images from a previously saved name-image dict, or an
+        iterable of (name, link) consumed as the coroutines start, into
+        downloadDir or the directory of the last run
+        """
+        downloadDir = downloadDir or self.downloadDir
+        os.makedirs(downloadDir, exist_ok=True)
+        self._resetRun(0, downloadDir, self.maxRetries)
+        self._nearDupIndex = self._openNearDupIndex(downloadDir)
+        asyncio.run(self._restoreAsync(self._restoreItems(imageMetaDict),
+                                       numWorkers or self.numWorkers))
+
+    @staticmethod
+    async def _offLoop(func, *args):
+        " Run the blocking func(*args) in the default executor of the loop "
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    def _makeSession(self, maxInFlight):
+        """
+        Create the client session, with a connection per request in flight
+        kept alive and counted, timing the connection setups of the page and
+        image requests (trace_request_ctx kind); must be called inside the
+        event loop
+        """
+        async def onCreateStart(session, context, params):
+            context.connectStart = time.perf_counter()
+        async def onCreate(session, context, params):
+            self._connStats['newConnections'] += 1
+            kind = (context.trace_request_ctx or {}).get('kind', 'image')
+            self.metrics.observe('connect', kind,
+                                 time.perf_counter() - context.connectStart)
+        async def onReuse(session, context, params):
+            self._connStats['reusedConnections'] += 1
+        traceConfig = aiohttp.TraceConfig()
+        traceConfig.on_connection_create_start.append(onCreateStart)
+        traceConfig.on_connection_create_end.append(onCreate)
+        traceConfig.on_connection_reuseconn.append(onReuse)
+
+        connector = aiohttp.TCPConnector(limit=maxInFlight, keepalive_timeout=30)
+        timeout = aiohttp.ClientTimeout(sock_connect=self.timeout[0],
+                                        sock_read=self.timeout[1])
+        return aiohttp.ClientSession(headers=self.headers, connector=connector,
+                                     timeout=timeout, trace_configs=[traceConfig])
+
+    def connectionStats(self):
+        return dict(self._connStats)
+
+    async def _runDownloadAsync(self, maxInFlight):
+        """
+        Async Download Logic;
+        Crawl the pages on the loop, in concurrent waves once the links per
+        page are known, and schedule an image coroutine for every link that
+        passes the image filter, waiting for a free slot before scheduling the next one so that at
+        most maxInFlight requests are pending at any time; a sync run stops
+        at the first image seen before (see AlphaDownloader._crawlPages)
+        """
+        semaphore = asyncio.Semaphore(maxInFlight)
+        self.limiter = AsyncAdaptiveLimiter(maxInFlight) if self.adaptive else None
+        imgLinksFetched = 0
+        numOnDisk = 0
+        pageFailed = False
+        syncing = self.seenIds is not None
+        tasks = set()
+        async with self._makeSession(maxInFlight) as session:
+            wave = self._nextPageWave(self.numImages)
+            while wave:
+                pagesFetched = 0
+                # fetch the whole wave concurrently, results in page order
+                pageLists = await asyncio.gather(*(
+                    self._fetchPageAsync(session, semaphore, pageNum, syncing)
+                    for pageNum in wave))
+                for imgList in pageLists:
+                    if imgList is None:     # page failed, already logged
+                        pageFailed = True
+                        continue
+                    if not imgList:         # no more results
+                        wave = None
+                        break
+                    pagesFetched += 1
+                    if syncing:
+                        imgList, onDisk, seenReached = self._unseenImages(imgList)
+                        numOnDisk += onDisk
+                        if seenReached:
+                            wave = None
+                    else:
+                        imgList = self._newImages(imgList)
+                    imgList = await self._filterLinksAsync(session, semaphore, imgList,
+                                    max(0, self.numImages - numOnDisk - imgLinksFetched))
+                    for record in imgList:
+                        await semaphore.acquire()   # released by the task
+                        task = asyncio.create_task(self.downloadImageAsync(
+                                        session, semaphore, record.link, record.name))
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+                        imgLinksFetched += 1
+                    if not wave:
+                        break
+                asyncLogger.debug(f'{imgLinksFetched = }')
+                asyncLogger.debug(f'{self.numPages = }')
+                # stop if the whole wave failed
+                if wave and pagesFetched and imgLinksFetched + numOnDisk < self.numImages:
+                    wave = self._nextPageWave(self.numImages - numOnDisk - imgLinksFetched)
+                else:
+                    wave = None
+            if syncing:
+                self.numImages = imgLinksFetched
+                self._syncComplete = not pageFailed
+            await asyncio.gather(*tasks)
+
+    async def _filterLinksAsync(self, session, semaphore, imgList, linksNeeded):
+        """
+        Return up to linksNeeded records of imgList that pass the image
+        filter, the sizes read with concurrent HEAD requests (see
+        AlphaDownloader._filterLinks)
+        """
+        if not self.imageFilter:
+            return imgList[:linksNeeded]
+        records = iter(imgList)
+        accepted = []
+        while len(accepted) < linksNeeded:
+            batch = self._filterByResolution(records, linksNeeded - len(accepted))
+            if not batch:
+                break
+            if self.imageFilter.maxBytes is not None:
+                sizes = await asyncio.gather(*(
+                    self._headSizeAsync(session, semaphore, record.link)
+                    for record in batch))
+                batch = self._filterBySize(batch, sizes)
+            accepted += batch
+        return accepted
+
+    async def _headSizeAsync(self, session, semaphore, link):
+        " Return the Content-Length of link from a HEAD request, None if unknown "
+        try:
+            async with semaphore:
+                with self.tracer.span('head', 'image', link=link):
+                    async with session.head(link, allow_redirects=True,
+                                trace_request_ctx=dict(kind='image')) as response:
+                        response.raise_for_status()
+                        length = response.content_length
+        except Exception as exc:
+            asyncLogger.warning(f'HEAD failed for {link}: {str(exc)}')
+            return None
+        self.metrics.countRequest('head')
+        return length
+
+    async def _restoreAsync(self, imgItems, maxInFlight):
+        " Download the given (name, link) items with bounded concurrency "
+        semaphore = asyncio.Semaphore(maxInFlight)
+        self.limiter = AsyncAdaptiveLimiter(maxInFlight) if self.adaptive else None
+        tasks = set()
+        async with self._makeSession(maxInFlight) as session:
+            for imgname, imglink in imgItems:
+                await semaphore.acquire()
+                task = asyncio.create_task(
+                    self.downloadImageAsync(session, semaphore, imglink, imgname))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+
+    async def _fetchPageAsync(self, session, semaphore, pageNum, revalidate=False):
+        """
+        Fetch and parse a single search page, return its list of
+        ImageRecord or None if the page could not be downloaded;
+        served from the page cache while fresh, else revalidated
+        """
+        pageUrl = self._pageUrl(self.searchKey, pageNum)
+        asyncLogger.info(f'{pageUrl = }')
+        imgList, condHeaders = await self._offLoop(self._cachedPage, pageUrl, revalidate)
+        if imgList is None:
+            try:
+                async with semaphore:
+                    requestStart = time.perf_counter()
+                    with self.tracer.span('page fetch', 'page', page=pageNum):
+                        async with session.get(pageUrl, headers=condHeaders,
+                                    trace_request_ctx=dict(kind='page')) as pageResponse:
+                            ttfb = time.perf_counter() - requestStart
+                            pageResponse.raise_for_status()
+                            asyncLogger.info(f'{pageResponse.status = }')
+                            pageContent = await pageResponse.read() \
+                                            if pageResponse.status != 304 else None
+            except Exception as exc:
+                asyncLogger.error(f'Error Downloading Page: {pageNum}\n{str(exc)}')
+                self.metrics.countError('page', exc)
+                return None
+            self._recordTransfer('page', len(pageContent or b''), ttfb,
+                                 time.perf_counter() - requestStart - ttfb)
+            imgList = await self._offLoop(self._pageFromResponse, pageUrl,
+                        pageResponse.status, pageResponse.headers, lambda: pageContent)
+        if self.linksPerPage is None and imgList:
+            self.linksPerPage = len(imgList)
+        return imgList
+
+    async def downloadImageAsync(self, session, semaphore, link, name=''):
+        """
+        download given image link holding the semaphore slot acquired by the
+        caller, return the saved filename or None if the image was not
+        downloaded; a failed attempt is retried after a backoff, without
+        holding the slot while waiting
+        """
+        imgfilename = self._imagePath(link, name)
+        claimed = False
+        try:
+            if os.path.exists(imgfilename):
+                asyncLogger.warning(f'{imgfilename} exists; possible bug')
+                return None
+            claimed = self._claimImage(imgfilename)
+            if not claimed:
+                return None
+            reused = await self._offLoop(self._reuseIndexed, link, name, imgfilename)
+            if reused:
+                return reused
+            while True:
+                try:
+                    async with self.limiter or nullcontext():
+                        with self.tracer.span('image transfer', 'image', link=link):
+                            imgSize = await self._fetchImageAsync(session, link, imgfilename)
+                    break
+                except Exception as exc:
+                    asyncLogger.error(f'Error saving image: {link}\n{str(exc)}')
+                    self.metrics.countError('image', exc)
+                    self._signalCongestion(exc)
+                    delay = self._retryDelay(link, name, exc)
+                    if delay is None:
+                        return None
+                semaphore.release()
+                await asyncio.sleep(delay)
+                await semaphore.acquire()
+        finally:
+            semaphore.release()
+            if claimed:
+                self._releaseImage(imgfilename)
+
+        if imgSize is None:     # a near duplicate of a better image, deleted
+            return None
+        self._recordDownload(link, name, imgSize)
+        if self.trace:
+            print(f'Downloaded: {name}...')
+        return imgfilename
+
+    async def _fetchImageAsync(self, session, link, imgfilename):
+        """
+        Transfer the image into its part file (resuming it if possible) and
+        rename it once complete, return the bytes transferred, None if the
+        image was deleted as a near duplicate
+        """
+        offset, rangeHeaders, expected = await self._offLoop(
+                                            self._resumeState, imgfilename, link)
+        if offset and offset == expected:   # finished but never renamed
+            digest = await self._offLoop(self._hashPart, imgfilename, offset)
+            await self._offLoop(self._finishPart, imgfilename, link, offset, expected)
+            return 0 if await self._offLoop(self._finishImage, link, imgfilename,
+                                            offset, digest.hexdigest()) else None
+        requestStart = time.perf_counter()
+        async with session.get(link, headers=rangeHeaders) as image:
+            ttfb = time.perf_counter() - requestStart
+            if image.status == 416:         # stale part file
+                await self._offLoop(self._discardPart, imgfilename)
+            image.raise_for_status()
+            imgfile, offset, expected = await self._offLoop(self._openPart,
+                    imgfilename, link, image.status, image.headers, offset)
+            imgSize = 0
+            writeTime = 0.0
+            try:
+                digest = await self._offLoop(self._hashPart, imgfilename, offset)
+                transferStart = time.perf_counter()
+                async for chunk in image.content.iter_chunked(self.chunksize):
+                    digest.update(chunk)
+                    writeStart = time.perf_counter()
+                    await self._offLoop(imgfile.write, chunk)
+                    writeEnd = time.perf_counter()
+                    self.tracer.complete('file write', 'disk', writeStart, writeEnd)
+                    writeTime += writeEnd - writeStart
+                    imgSize += len(chunk)
+            finally:
+                await self._offLoop(imgfile.close)
+            transferTime = time.perf_counter() - transferStart - writeTime
+        finishStart = time.perf_counter()
+        await self._offLoop(self._finishPart, imgfilename, link, offset + imgSize, expected)
+        finishEnd = time.perf_counter()
+        self.tracer.complete('file rename', 'disk', finishStart, finishEnd)
+        writeTime += finishEnd - finishStart    # rename included
+        kept = await self._offLoop(self._finishImage, link, imgfilename,
+                                   offset + imgSize, digest.hexdigest())
+        self._recordTransfer('image', imgSize, ttfb, transferTime, writeTime)
+        if self.limiter:
+            self.limiter.onSuccess(imgSize, ttfb)
+        return imgSize if kept else None
@@ -0,0 +1,253 @@
+"""
+ This module contains the batch mode of the downloader.
+
+ Many search keys are downloaded in one run sharing a single session
+ (connection pool, page cache, dedup index, metrics) and a single pool
+ of download workers. Every search key gets a run of its own, a shallow
+ copy of the batch downloader holding the per key state (directory,
+ served query string, pages, counters); its jobs carry it to the shared
+ workers. The crawler fetches one page per key in turn and interleaves
+ the links of the pages fetched, so a key asking for thousands of
+ images cannot hold back the ones asking for a few.
+
+"""
+
+import os, copy, csv, logging, queue, threading, time
+from collections import namedtuple
+from itertools import chain, zip_longest
+from concurrent.futures import ThreadPoolExecutor
+from downloader import AlphaDownloader
+from syncindex import SyncIndex
+from exceptions import MaxRetriesCrossed, InvalidDownloadNum
+from logger import mainlogger
+
+# get module logger
+batchLogger = logging.getLogger('main.batch')
+
+BatchQuery = namedtuple('BatchQuery', ['searchKey', 'numImages', 'downloadDir'])
+
+def readBatchFile(batchFile, numImages=30, downloadDir=None):
+    """
+    Return the BatchQuery list of a batch file, a csv line per search key:
+    search key[, number of images[, directory]]; blank lines and lines
+    starting with '#' are skipped, missing fields take the given defaults
+    (directory: downloadDir/search key, or the search key)
+    """
+    queries = []
+    for lineNum, row in enumerate(csv.reader(batchFile), 1):
+        row = [field.strip() for field in row]
+        if not row or not row[0] or row[0].startswith('#'):
+            continue
+        if len(row) > 3:
+            raise ValueError(f'Line {lineNum}: expected search key, number, directory')
+        searchKey, count, dirname = row + [''] * (3 - len(row))
+        try:
+            count = int(count) if count else numImages
+        except ValueError:
+            raise ValueError(f'Line {lineNum}: invalid number {count!r}') from None
+        queries.append(makeQuery(searchKey, count, dirname or None, downloadDir))
+    return queries
+
+def makeQuery(searchKey, numImages, dirname=None, downloadDir=None):
+    " Return the BatchQuery of a search key, in dirname or downloadDir/searchKey "
+    if dirname is None:
+        dirname = os.path.join(downloadDir, searchKey) if downloadDir else searchKey
+    return BatchQuery(searchKey, numImages, dirname)
+
+class _RunPool:
+    """
+    The shared worker pool as seen by a run: jobs (and retries)
+    submitted through it carry the run
+    """
+    def __init__(self, pool, run):
+        self.pool = pool
+        self.run = run
+
+    def submit(self, link, name):
+        self.pool.submit(self.run, link, name)
+
+    def submitLater(self, delay, link, name):
+        self.pool.submitLater(delay, self.run, link, name)
+
+"""
+Wallpaper Downloader for many search keys at once; the runs of the keys
+share the connections and the download workers of a single downloader
+"""
+class BatchDownloader(AlphaDownloader):
+    batchFormat = ("%(searchKey)-24.24s %(numDownloaded)5d/%(numImages)-5d "
+                   "pages: %(numPages)-3d abandoned: %(numAbandoned)-3d "
+                   "reused: %(numDeduplicated)-3d %(downloadSize)8.3f MB %(status)s")
+
+    def startBatch(self, queries, maxretries=3, numWorkers=None, imageFilter=None,
+                   sync=False):
+        """
+        Download the images of every BatchQuery (search key, number of
+        images, directory) with a shared pool of numWorkers workers;
+        return the per key stats (also in batchStats, the totals in
+        sessionDict) and raise MaxRetriesCrossed if any key fell short;
+        sync: only the images new since the last sync of every key
+        """
+        for query in queries:
+            if query.numImages <= 0:
+                raise InvalidDownloadNum(query.numImages)
+        if sync and self.syncIndex is None:
+            self.syncIndex = self._openStore(SyncIndex, 'sync.sqlite',
+                                             'Sync index')     # shared by the runs
+        start = time.time()
+        with self._makePool(numWorkers, target=self._runJob) as self._pool:
+            runs = [self._makeRun(query, maxretries, imageFilter, sync)
+                    for query in queries]
+            jobQueue = queue.Queue(maxsize=self.prefetchPages)
+            crawler = threading.Thread(target=self._crawlBatch, daemon=True,
+                                       name='wall-do-crawler', args=(runs, jobQueue))
+            crawler.start()
+            for jobs in iter(jobQueue.get, None):
+                if isinstance(jobs, Exception):     # crawler failed
+                    raise jobs
+                for run, record in jobs:
+                    run._pool.submit(record.link, record.name)
+        self._pool = None
+        crawler.join()
+        for run in runs:
+            run._endSync()
+            if run.journal:
+                run.journal.close()
+
+        self.lastDownloadTime = time.time() - start
+        self.batchStats = [self._runStats(run) for run in runs]
+        self.numDownloaded = sum(run.numDownloaded for run in runs)
+        self.downloadSize = sum(run.downloadSize for run in runs)
+        self.totalDownloads += self.numDownloaded
+        self.totalSize += self.downloadSize
+        self.sessionDict = dict(
+                numDownloaded    = self.numDownloaded,
+                lastDownloadTime = self.lastDownloadTime,
+                numPages         = sum(run.numPages for run in runs),
+                numAbandoned     = sum(len(run.abandonedLinks) for run in runs),
+                numFiltered      = sum(len(run.filteredLinks) for run in runs),
+                numDeduplicated  = sum(run.numDeduplicated for run in runs),
+                numNearDuplicates = sum(len(run.nearDuplicateImages) for run in runs),
+                concurrencyLimit = self.limiter.limit if self.limiter
+                                        else numWorkers or self.numWorkers,
+                downloadSize     = self.bytesToMiB(self.downloadSize),
+                totalDownloads   = self.totalDownloads,
+                totalSize        = self.bytesToMiB(self.totalSize),
+                **self.connectionStats(),
+        )
+
+        if self.trace:
+            print('\n', ' Search Keys: '.center(50, '*'))
+            for stats in self.batchStats:
+                print(self.batchFormat % stats)
+            print('\n', ' Stats: '.center(50, '*'))
+            print(self.printFormat % self.sessionDict)
+            print('\n' + self.metrics.formatTable())
+
+        incomplete = [stats['searchKey'] for stats in self.batchStats
+                      if stats['status'] != 'ok']
+        if incomplete:
+            raise MaxRetriesCrossed(f"{len(incomplete)} of {len(runs)} search keys "
+                                    f"incomplete: {', '.join(incomplete)}")
+        return self.batchStats
+
+    def _makeRun(self, query, maxretries, imageFilter, sync=False):
+        " Return the run of a search key, sharing everything but the run state "
+        os.makedirs(query.downloadDir, exist_ok=True)
+        run = copy.copy(self)
+        run.searchKey = query.searchKey
+        run._resetRun(query.numImages, query.downloadDir, maxretries)
+        run.imageFilter = imageFilter
+        if sync:
+            run._startSync()
+        run._nearDupIndex = run._openNearDupIndex(query.downloadDir)
+        run._queryStrServed = None
+        run.linksPerPage = None
+        run._pool = _RunPool(self._pool, run)
+        run.journal = None
+        run.linksProduced = 0
+        run.numOnDisk = 0       # sync run: new images found in the directory
+        run.crawlError = None
+        return run
+
+    @staticmethod
+    def _runJob(run, link, name):
+        " Worker pool target: download an image of a run "
+        run.downloadImage(link, name)
+
+    def _crawlBatch(self, runs, jobQueue):
+        """
+        Crawler stage; take the runs still needing links in turn,
+        crawlWorkers at a time, fetch the next page of each concurrently
+        and put their filtered links on the bounded job queue interleaved,
+        a link of each run in turn; a run is done once it has produced its
+        links, its results ran out or one of its pages failed; a sync run
+        is also done at the first image seen before, its numImages cut down
+        to the links produced
+        """
+        try:
+            with ThreadPoolExecutor(self.crawlWorkers,
+                                    thread_name_prefix='wall-do-crawler') as executor:
+                active = list(runs)
+                cursor = 0
+                while active:
+                    cursor %= len(active)
+                    group = active[cursor:cursor + self.crawlWorkers]
+                    cursor += len(group)
+                    imgLists = []
+                    for run, page in zip(group, executor.map(self._fetchNextPage, group)):
+                        ended = not page    # failed or no more results
+                        if page and run.seenIds is not None:
+                            page, onDisk, ended = run._unseenImages(page)
+                            run.numOnDisk += onDisk
+                        elif page:
+                            page = run._newImages(page)
+                        if page:
+                            imgList = run._filterLinks(page, max(0, run.numImages
+                                            - run.numOnDisk - run.linksProduced),
+                                            executor.map)
+                            run.linksProduced += len(imgList)
+                            imgLists.append([(run, record) for record in imgList])
+                        # failed, no more results, seen before, or all links produced
+                        if ended or run.linksProduced + run.numOnDisk >= run.numImages:
+                            cursor -= active.index(run) < cursor
+                            active.remove(run)
+                            if run.seenIds is not None:
+                                run.numImages = run.linksProduced
+                                run._syncComplete = page is not None
+                    jobs = [job for job in chain.from_iterable(zip_longest(*imgLists))
+                            if job is not None]
+                    if jobs:
+                        jobQueue.put(jobs)
+        except Exception as exc:
+            jobQueue.put(exc)       # re-raised by the consumer
+        else:
+            jobQueue.put(None)
+
+    @staticmethod
+    def _fetchNextPage(run):
+        " Fetch the next page of a run; None (error kept) if it failed "
+        run.numPages += 1
+        try:
+            return run._fetchPage(run.numPages, revalidate=run.seenIds is not None)
+        except Exception as exc:
+            batchLogger.error(f'Search {run.searchKey!r} failed: {str(exc)}')
+            run.crawlError = exc
+            return None
+
+    def _runStats(self, run):
+        " Return the stats dict of a run "
+        if run.crawlError:
+            status = f'failed: {run.crawlError}'
+        else:
+            status = 'ok' if run._numFinished() >= run.numImages \
+                          else f'incomplete: {run._shortfallError()}'
+        return dict(searchKey        = run.searchKey,
+                    downloadDir      = run.downloadDir,
+                    numImages        = run.numImages,
+                    numDownloaded    = run.numDownloaded,
+                    numPages         = run.numPages,
+                    numAbandoned     = len(run.abandonedLinks),
+                    numFiltered      = len(run.filteredLinks),
+                    numDeduplicated  = run.numDeduplicated,
+                    downloadSize     = self.bytesToMiB(run.downloadSize),
+                    status           = status)
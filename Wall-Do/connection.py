@@ -0,0 +1,139 @@
+"""
+ This module contains the http connection handling for the downloader.
+
+ The default requests adapter keeps 10 connections per host, so with
+ more download workers than that, connections were opened and thrown
+ away on every transfer (the 'Connection pool is full' warnings). The
+ session here sizes the pools to the configured concurrency, keeps the
+ page host apart from the image cdn hosts, and counts how many requests
+ reused a kept-alive connection against the ones that needed a new
+ TCP (and TLS) handshake, timing the handshakes for the metrics.
+
+"""
+
+import logging, threading, time
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from logger import mainlogger
+
+# get module logger
+connLogger = logging.getLogger('main.connection')
+
+class CountingAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that counts the requests sent and the connections opened;
+    onConnect(secs) is called with the time taken by every connection
+    setup (dns, tcp and tls handshakes)
+    """
+    def __init__(self, *args, onConnect=None, **kw):
+        self.numRequests = 0
+        self.numConnections = 0
+        self.onConnect = onConnect
+        self._countLock = threading.Lock()
+        HTTPAdapter.__init__(self, *args, **kw)
+
+    def init_poolmanager(self, *args, **kw):
+        HTTPAdapter.init_poolmanager(self, *args, **kw)
+        adapter = self
+
+        # connections timing their setup, opened lazily on the first request
+        class TimedHTTPConnection(HTTPConnection):
+            def connect(self):
+                start = time.perf_counter()
+                HTTPConnection.connect(self)
+                adapter._timeConnection(time.perf_counter() - start)
+
+        class TimedHTTPSConnection(HTTPSConnection):
+            def connect(self):
+                start = time.perf_counter()
+                HTTPSConnection.connect(self)
+                adapter._timeConnection(time.perf_counter() - start)
+
+        # pool classes calling back on every new connection
+        class CountingHTTPConnectionPool(HTTPConnectionPool):
+            ConnectionCls = TimedHTTPConnection
+            def _new_conn(self):
+                adapter._countConnection()
+                return HTTPConnectionPool._new_conn(self)
+
+        class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+            ConnectionCls = TimedHTTPSConnection
+            def _new_conn(self):
+                adapter._countConnection()
+                return HTTPSConnectionPool._new_conn(self)
+
+        self.poolmanager.pool_classes_by_scheme = {
+            'http':  CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool,
+        }
+
+    def _countConnection(self):
+        with self._countLock:
+            self.numConnections += 1
+
+    def _timeConnection(self, seconds):
+        if self.onConnect:
+            self.onConnect(seconds)
+
+    def send(self, *args, **kw):
+        with self._countLock:
+            self.numRequests += 1
+        return HTTPAdapter.send(self, *args, **kw)
+
+class PooledSession(requests.Session):
+    """
+    requests Session with one connection pool for the page host, sized for
+    the crawler, and pools for the image cdn hosts (imagesN.alphacoders.com),
+    sized for the download workers
+    """
+    cdnHosts = 10       # image hosts kept pooled at once
+
+    def __init__(self, pageUrl, numWorkers, crawlWorkers, metrics=None):
+        requests.Session.__init__(self)
+        self.metrics = metrics      # connection setup times, by kind
+        scheme, host = urlsplit(pageUrl)[:2]
+        self.pageOrigin = f'{scheme}://{host}/'
+        self.poolSizes = None
+        # counters of the adapters replaced by resize()
+        self._retiredRequests = self._retiredConnections = 0
+        self.resize(numWorkers, crawlWorkers)
+
+    def resize(self, numWorkers, crawlWorkers):
+        " Mount adapters for the given concurrency, if it changed "
+        if self.poolSizes == (numWorkers, crawlWorkers):
+            return
+        for adapter in set(self.adapters.values()):
+            self._retiredRequests += getattr(adapter, 'numRequests', 0)
+            self._retiredConnections += getattr(adapter, 'numConnections', 0)
+            adapter.close()
+        imageAdapter = CountingAdapter(pool_connections=self.cdnHosts,
+                                       pool_maxsize=numWorkers,
+                                       onConnect=self._connectTimer('image'))
+        pageAdapter  = CountingAdapter(pool_connections=1,
+                                       pool_maxsize=crawlWorkers,
+                                       onConnect=self._connectTimer('page'))
+        self.mount('https://', imageAdapter)
+        self.mount('http://', imageAdapter)
+        self.mount(self.pageOrigin, pageAdapter)    # longest prefix wins
+        self.poolSizes = (numWorkers, crawlWorkers)
+        connLogger.info(f'{self.pageOrigin = }, {self.poolSizes = }')
+
+    def _connectTimer(self, kind):
+        " Return the callback recording the connection setup times of kind "
+        def onConnect(seconds):
+            if self.metrics is not None:
+                self.metrics.observe('connect', kind, seconds)
+        return onConnect
+
+    def connectionStats(self):
+        " Return a dict of new and reused connection counts "
+        adapters = set(self.adapters.values())
+        numRequests = self._retiredRequests + \
+                sum(getattr(adapter, 'numRequests', 0) for adapter in adapters)
+        numConnections = self._retiredConnections + \
+                sum(getattr(adapter, 'numConnections', 0) for adapter in adapters)
+        return dict(newConnections=numConnections,
+                    reusedConnections=max(0, numRequests - numConnections))
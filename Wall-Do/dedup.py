@@ -0,0 +1,123 @@
+"""
+ This module contains the index of the downloaded images across sessions.
+
+ Every finished image is recorded by its alphacoders image id (the
+ trailing number of its link) and the sha256 of its content, along with
+ the path it was saved to. Before an image is requested the downloader
+ looks its id up, and if a copy exists anywhere on disk it is linked
+ (hard link, else reflink, else copied) into the new directory instead
+ of being downloaded again; a new image with the same content as an
+ indexed one (same artwork under another id) is replaced by a link to
+ the existing copy. Entries whose file is gone or changed are dropped on
+ lookup.
+
+"""
+
+import os, logging, time, shutil, uuid
+from collections import namedtuple
+from urllib.parse import urlsplit
+from sqlitestore import SqliteStore
+from logger import mainlogger
+
+# get module logger
+dedupLogger = logging.getLogger('main.dedup')
+
+IndexedImage = namedtuple('IndexedImage', ['path', 'imageId', 'sha256', 'size'])
+
+def imageId(link):
+    " Return the image id of a link: '1149' for '.../1149.jpg' "
+    return os.path.splitext(os.path.basename(urlsplit(link).path))[0]
+
+def linkFile(source, dest, copy=True):
+    """
+    Make dest a copy of source sharing its data if the filesystem allows;
+    return the method used: 'hardlink', 'reflink' or 'copy', or None if
+    the data cannot be shared and copy is False; the copy is made under a
+    temporary name next to dest and renamed over it once complete, so a
+    failed or interrupted copy never leaves a partial dest
+    """
+    tempname = f'{dest}.{uuid.uuid4().hex[:8]}.tmp'
+    try:
+        method = _shareData(source, tempname, copy)
+        if method:
+            os.replace(tempname, dest)
+        return method
+    finally:
+        try:
+            os.unlink(tempname)
+        except FileNotFoundError:
+            pass
+
+def _shareData(source, dest, copy):
+    " Create dest (not existing) from source, see linkFile "
+    try:
+        os.link(source, dest)
+        return 'hardlink'
+    except OSError:     # other device, or no hard links (fat, some shares)
+        pass
+    try:
+        import fcntl
+        FICLONE = 0x40049409    # linux ioctl, btrfs/xfs/overlayfs copy-on-write
+        with open(source, 'rb') as src, open(dest, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return 'reflink'
+    except (ImportError, OSError):
+        pass
+    if not copy:
+        return None
+    shutil.copyfile(source, dest)
+    return 'copy'
+
+class DedupIndex(SqliteStore):
+    schema = """
+        CREATE TABLE IF NOT EXISTS images (
+            path     TEXT PRIMARY KEY,
+            imageId  TEXT NOT NULL,
+            sha256   TEXT NOT NULL,
+            size     INTEGER NOT NULL,
+            addedAt  REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS imagesById   ON images (imageId);
+        CREATE INDEX IF NOT EXISTS imagesByHash ON images (sha256);
+    """
+    useWal = True       # a commit per image
+
+    def __init__(self, path):
+        " path: sqlite file "
+        SqliteStore.__init__(self, path)
+        dedupLogger.info(f'{self.path = }')
+
+    def _existing(self, column, value):
+        " Return the first indexed image whose file is intact, dropping stale ones "
+        with self._lock:
+            rows = self._db.execute(f'SELECT path, imageId, sha256, size FROM images '
+                                    f'WHERE {column} = ? ORDER BY addedAt',
+                                    (value,)).fetchall()
+        for row in map(IndexedImage._make, rows):
+            try:
+                if os.path.getsize(row.path) == row.size:
+                    return row
+            except OSError:
+                pass
+            dedupLogger.debug(f'Dropping stale entry {row.path}')
+            self.remove(row.path)
+        return None
+
+    def findById(self, imageId):
+        " Return an IndexedImage with the given image id, or None "
+        return self._existing('imageId', imageId)
+
+    def findByHash(self, sha256):
+        " Return an IndexedImage with the given content hash, or None "
+        return self._existing('sha256', sha256)
+
+    def add(self, path, imageId, sha256, size):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?)',
+                             (os.path.abspath(path), imageId, sha256, size, time.time()))
+            self._db.commit()
+
+    def remove(self, path):
+        with self._lock:
+            self._db.execute('DELETE FROM images WHERE path = ?', (path,))
+            self._db.commit()
@@ -10,11 +10,25 @@
 
 """
 
-import os, sys, logging, time
-import threading, requests, bs4
+import os, logging, time, queue, math, json, random, hashlib
+import threading, requests
+from itertools import repeat
+from email.utils import parsedate_to_datetime
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
 from logger import mainlogger
-from exceptions import (InvalidDownloadNum, MaxRetriesCrossed,
-                SearchReturnedNone)
+from workerpool import WorkerPool, AdaptiveLimiter
+from connection import PooledSession
+from pagecache import PageCache
+from sqlitestore import openStore
+from dedup import DedupIndex, imageId, linkFile
+from journal import MetadataJournal, readJournal, fileMatches
+from syncindex import SyncIndex
+from extractor import extractLinks
+from metrics import Metrics
+from tracing import Tracer, TracedLock
+from exceptions import (InvalidDownloadNum, MaxRetriesCrossed, ResultsExhausted,
+                SearchReturnedNone, ImageDownloadError)
 
 # get module logger
 downloadLogger = logging.getLogger('main.downloader')
@@ -31,13 +45,43 @@ class AlphaDownloader:
                       'Chrome/72.0.3626.28 Safari/537.36'
     }
     prefixes = ('Movie ', 'Video ', 'Comics ', 'TV Show ')
-    chunksize = 10000000
+    chunksize = 64 * 1024   # streaming buffer per transfer
+    numWorkers = 8      # default number of concurrent downloads
+    prefetchPages = 2   # pages crawled ahead of the downloaders
+    crawlWorkers  = 4   # pages fetched concurrently by the crawler
+    adaptive = True     # adapt the concurrent transfers (up to numWorkers)
+                        # to the server health, else always use numWorkers
+    cacheDir = os.path.join(os.path.expanduser('~'), '.wall-do')
+    usePageCache = True # keep parsed search pages across runs
+    useDedupIndex = True    # reuse images downloaded before (any directory)
+    journalName = 'wall-do.jsonl'   # metadata journal in every download
+                                    # directory, None: no journal
+    dedupMode = 'link'  # 'link' the indexed copy into the download
+                        # directory, or 'skip' the image altogether
+    nearDuplicates = None   # 'flag' or 'skip' (delete the lower resolution
+                            # copy of) images looking alike, None: off
+    nearDupThreshold = 10   # max differing bits of the 64 bit perceptual hash
+    timeout = (10, 60)  # connect, read timeout (secs) for every request
+    # exponential backoff (secs) between attempts of a failed image
+    backoffBase = 1
+    backoffMax  = 60
+    # errors worth retrying, besides http 408, 429 and 5xx responses
+    transientErrors = (requests.ConnectionError, requests.Timeout,
+                       requests.exceptions.ChunkedEncodingError,
+                       ImageDownloadError, ConnectionError, TimeoutError)
+    # transport errors taken as a sign of an overloaded server
+    congestionErrors = (requests.ConnectionError, requests.Timeout,
+                        ConnectionError, TimeoutError)
     # For current session (total)
     totalSize = 0
     totalDownloads = 0
     printFormat = ("Current Run :\n"
                   "Images Downloaded : %(numDownloaded)d, Time taken: %(lastDownloadTime)d secs\n"
-                  "Number of Pages   : %(numPages)d, Downloaded: %(downloadSize).3f MB\n\n"
+                  "Number of Pages   : %(numPages)d, Downloaded: %(downloadSize).3f MB\n"
+                  "Images Abandoned  : %(numAbandoned)d, Concurrency: %(concurrencyLimit)d\n"
+                  "Images Reused     : %(numDeduplicated)d, Near Duplicates: %(numNearDuplicates)d\n"
+                  "Images Filtered   : %(numFiltered)d\n"
+                  "New Connections   : %(newConnections)d, Reused: %(reusedConnections)d\n\n"
                   "Session Details:\n"
                   "Total Images   : %(totalDownloads)d, Total Size: %(totalSize).3f MB\n")
 
@@ -45,48 +89,70 @@ class AlphaDownloader:
         " initialize attributes for object "
         self.imageMetaDict = dict()
         self.trace = trace
-        self.mutex = threading.Lock()
+        self.tracer = Tracer()        # timeline of the run, when enabled
+        self.mutex = TracedLock(self.tracer)
+        # the dedup lookup and add of an image, two copies of the same
+        # content finishing together must not both miss the other
+        self.indexMutex = TracedLock(self.tracer, 'index mutex')
         self._queryStrServed = None
-        self.downloadSession = requests.Session()
+        self.linksPerPage = None      # learnt from the first page fetched
+        self._pool = None             # worker pool of the running download
+        self.limiter = None           # adaptive limit of concurrent transfers
+        self._resetRun(numImages=0, downloadDir=os.curdir)
+        self.metrics = Metrics()      # phase timings and counters (session)
+        self.downloadSession = PooledSession(self.queryStr,
+                                             self.numWorkers, self.crawlWorkers,
+                                             metrics=self.metrics)
         self.downloadSession.headers.update(self.headers)
+        self.pageCache = self._openStore(PageCache, 'pages.sqlite', 'Page cache') \
+                            if self.usePageCache else None
+        self._nearDupIndex = None
+        self.journal = None           # journal of the current directory
+        self.syncIndex = None         # opened by the first sync run
+        self.dedupIndex = self._openStore(DedupIndex, 'images.sqlite', 'Dedup index') \
+                            if self.useDedupIndex else None
 
     def startDownload(self, 
                       searchKey, 
                       numImages, 
                       downloadDir  = os.curdir, 
-                      maxretries   = 2, 
-                      imgPerThread = 5):
+                      maxretries   = 3, 
+                      numWorkers   = None,
+                      imageFilter  = None,
+                      sync         = False):
         """ 
         toplevel method for starting download, handle and check actual
-        download success 
+        download success; a failed image is retried up to maxretries
+        times with backoff before it is abandoned; the images rejected by
+        imageFilter (filters.ImageFilter) are skipped before any request
+        for them and don't count toward numImages;
+        sync: download only the images newer than the ones finished by
+        the last sync of searchKey, up to numImages (see syncindex)
         """
         # PreDownload Hooks
         if numImages <= 0:
-            raise InvalidDownloadNum
+            raise InvalidDownloadNum(numImages)
 
         # Make sure download dir exists
         os.makedirs(downloadDir, exist_ok=True)
         downloadLogger.info(f'{downloadDir = }')
-        self.downloadDir = downloadDir
 
-        # For current run
         self.searchKey = searchKey
-        self.numImages = numImages
-        self.numPages = 0
-        self.numDownloaded = 0
-        self.downloadSize  = 0
-        self.lastDownloadTime = None
+        self._resetRun(numImages, downloadDir, maxretries)
+        self.imageFilter = imageFilter
+        self._nearDupIndex = self._openNearDupIndex(downloadDir)
+        if sync:
+            self._startSync()
 
-        MaxRetries = maxretries
         start = time.time()
         self._queryStrServed = None   # query string returned by website
                                       # (may be collection id)
-        retries = 0
-        # Try until actual number of images downloaded is less than
-        # given number; and retries is less than max retries
-        while self.numDownloaded < self.numImages and retries < MaxRetries:
-            self._runDownload(imgPerThread)
-            retries += 1
+        self.linksPerPage = None
+        # Crawl once; failed images are retried individually by the workers
+        try:
+            self._runDownload(numWorkers)
+        finally:
+            self._endSync()
 
         self.lastDownloadTime = time.time() - start
         self.totalDownloads += self.numDownloaded
@@ -94,163 +160,969 @@ class AlphaDownloader:
                 numDownloaded    = self.numDownloaded,
                 lastDownloadTime = self.lastDownloadTime,
                 numPages         = self.numPages,
+                numAbandoned     = len(self.abandonedLinks),
+                numFiltered      = len(self.filteredLinks),
+                numDeduplicated  = self.numDeduplicated,
+                numNearDuplicates = len(self.nearDuplicateImages),
+                concurrencyLimit = self.limiter.limit if self.limiter
+                                        else numWorkers or self.numWorkers,
                 downloadSize     = self.bytesToMiB(self.downloadSize),
                 totalDownloads   = self.totalDownloads,
                 totalSize        = self.bytesToMiB(self.totalSize),
+                **self.connectionStats(),
         )
 
         if self.trace:
             print('\n', ' Stats: '.center(50, '*'))
             print(self.printFormat % self.sessionDict)
+            for link, (name, reason) in self.abandonedLinks.items():
+                print(f'Abandoned: {link} ({reason})')
+            for filename, (similar, distance, action) in self.nearDuplicateImages.items():
+                print(f'Near duplicate: {filename} of {similar} ({action})')
+            print('\n' + self.metrics.formatTable())
 
-        if retries >= MaxRetries and self.numDownloaded < self.numImages:
-            raise MaxRetriesCrossed("Max Retries; check log for error details")
+        if self._numFinished() < self.numImages:
+            raise self._shortfallError()
 
-    def _downloadSq(self, imgList):
-        " Target Function for threading "
-        for imgname, imglink in imgList:
-            self.downloadImage(imglink, imgname)
+    def _shortfallError(self):
+        """
+        Return the error of a run that finished short of numImages:
+        MaxRetriesCrossed if images were abandoned, else ResultsExhausted
+        (the search results, or the ones passing the filter, ran out)
+        """
+        if self.abandonedLinks:
+            return MaxRetriesCrossed(f"Max Retries; {len(self.abandonedLinks)} images "
+                                     "abandoned, check log for error details")
+        numShort = self.numImages - self._numFinished()
+        if self.filteredLinks:
+            return ResultsExhausted(f"Results ran out {numShort} images short; "
+                                    f"{len(self.filteredLinks)} images filtered out")
+        return ResultsExhausted(f"Results ran out {numShort} images short")
+
+    def _resetRun(self, numImages, downloadDir, maxretries=3):
+        " Reset the attributes for current run "
+        self.downloadDir = downloadDir
+        self.numImages = numImages
+        self.numPages = 0
+        self.numDownloaded = 0
+        self.downloadSize  = 0
+        self.numDeduplicated = 0      # images reused from the dedup index
+        self.nearDuplicateImages = dict()   # filename: (similar filename,
+                                            #   hamming distance, action)
+        self._runImages = set()       # filenames hashed in this run
+        self._inFlight = set()        # filenames being downloaded
+        self._queuedImages = set()    # filenames queued by the crawl
+        self.lastDownloadTime = None
+        self.maxRetries = maxretries
+        self._attempts = dict()       # failed attempts per link
+        self.abandonedLinks = dict()  # link: (name, reason) given up on
+        self.imageFilter = None       # filters.ImageFilter of the run
+        self.filteredLinks = dict()   # link: (name, reason) filtered out
+        self.seenIds = None           # image ids of the previous syncs,
+                                      #   None if not a sync run
+        self._syncedIds = []          # image ids finished in this sync run
+        self._syncComplete = False    # crawled up to a seen image (or the
+                                      #   end, or numImages) without a gap
 
-    def _runDownload(self, ImgPerThread=5):
+    def _runDownload(self, numWorkers=None):
         """
-        Threaded Download Logic;
-        Perform Download assuming every link works, doesn't check if the actual number of download
-        satisfies the required number given
+        Pipelined Download Logic;
+        The crawler stage fetches and parses pages in its own thread,
+        prefetching up to prefetchPages pages ahead, while the fetched links
+        are fed to a fixed number of download workers; assumes every link works,
+        doesn't check if the actual number of download satisfies the required
+        number given
         Not to be invoked directly, use wrapper method startDownload()
 
         """
-        threads  = []
-        imgArg   = []
-        finished = False
-        imgLinksFetched = 0 
-
-        while not finished:
-            self.numPages += 1
-            for imgTuple in self.fetchLinks(self.searchKey, self.numPages):
-                if imgLinksFetched >= self.numImages:
-                    finished = True
-                else:
-                    imgArg.append(imgTuple)
-                # if length becomes equal to image per thread
-                # or image links are fetched but not processed
-                # (not a multiple of imgPerThread)
-                if len(imgArg) == ImgPerThread \
-                        or (finished and imgArg):
-                    downloadLogger.info(f'{len(imgArg) = }')
-                    downloadLogger.debug(f'{imgLinksFetched = }')
+        pageQueue = queue.Queue(maxsize=self.prefetchPages)
+        crawler = threading.Thread(target=self._crawlPages, daemon=True,
+                                   name='wall-do-crawler',
+                                   args=(pageQueue, self.numImages - self.numDownloaded))
+        crawler.start()
+
+        with self._makePool(numWorkers) as self._pool:
+            for imgList in iter(pageQueue.get, None):
+                if isinstance(imgList, Exception):  # crawler failed
+                    raise imgList
+                for record in imgList:
+                    self._pool.submit(record.link, record.name)   # blocks while workers are busy
+        self._pool = None
+        crawler.join()
+
+    def _makePool(self, numWorkers=None, target=None):
+        """
+        Create the download worker pool running target (downloadImage by
+        default); with adaptive concurrency the workers are gated by an
+        AIMD limiter that starts at half of them
+        """
+        numWorkers = numWorkers or self.numWorkers
+        self.limiter = AdaptiveLimiter(numWorkers) if self.adaptive else None
+        # one pooled connection per worker, no handshakes past the pool
+        self.downloadSession.resize(numWorkers, self.crawlWorkers)
+        return WorkerPool(target or self.downloadImage, numWorkers)
+
+    def _crawlPages(self, pageQueue, numLinks):
+        """
+        Crawler stage; the first page is fetched alone as it reveals the
+        served query string and the number of links per page, the rest of
+        the pages needed for numLinks are then fetched concurrently in waves
+        of crawlWorkers pages; the ImageRecord lists that pass the image
+        filter are put in page order on the bounded page queue (blocking
+        when the downloaders fall behind) until numLinks links have been
+        produced or the results run out, past the images already in the
+        download directory; ends the queue with None, or with the exception
+        if the crawl failed;
+        a sync run revalidates every page and stops at the first image
+        seen before, its numImages is cut down to the links produced
+        """
+        linksProduced = 0
+        numOnDisk = 0       # sync run: new images found in the directory
+        pageFailed = False
+        syncing = self.seenIds is not None
+        try:
+            with ThreadPoolExecutor(self.crawlWorkers,
+                                    thread_name_prefix='wall-do-crawler') as executor:
+                wave = self._nextPageWave(numLinks)
+                while wave:
+                    pagesFetched = 0
+                    for imgList in executor.map(self._fetchPage, wave,
+                                                repeat(None), repeat(syncing)):
+                        if imgList is None:     # page failed, already logged
+                            pageFailed = True
+                            continue
+                        if not imgList:         # no more results
+                            wave = None
+                            break
+                        pagesFetched += 1
+                        if syncing:
+                            imgList, onDisk, seenReached = self._unseenImages(imgList)
+                            numOnDisk += onDisk
+                            if seenReached:
+                                wave = None
+                        else:
+                            imgList = self._newImages(imgList)
+                        imgList = self._filterLinks(imgList,
+                                        max(0, numLinks - numOnDisk - linksProduced),
+                                        executor.map)
+                        linksProduced += len(imgList)
+                        if imgList:
+                            pageQueue.put(imgList)
+                        if not wave:
+                            break
+                    downloadLogger.debug(f'{linksProduced = }')
                     downloadLogger.debug(f'{self.numPages = }')
+                    # stop if the whole wave failed
+                    if wave and pagesFetched and linksProduced + numOnDisk < numLinks:
+                        wave = self._nextPageWave(numLinks - numOnDisk - linksProduced)
+                    else:
+                        wave = None
+            if syncing:
+                self.numImages -= numLinks - linksProduced
+                self._syncComplete = not pageFailed
+        except Exception as exc:
+            pageQueue.put(exc)      # re-raised by the consumer
+        else:
+            pageQueue.put(None)
+
+    def _newImages(self, imgList):
+        """
+        Return the records of imgList neither in the download directory
+        (saved by an earlier run) nor already queued by this run; the
+        crawl goes on past the others, so a run into the directory of an
+        earlier one downloads numImages new images
+        """
+        newList = []
+        for record in imgList:
+            imgfilename = self._imagePath(record.link, record.name)
+            if imgfilename in self._queuedImages or os.path.exists(imgfilename):
+                continue
+            self._queuedImages.add(imgfilename)
+            newList.append(record)
+        return newList
+
+    def _filterLinks(self, imgList, linksNeeded, mapper=map):
+        """
+        Return up to linksNeeded records of imgList that pass the image
+        filter; the resolution is checked on the records, the size with
+        HEAD requests (run through mapper) for just the candidates needed;
+        the records past the last one needed are not examined (nor counted
+        as filtered)
+        """
+        if not self.imageFilter:
+            return imgList[:linksNeeded]
+        records = iter(imgList)
+        accepted = []
+        while len(accepted) < linksNeeded:
+            batch = self._filterByResolution(records, linksNeeded - len(accepted))
+            if not batch:
+                break
+            if self.imageFilter.maxBytes is not None:
+                sizes = mapper(self._headSize, [record.link for record in batch])
+                batch = self._filterBySize(batch, sizes)
+            accepted += batch
+        return accepted
+
+    def _filterByResolution(self, records, numWanted):
+        """
+        Return the next numWanted records (or less, if they run out) of
+        the iterator records with an acceptable resolution
+        """
+        accepted = []
+        for record in records:
+            if not self._rejectLink(record, self.imageFilter.rejectResolution(record)):
+                accepted.append(record)
+                if len(accepted) == numWanted:
+                    break
+        return accepted
+
+    def _filterBySize(self, imgList, sizes):
+        " Return the records of imgList whose size (bytes or None) is acceptable "
+        return [record for record, nbytes in zip(imgList, sizes)
+                if not self._rejectLink(record, self.imageFilter.rejectSize(nbytes))]
 
-                    thread = threading.Thread(target=self._downloadSq, args=(imgArg,))
-                    threads.append(thread)
-                    thread.start()
-                    imgArg = []
-                imgLinksFetched += 1
-                if finished: break    # break inner loop if download
-                                      # number satisfied
-        for thread in threads: thread.join()
+    def _rejectLink(self, record, reason):
+        " Record the image as filtered out if there is a reason, return it "
+        if reason:
+            downloadLogger.debug(f'Filtered {record.link}: {reason}')
+            self.metrics.count('filtered', 'image')
+            with self.mutex:
+                self.filteredLinks[record.link] = (record.name, reason)
+        return reason
+
+    def _headSize(self, link):
+        " Return the Content-Length of link from a HEAD request, None if unknown "
+        try:
+            with self.tracer.span('head', 'image', link=link):
+                response = self.downloadSession.head(link, timeout=self.timeout,
+                                                     allow_redirects=True)
+            response.raise_for_status()
+        except Exception as exc:
+            downloadLogger.warning(f'HEAD failed for {link}: {str(exc)}')
+            return None
+        self.metrics.countRequest('head')
+        length = response.headers.get('Content-Length', '')
+        return int(length) if length.isdigit() else None
+
+    def _nextPageWave(self, linksNeeded):
+        """
+        Return the page numbers to fetch next for linksNeeded links and
+        advance numPages past them; a single page until the links per page
+        are known, else just enough pages to cover the links, at most
+        crawlWorkers at a time; a single page in a sync run that may stop
+        at any page
+        """
+        if self.linksPerPage is None or self.seenIds:
+            numPages = 1
+        else:
+            numPages = min(math.ceil(linksNeeded / self.linksPerPage),
+                           self.crawlWorkers)
+        wave = range(self.numPages + 1, self.numPages + numPages + 1)
+        self.numPages += numPages
+        return wave
 
     def downloadImage(self, link, name=''):
-        " download given image link "
-        # Use the trailing id of the image link: ('1149.jpg')
-        # to make the image name truly unique
-        imgfilename = os.path.join(self.downloadDir,
-                            name + '_' + os.path.basename(link))
+        """
+        download given image link, return the saved filename
+        or None if the image was not downloaded
+        """
+        imgfilename = self._imagePath(link, name)
 
         # Abort Download (return) if:
-        # 1) Filename exists,
+        # 1) Filename exists, or another worker is saving it
         if os.path.exists(imgfilename):
             downloadLogger.warning(f'{imgfilename} exists; possible bug')
-            return
+            return None
+        if not self._claimImage(imgfilename):
+            return None
         try:
-            image = self.downloadSession.get(link)
-            image.raise_for_status()
-        # 2) Download error
+            # 2) A copy was downloaded before
+            reused = self._reuseIndexed(link, name, imgfilename)
+            if reused:
+                return reused
+            with self.limiter or nullcontext(), \
+                    self.tracer.span('image transfer', 'image', link=link):
+                imgSize = self._fetchImage(link, imgfilename)
+        # 3) Download error; the part file is kept to resume from
         except Exception as exc:
             downloadLogger.error(f'Error saving image: {link}\n{str(exc)}')
+            self.metrics.countError('image', exc)
+            self._signalCongestion(exc)
+            delay = self._retryDelay(link, name, exc)
+            if delay is not None and self._pool is not None:
+                self._pool.submitLater(delay, link, name)   # re-queue the image
+            return None
+        finally:
+            self._releaseImage(imgfilename)
+
+        # 4) A near duplicate of a better image, deleted
+        if imgSize is None:
+            return None
+
+        self._recordDownload(link, name, imgSize)
+        if self.trace:
+            print(f'Downloaded: {name}...')
+        return imgfilename      # saved filename for subclass
+
+    def _claimImage(self, imgfilename):
+        """
+        Mark imgfilename as being downloaded, return False if it already
+        is (the same image queued twice): the two would share a part file
+        """
+        with self.mutex:
+            if imgfilename in self._inFlight:
+                downloadLogger.warning(f'{imgfilename} already downloading')
+                return False
+            self._inFlight.add(imgfilename)
+            return True
+
+    def _releaseImage(self, imgfilename):
+        with self.mutex:
+            self._inFlight.discard(imgfilename)
+
+    def _fetchImage(self, link, imgfilename):
+        """
+        Transfer the image into its part file (resuming it if possible) and
+        rename it once complete, return the bytes transferred, None if the
+        image was deleted as a near duplicate
+        """
+        offset, rangeHeaders, expected = self._resumeState(imgfilename, link)
+        if offset and offset == expected:   # finished but never renamed
+            digest = self._hashPart(imgfilename, offset)
+            self._finishPart(imgfilename, link, offset, expected)
+            return 0 if self._finishImage(link, imgfilename, offset,
+                                          digest.hexdigest()) else None
+        with self.downloadSession.get(link, stream=True, timeout=self.timeout,
+                                      headers=rangeHeaders) as image:
+            if image.status_code == 416:    # stale part file
+                self._discardPart(imgfilename)
+            image.raise_for_status()
+            imgfile, offset, expected = self._openPart(imgfilename, link,
+                    image.status_code, image.headers, offset)
+            digest = self._hashPart(imgfilename, offset)    # resumed bytes
+            imgSize = 0
+            writeTime = 0.0
+            transferStart = time.perf_counter()
+            with imgfile:
+                for chunk in image.iter_content(self.chunksize):
+                    digest.update(chunk)
+                    writeStart = time.perf_counter()
+                    imgfile.write(chunk)
+                    writeEnd = time.perf_counter()
+                    self.tracer.complete('file write', 'disk', writeStart, writeEnd)
+                    writeTime += writeEnd - writeStart
+                    imgSize += len(chunk)
+            transferTime = time.perf_counter() - transferStart - writeTime
+        finishStart = time.perf_counter()
+        self._finishPart(imgfilename, link, offset + imgSize, expected)
+        finishEnd = time.perf_counter()
+        self.tracer.complete('file rename', 'disk', finishStart, finishEnd)
+        writeTime += finishEnd - finishStart    # rename included
+        kept = self._finishImage(link, imgfilename, offset + imgSize, digest.hexdigest())
+        # elapsed: time from sending the request to parsing the headers
+        ttfb = image.elapsed.total_seconds()
+        self._recordTransfer('image', imgSize, ttfb, transferTime, writeTime)
+        if self.limiter:
+            self.limiter.onSuccess(imgSize, ttfb)
+        return imgSize if kept else None
+
+    def _recordTransfer(self, kind, nbytes, ttfb, transferTime, writeTime=None):
+        " Record the phase timings and the bytes of a completed request "
+        self.metrics.observe('ttfb', kind, ttfb)
+        self.metrics.observe('transfer', kind, transferTime)
+        if writeTime is not None:
+            self.metrics.observe('write', kind, writeTime)
+        self.metrics.countRequest(kind, nbytes)
+
+    def _signalCongestion(self, exc):
+        " Cut the concurrency on throttling (429/503) or a connection reset "
+        if self.limiter is None:
             return
+        response = getattr(exc, 'response', None)
+        status = getattr(response, 'status_code', None) or getattr(exc, 'status', None)
+        if status in (429, 503):
+            self.limiter.onCongestion(f'http {status}')
+        elif status is None and isinstance(exc, self.congestionErrors):
+            self.limiter.onCongestion(type(exc).__name__)
 
-        # save downloaded image (try to delegate os-specific filename
-        # restrictions to underlying platform by encoding filename)
-        with open(imgfilename.encode(), 'wb') as imgfile:
-            for chunk in image.iter_content(self.chunksize):
-                imgfile.write(chunk)
+    def _classifyError(self, exc):
+        """
+        Return (transient, retryAfter) for a download error; timeouts,
+        connection errors and http 408/429/5xx are transient (and 416, the
+        stale part file is discarded by then), other http errors (404...)
+        are permanent; retryAfter is the server requested delay in secs
+        (Retry-After header) or None
+        """
+        response = getattr(exc, 'response', None)
+        status = getattr(response, 'status_code', None) or getattr(exc, 'status', None)
+        if status is None:
+            return isinstance(exc, self.transientErrors), None
+        transient = status in (408, 416, 429) or status >= 500
+        headers = getattr(response, 'headers', None) or getattr(exc, 'headers', None) or {}
+        return transient, self._parseRetryAfter(headers.get('Retry-After'))
 
+    @staticmethod
+    def _parseRetryAfter(value):
+        " Return the Retry-After header (secs or http date) in secs, or None "
+        if not value:
+            return None
+        if value.strip().isdigit():
+            return int(value)
+        try:
+            return max(0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def _retryDelay(self, link, name, exc):
+        """
+        Record a failed attempt of link and return the delay in secs before
+        the next one (jittered exponential backoff, at least Retry-After);
+        return None and mark the link abandoned if the error is permanent
+        or the retries are exhausted
+        """
+        transient, retryAfter = self._classifyError(exc)
         with self.mutex:
-            imgSize = os.path.getsize(imgfilename)
-            self.downloadSize  += imgSize
-            self.totalSize     += imgSize
-            self.numDownloaded += 1
-            self.imageMetaDict[name] = link
+            attempt = self._attempts.get(link, 0) + 1
+            self._attempts[link] = attempt
+            if not transient or attempt > self.maxRetries:
+                reason = str(exc) if transient else f'permanent: {str(exc)}'
+                self.abandonedLinks[link] = (name, reason)
+                downloadLogger.warning(f'Abandoned {link} after {attempt} attempts')
+                return None
+        # full jitter spreads the retries of a throttled burst
+        delay = random.uniform(0, min(self.backoffMax,
+                                      self.backoffBase * 2 ** attempt))
+        if retryAfter is not None:
+            delay = max(delay, min(retryAfter, self.backoffMax))
+        downloadLogger.info(f'Retrying {link} in {delay:.2f} secs ({attempt = })')
+        return delay
 
-        if self.trace:
-            print(f'Downloaded: {name}...')
-        self.imgfilename = imgfilename      # save filename for subclass
-
-    def restoreMetadata(self, imageMetaDict, imgPerThread=5):
-        " Download images from a previously saved name-image dict "
-        imgList = [(name, link) for name, link in imageMetaDict.items()]
-        threads = []
-        while imgList:
-            imgArg, imgList = imgList[:imgPerThread], imgList[imgPerThread:]
-            thread = threading.Thread(target=self._downloadSq, args=(imgArg,))
-            thread.start()
-            threads.append(thread)
-        for thread in threads: thread.join()
-        msgb.showinfo(title='Imported', 
-                      message='Previous session was successfully restored')
-
-    def fetchLinks(self, searchKey, start=1, stop=None, step=1):
-        """
-        Generate the image links for pages start to stop (non-inclusive)
+    # Partial downloads are streamed to '<image>.part' with a sidecar
+    # '<image>.part.json' holding the link, validators (ETag/Last-Modified)
+    # and the expected length; the part is renamed to the image only when
+    # complete, and resumed with a Range request on the next attempt
+    @staticmethod
+    def _partPaths(imgfilename):
+        " Return the part and sidecar filenames for an image "
+        return imgfilename + '.part', imgfilename + '.part.json'
+
+    def _resumeState(self, imgfilename, link):
+        """
+        Return (offset, request headers, expected length) for downloading
+        link; a part file is only resumed if its sidecar was written for the
+        same link, else the download starts from zero
+        """
+        partfilename, metafilename = self._partPaths(imgfilename)
+        try:
+            with open(metafilename) as metafile:
+                partMeta = json.load(metafile)
+            offset = os.path.getsize(partfilename)
+        except (OSError, ValueError):
+            return 0, {}, None
+        if partMeta.get('link') != link or not offset:
+            return 0, {}, None
+
+        rangeHeaders = {'Range': f'bytes={offset}-'}
+        # If-Range makes the server send the whole image if it changed;
+        # weak etags are not allowed there
+        etag = partMeta.get('etag')
+        validator = etag if etag and not etag.startswith('W/') \
+                         else partMeta.get('lastModified')
+        if validator:
+            rangeHeaders['If-Range'] = validator
+        downloadLogger.info(f'Resuming {link} from {offset = }')
+        return offset, rangeHeaders, partMeta.get('length')
+
+    def _openPart(self, imgfilename, link, status, respHeaders, offset):
+        """
+        Open the part file for the response and save its validators in the
+        sidecar; append if the server honoured the range, else start over
+        (server ignored the range or the image changed); a partial response
+        for another range discards the part file and raises
+        ImageDownloadError, the retry starts over without a range;
+        return (fileobject, offset, expected length)
+        """
+        partfilename, metafilename = self._partPaths(imgfilename)
+        contentRange = respHeaders.get('Content-Range', '')
+        rangeMatches = offset and contentRange.startswith(f'bytes {offset}-')
+        if status == 206 and not rangeMatches:
+            # a fragment; its Content-Length is not the image length
+            downloadLogger.warning(f'Unexpected range {contentRange!r} for {link}')
+            self._discardPart(imgfilename)
+            raise ImageDownloadError(link)
+        if status == 206:
+            total = contentRange.rpartition('/')[2]
+            mode = 'ab'
+        else:
+            total = respHeaders.get('Content-Length', '')
+            if respHeaders.get('Content-Encoding', 'identity') != 'identity':
+                total = ''      # length of the encoded body, not the image
+            mode, offset = 'wb', 0
+        expected = int(total) if total.isdigit() else None
+
+        partMeta = dict(link=link,
+                        etag=respHeaders.get('ETag'),
+                        lastModified=respHeaders.get('Last-Modified'),
+                        length=expected)
+        with open(metafilename, 'w') as metafile:
+            json.dump(partMeta, metafile)
+        return open(partfilename, mode), offset, expected
+
+    def _finishPart(self, imgfilename, link, partSize, expected):
+        """
+        Rename the completed part file to the image and remove its sidecar;
+        raise ImageDownloadError (keeping the part) if it is short
+        """
+        partfilename, metafilename = self._partPaths(imgfilename)
+        if expected is not None and partSize != expected:
+            raise ImageDownloadError(link)
+        os.replace(partfilename, imgfilename)
+        os.unlink(metafilename)
+
+    def _hashPart(self, imgfilename, length):
+        " Return a sha256 hash object fed with the first length bytes of the part "
+        digest = hashlib.sha256()
+        if length:
+            with open(self._partPaths(imgfilename)[0], 'rb') as partfile:
+                while length > 0:
+                    chunk = partfile.read(min(self.chunksize, length))
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    length -= len(chunk)
+        return digest
+
+    def _discardPart(self, imgfilename):
+        " Remove the part file and sidecar of an image, if present "
+        for filename in self._partPaths(imgfilename):
+            try:
+                os.unlink(filename)
+            except FileNotFoundError:
+                pass
+
+    def restoreMetadata(self, imageMetaDict, numWorkers=None, downloadDir=None):
+        """
+        Download images from a previously saved name-image dict, or an
+        iterable of (name, link) consumed as the workers take them, into
+        downloadDir or the directory of the last run
+        """
+        downloadDir = downloadDir or self.downloadDir
+        os.makedirs(downloadDir, exist_ok=True)
+        self._resetRun(0, downloadDir, self.maxRetries)
+        self._nearDupIndex = self._openNearDupIndex(downloadDir)
+        with self._makePool(numWorkers) as self._pool:
+            for name, link in self._restoreItems(imageMetaDict):
+                self._pool.submit(link, name)
+        self._pool = None
+
+    def _restoreItems(self, imageMetaDict):
+        " Generate the (name, link) items to restore, counted in numImages "
+        items = imageMetaDict.items() if isinstance(imageMetaDict, dict) \
+                                      else imageMetaDict
+        for name, link in items:
+            self.numImages += 1
+            yield name, link
+
+    def restoreJournal(self, journalPath, numWorkers=None, downloadDir=None,
+                       verifyHash=False):
+        """
+        Download the images of a metadata journal missing from downloadDir
+        (the directory of the journal by default), but the ones removed
+        as near duplicates; an image on disk with another size (or hash,
+        with verifyHash) is downloaded again; the journal is streamed in a
+        single pass, so an image is restored before a later removal line
+        is read, and deleted again once the restore is done
+        """
+        downloadDir = downloadDir or os.path.dirname(os.path.abspath(journalPath))
+        imageStates = dict()    # filename: 'kept', 'queued' or 'removed',
+                                #   by the last line read of the image
+        removedLate = set()     # queued, then removed by a later line
+        def missingImages():
+            for entry in readJournal(journalPath, withRemovals=True):
+                imgfilename = os.path.join(downloadDir, os.path.basename(entry.path))
+                state = imageStates.get(imgfilename)
+                if entry.removed:
+                    if state == 'queued':
+                        removedLate.add(imgfilename)
+                    imageStates[imgfilename] = 'removed'
+                    continue
+                if state in ('kept', 'queued'):     # journaled by several runs
+                    continue
+                if imgfilename in removedLate:      # journaled again after its removal
+                    removedLate.discard(imgfilename)
+                    imageStates[imgfilename] = 'queued'
+                    continue
+                if fileMatches(imgfilename, entry, verifyHash):
+                    imageStates[imgfilename] = 'kept'
+                    continue
+                imageStates[imgfilename] = 'queued'
+                if os.path.exists(imgfilename):
+                    downloadLogger.warning(f'{imgfilename} differs from the journal')
+                    os.unlink(imgfilename)
+                yield entry.name, entry.link
+        self.restoreMetadata(missingImages(), numWorkers, downloadDir)
+        journal = self._openJournal()
+        for imgfilename in removedLate:
+            if os.path.exists(imgfilename):
+                downloadLogger.info(f'{imgfilename} removed by the journal')
+                os.unlink(imgfilename)
+                if journal:
+                    journal.remove(imgfilename)
+
+    def fetchLinks(self, searchKey, start=1, stop=None, step=1, revalidate=False):
+        """
+        Generate the ImageRecord (name, link, width, height) of the images
+        for pages start to stop (non-inclusive)
         Optional: Stop: if not given, scrape links for start page only,
                   Step: default 1, can travel backwards if given negative value
+                  Revalidate: ask the site even if the cached page is fresh
         """
         if stop is None:    # generate links for given page only
             stop = start + 1
         downloadLogger.info(f'{start = }, {stop = }, {step = }')
         for pageNum in range(start, stop, step):
-            # construct page url, if first pass, use base query, else fetched
-            # query string
-            pageInfoDict = dict(searchKey=searchKey, pageNo=pageNum)
-            pageUrl = self._queryStrServed + f'&page={pageNum}' \
-                            if self._queryStrServed \
-                            else self.queryStr % pageInfoDict
-            downloadLogger.info(f'{pageUrl = }')
+            imgList = self._fetchPage(pageNum, searchKey, revalidate)
+            if imgList:
+                yield from imgList
+
+    def _fetchPage(self, pageNum, searchKey=None, revalidate=False):
+        """
+        Fetch and parse a single search page, return its list of
+        ImageRecord or None if the page could not be downloaded;
+        served from the page cache while fresh, else revalidated
+        """
+        pageUrl = self._pageUrl(searchKey or self.searchKey, pageNum)
+        downloadLogger.info(f'{pageUrl = }')
+        imgList, condHeaders = self._cachedPage(pageUrl, revalidate)
+        if imgList is None:
             # fetch page
             try:
-                pageResponse = self.downloadSession.get(pageUrl)
+                requestStart = time.perf_counter()
+                with self.tracer.span('page fetch', 'page', page=pageNum):
+                    pageResponse = self.downloadSession.get(pageUrl, timeout=self.timeout,
+                                                            headers=condHeaders)
                 pageResponse.raise_for_status()
                 downloadLogger.info(f'{pageResponse.status_code = }')
             except Exception as exc:
                 downloadLogger.error(f'Error Downloading Page: {pageNum}\n{str(exc)}')
-                continue
-            # parse and get the image links
-            mainPageSoup = bs4.BeautifulSoup(pageResponse.text, 'lxml')
+                self.metrics.countError('page', exc)
+                return None
+            # the body is read along with the request (not streamed)
+            ttfb = pageResponse.elapsed.total_seconds()
+            self._recordTransfer('page', len(pageResponse.content), ttfb,
+                                 max(0.0, time.perf_counter() - requestStart - ttfb))
+            imgList = self._pageFromResponse(pageUrl, pageResponse.status_code,
+                                    pageResponse.headers, lambda: pageResponse.content)
+        if self.linksPerPage is None and imgList:
+            self.linksPerPage = len(imgList)
+        return imgList
+
+    def _openStore(self, storeClass, filename, description):
+        " Open a sqlite store in cacheDir, None if it cannot be used "
+        return openStore(storeClass, os.path.join(self.cacheDir, filename), description)
+
+    def _startSync(self):
+        """
+        Make the run a sync run of searchKey: load the image ids seen by
+        its previous syncs; a plain run if the sync index cannot be used
+        """
+        if self.syncIndex is None:
+            self.syncIndex = self._openStore(SyncIndex, 'sync.sqlite', 'Sync index')
+        if self.syncIndex:
+            self.seenIds = self.syncIndex.seenIds(self.searchKey)
+            downloadLogger.info(f'Sync {self.searchKey!r}: {len(self.seenIds)} ids seen')
+
+    def _endSync(self):
+        """
+        Record the images finished by a sync run as seen, if all of them
+        were; after a failed page or an abandoned image nothing is
+        recorded, the next sync crawls past the images on disk again
+        rather than stopping short of the ones missed
+        """
+        if self.seenIds is None:
+            return
+        if not self._syncComplete or self._numFinished() < self.numImages:
+            downloadLogger.warning(f'Sync {self.searchKey!r} incomplete, not recorded')
+        elif self._syncedIds:
+            self.syncIndex.addSeen(self.searchKey, self._syncedIds)
+
+    def _unseenImages(self, imgList):
+        """
+        Return the records of a sync run page before the first image seen
+        by the previous syncs, the number of them already in the download
+        directory (recorded as seen, skipped) and whether a seen image
+        was reached
+        """
+        unseen, numOnDisk = [], 0
+        for record in imgList:
+            recordId = imageId(record.link)
+            if recordId in self.seenIds:
+                return unseen, numOnDisk, True
+            if os.path.exists(self._imagePath(record.link, record.name)):
+                numOnDisk += 1
+                with self.mutex:
+                    self._syncedIds.append(recordId)
+            else:
+                unseen.append(record)
+        return unseen, numOnDisk, False
+
+    def _reuseIndexed(self, link, name, imgfilename):
+        """
+        If the image was downloaded before (same image id, file intact),
+        link the copy into imgfilename, or leave it where it is in 'skip'
+        mode, and record the image as done without requesting it;
+        return the filename of the reused copy, None if there is none
+        """
+        indexed = self.dedupIndex and self.dedupIndex.findById(imageId(link))
+        if not indexed:
+            return None
+        if self.dedupMode == 'skip':
+            reused = indexed.path
+        else:
+            try:
+                method = linkFile(indexed.path, imgfilename)
+            except OSError as exc:
+                downloadLogger.warning(f'Cannot reuse {indexed.path}: {str(exc)}')
+                return None
+            self.dedupIndex.add(imgfilename, indexed.imageId, indexed.sha256, indexed.size)
+            downloadLogger.info(f'Reused {indexed.path} for {link} ({method})')
+            reused = imgfilename
+        self.metrics.count('dedupHits', 'image')
+        with self.mutex:
+            self.numDeduplicated += 1
+        self._recordDownload(link, name, 0)
+        self._journalImage(link, reused, indexed.size, indexed.sha256)
+        return reused
+
+    def _finishImage(self, link, imgfilename, imgSize, sha256):
+        """
+        Index and journal an image saved in full (imgSize bytes), unless
+        it was deleted as a near duplicate; return whether it was kept
+        """
+        if self._checkNearDuplicate(imgfilename) is None:
+            return False
+        self._indexImage(link, imgfilename, imgSize, sha256)
+        self._journalImage(link, imgfilename, imgSize, sha256)
+        return True
 
-            # get the served query string (may give a collection id for
-            # selected keywords)
-            if self._queryStrServed is None:
+    def _journalImage(self, link, imgfilename, imgSize, sha256):
+        " Append the image to the journal of the download directory "
+        journal = self._openJournal()
+        if journal:
+            journal.append(self._imageName(link, imgfilename), link,
+                           imgfilename, imgSize, sha256)
+
+    def _openJournal(self):
+        " Return the journal of the download directory, None if disabled "
+        if not self.journalName:
+            return None
+        journalPath = os.path.join(self.downloadDir, self.journalName)
+        with self.mutex:
+            if self.journal is None or self.journal.path != journalPath:
+                if self.journal:
+                    self.journal.close()
                 try:
-                    pageUrl = mainPageSoup.select('div.page_container')[0].get('data-url')
-                except IndexError:
-                    raise SearchReturnedNone("Target Not found") from None
-                self._queryStrServed = pageUrl
-            downloadLogger.debug(f'{pageUrl = }')
-
-            # get the image elements with class='img-responsive'
-            imageTags = mainPageSoup.select('img.img-responsive')
-            downloadLogger.debug(f'{len(imageTags) = }')
-            # generate imagename, imagelink for every image found
-            for imageTag in imageTags:
-                imageName = imageTag.get('alt').rstrip(' HD Wallpaper | Background Image')[:50]
-                # strip unnecessary prefixes (if present)
-                for prefix in self.prefixes:
-                    if imageName.startswith(prefix):
-                        imageName = imageName.lstrip(prefix)
-                        break
+                    self.journal = MetadataJournal(journalPath)
+                except OSError as exc:
+                    downloadLogger.warning(f'Journal disabled: {str(exc)}')
+                    self.journal = None
+            return self.journal
+
+    def _indexImage(self, link, imgfilename, imgSize, sha256):
+        """
+        Add a finished image to the dedup index; if the same content is
+        indexed under another image id, share the data of that copy
+        (when the filesystem can, never copying)
+        """
+        if self.dedupIndex is None:
+            return
+        with self.indexMutex:
+            duplicate = self.dedupIndex.findByHash(sha256)
+            if duplicate and os.path.abspath(imgfilename) != duplicate.path:
+                try:
+                    if linkFile(duplicate.path, imgfilename, copy=False):
+                        downloadLogger.info(f'{imgfilename} has the content of {duplicate.path}')
+                except OSError as exc:
+                    downloadLogger.warning(f'Cannot link {duplicate.path}: {str(exc)}')
+            self.dedupIndex.add(imgfilename, imageId(link), sha256, imgSize)
+
+    def _openNearDupIndex(self, downloadDir):
+        """
+        Return the perceptual hash index seeded with the images already in
+        downloadDir, None if near duplicates are not looked for
+        """
+        if not self.nearDuplicates:
+            return None
+        import phash    # numpy and Pillow, only needed here
+        store = self._openStore(phash.HashStore, 'phash.sqlite', 'Perceptual hash store')
+        index = phash.NearDuplicateIndex(self.nearDupThreshold, store=store)
+        index.addDirectory(downloadDir)
+        return index
+
+    def _checkNearDuplicate(self, imgfilename):
+        """
+        Look the finished image up among the similar looking ones; in 'skip'
+        mode the lower resolution copy is deleted (the earlier image only if
+        downloaded in this run); return the image filename, None if deleted
+        """
+        if self._nearDupIndex is None:
+            return imgfilename
+        from phash import resolution
+        try:
+            with self.tracer.span('perceptual hash', 'image'):
+                hashed, matches = self._nearDupIndex.add(imgfilename)
+        except Exception as exc:
+            downloadLogger.warning(f'Cannot hash {imgfilename}: {str(exc)}')
+            return imgfilename
+        with self.mutex:
+            self._runImages.add(hashed.path)
+        if not matches:
+            return imgfilename
+        distance, similar = max(matches, key=lambda match: resolution(match[1]))
+        action = 'flagged'
+        if self.nearDuplicates == 'skip':
+            if resolution(hashed) <= resolution(similar):
+                removed, action = hashed.path, 'skipped'
+            elif similar.path in self._runImages:
+                # the earlier image of the run, counted and journaled
+                removed, action = similar.path, 'replaced'
+                journal = self._openJournal()
+                if journal:
+                    journal.remove(removed)
+                with self.mutex:
+                    self.numDownloaded -= 1
+            if action != 'flagged':
+                os.unlink(removed)
+                self._nearDupIndex.remove(removed)
+        downloadLogger.info(f'{imgfilename} looks like {similar.path} '
+                            f'({distance = }, {action})')
+        with self.mutex:
+            self.nearDuplicateImages[imgfilename] = (similar.path, distance, action)
+        return None if action == 'skipped' else imgfilename
+
+    def _numFinished(self):
+        " Return the images of the run done: downloaded, or deleted as near duplicates "
+        with self.mutex:
+            return self.numDownloaded + sum(action != 'flagged' for _, _, action
+                                            in self.nearDuplicateImages.values())
+
+    def _cachedPage(self, pageUrl, revalidate=False):
+        """
+        Look up pageUrl in the page cache; return (imgList, None) if the
+        cached page can be used as is, else (None, request headers) with
+        the conditional headers to revalidate a stale cached page
+        """
+        cached = self.pageCache and self.pageCache.get(pageUrl)
+        if not cached:
+            return None, {}
+        if cached.fresh and not revalidate:
+            downloadLogger.debug(f'Page cache hit: {pageUrl}')
+            self._useCachedPage(cached)
+            return cached.imgList, None
+        condHeaders = {}
+        if cached.etag:
+            condHeaders['If-None-Match'] = cached.etag
+        if cached.lastModified:
+            condHeaders['If-Modified-Since'] = cached.lastModified
+        return None, condHeaders
+
+    def _useCachedPage(self, cached):
+        " Take the served query string from a cached page, if not known yet "
+        if self._queryStrServed is None:
+            self._queryStrServed = cached.queryStrServed
+        self.metrics.count('cacheHits', 'page')
+
+    def _pageFromResponse(self, pageUrl, status, respHeaders, getContent):
+        """
+        Return the ImageRecord list of a page response: the cached list
+        if the site answered 304 (None if it is gone), else parse the page
+        bytes (getContent()) and cache the result with its validators
+        """
+        if status == 304:
+            cached = self.pageCache and self.pageCache.get(pageUrl)
+            if not cached:      # evicted meanwhile; fetch it again later
+                return None
+            downloadLogger.debug(f'Page not modified: {pageUrl}')
+            self.pageCache.touch(pageUrl)
+            self._useCachedPage(cached)
+            return cached.imgList
+        pageContent = getContent()
+        with self.metrics.timed('parse', 'page'), \
+                self.tracer.span('parse', 'page', url=pageUrl):
+            imgList = self._parsePage(pageContent)
+        if self.pageCache:
+            self.pageCache.put(pageUrl, imgList, self._queryStrServed,
+                               etag=respHeaders.get('ETag'),
+                               lastModified=respHeaders.get('Last-Modified'))
+        return imgList
+
+    def _pageUrl(self, searchKey, pageNum):
+        """
+        construct page url, if first pass, use base query, else fetched
+        query string
+        """
+        pageInfoDict = dict(searchKey=searchKey, pageNo=pageNum)
+        return self._queryStrServed + f'&page={pageNum}' \
+                    if self._queryStrServed \
+                    else self.queryStr % pageInfoDict
+
+    def _parsePage(self, pageContent):
+        " parse the search page and return a list of ImageRecord "
+        imgList, queryStrServed = extractLinks(pageContent, self.prefixes)
+
+        # get the served query string (may give a collection id for
+        # selected keywords)
+        if self._queryStrServed is None:
+            if queryStrServed is None:
+                raise SearchReturnedNone("Target Not found")
+            self._queryStrServed = queryStrServed
+            downloadLogger.debug(f'{queryStrServed = }')
+        downloadLogger.debug(f'{len(imgList) = }')
+        return imgList
+
+    def _imagePath(self, link, name):
+        """
+        Use the trailing id of the image link: ('1149.jpg')
+        to make the image name truly unique
+        """
+        return os.path.join(self.downloadDir,
+                            name + '_' + os.path.basename(link))
+
+    @staticmethod
+    def _imageName(link, imgfilename):
+        " Return the name an image path was made from (see _imagePath) "
+        basename, suffix = os.path.basename(imgfilename), '_' + os.path.basename(link)
+        return basename[:-len(suffix)] if basename.endswith(suffix) else basename
+
+    def _recordDownload(self, link, name, imgSize):
+        " update the run and session stats for a finished image "
+        with self.mutex:
+            self.downloadSize  += imgSize
+            self.totalSize     += imgSize
+            self.numDownloaded += 1
+            self.imageMetaDict[name] = link
+            if self.seenIds is not None:
+                self._syncedIds.append(imageId(link))
+
+    def connectionStats(self):
+        " Return a dict of new and reused (kept-alive) connection counts "
+        return self.downloadSession.connectionStats()
+
+    def metricsSnapshot(self):
+        """
+        Return the session metrics as a dict: per-phase histograms
+        (connect, ttfb, transfer, write, parse) of pages and images, and
+        the request, byte and error counts (see metrics.Metrics.snapshot)
+        """
+        return self.metrics.snapshot()
 
-                imageLink = imageTag.get('src').replace('thumbbig-', '')
-                yield imageName, imageLink
+    def exportMetrics(self, fmt='json'):
+        " Return the session metrics as 'json' or 'prometheus' text "
+        if fmt == 'prometheus':
+            return self.metrics.toPrometheus()
+        if fmt == 'json':
+            return self.metrics.toJSON(indent=4)
+        raise ValueError(f'Unknown metrics format: {fmt}')
 
     @staticmethod
     def bytesToMiB(sizeInBy):
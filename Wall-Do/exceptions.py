@@ -21,6 +21,9 @@ class InvalidDownloadNum(DownloadError):
 class MaxRetriesCrossed(DownloadError):
     " Maximum retries crossed and still failed to download all images "
 
+class ResultsExhausted(MaxRetriesCrossed):
+    " Search results ran out (after filtering) before all images were downloaded "
+
 class SearchReturnedNone(DownloadError):
     " Website returned none found for given search key "
 
@@ -0,0 +1,90 @@
+"""
+ This module contains the link extraction from the search pages.
+
+ extractLinks works straight on the response bytes with precompiled
+ lxml xpath expressions, without building a BeautifulSoup tree or
+ decoding the page to text first; extractLinksSoup is the BeautifulSoup
+ path it replaced, kept as the reference for the parity check and the
+ benchmark (benchmarks/bench_extractor.py).
+ Every link comes with the resolution shown under its thumbnail
+ (div.thumb-info-big > span 'WxH'), so images can be filtered by
+ resolution before they are requested.
+
+"""
+
+import re
+from collections import namedtuple
+import lxml.etree
+import bs4
+
+ImageRecord = namedtuple('ImageRecord', ['name', 'link', 'width', 'height'],
+                         defaults=(None, None))     # resolution, if shown
+
+def _hasClass(className):
+    " xpath predicate of the tags having className among their classes "
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {className} ')"
+
+def _classXPath(tag, className):
+    " xpath for the tags having className among their classes (css 'tag.class') "
+    return f"//{tag}[{_hasClass(className)}]"
+
+# the site serves utf-8; without a charset declaration libxml2 would
+# take the bytes for latin-1
+_parser = lxml.etree.HTMLParser(encoding='utf-8')
+# compiled once, evaluated on every page
+_findQueryStr = lxml.etree.XPath(_classXPath('div', 'page_container') + '/@data-url')
+_findImages   = lxml.etree.XPath(_classXPath('img', 'img-responsive'))
+# from an image, the first span of the info box of its thumbnail container
+_findResolution = lxml.etree.XPath(
+        f"ancestor::div[{_hasClass('thumb-container-big')}][1]"
+        f"//div[{_hasClass('thumb-info-big')}]/span[1]/text()")
+_resolution = re.compile(r'\s*(\d+)\s*x\s*(\d+)')
+
+def cleanName(alt, prefixes):
+    " Return the image name from the alt text of its thumbnail "
+    imageName = alt.rstrip(' HD Wallpaper | Background Image')[:50]
+    # strip unnecessary prefixes (if present)
+    for prefix in prefixes:
+        if imageName.startswith(prefix):
+            imageName = imageName.lstrip(prefix)
+            break
+    return imageName
+
+def fullLink(src):
+    " Return the full image link from the src of its thumbnail "
+    return src.replace('thumbbig-', '')
+
+def parseResolution(text):
+    " Return (width, height) from a 'WxH' text, (None, None) if it is not one "
+    match = _resolution.match(text or '')
+    return (int(match[1]), int(match[2])) if match else (None, None)
+
+def extractLinks(pageContent, prefixes=()):
+    """
+    Return (imgList, queryStrServed) of a search page given as bytes
+    (utf-8) or text: the list of ImageRecord (name, link, width, height) and the
+    served query string, None if the page has no page container (search
+    returned nothing)
+    """
+    root = lxml.etree.HTML(pageContent, _parser) if pageContent else None
+    if root is None:
+        return [], None
+    queryStrs = _findQueryStr(root)
+    imgList = [ImageRecord(cleanName(imageTag.get('alt', ''), prefixes),
+                           fullLink(imageTag.get('src', '')),
+                           *parseResolution(''.join(_findResolution(imageTag)[:1])))
+               for imageTag in _findImages(root)]
+    return imgList, (str(queryStrs[0]) if queryStrs else None)
+
+def extractLinksSoup(pageText, prefixes=()):
+    " Reference implementation of extractLinks with BeautifulSoup "
+    mainPageSoup = bs4.BeautifulSoup(pageText, 'lxml')
+    containers = mainPageSoup.select('div.page_container')
+    imgList = []
+    for imageTag in mainPageSoup.select('img.img-responsive'):
+        thumbContainer = imageTag.find_parent('div', class_='thumb-container-big')
+        infoSpan = thumbContainer and thumbContainer.select_one('div.thumb-info-big > span')
+        imgList.append(ImageRecord(cleanName(imageTag.get('alt', ''), prefixes),
+                                   fullLink(imageTag.get('src', '')),
+                                   *parseResolution(infoSpan and infoSpan.get_text())))
+    return imgList, (containers[0].get('data-url') if containers else None)
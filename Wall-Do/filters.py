@@ -0,0 +1,62 @@
+"""
+ This module contains the filters applied to the search results.
+
+ The resolution shown on the search page decides the minimum width,
+ height and aspect ratio checks before an image is ever requested; only
+ the maximum size needs the image itself, and is read from the
+ Content-Length of a HEAD request. An image whose resolution is not
+ shown is let through rather than dropped.
+
+"""
+
+class ImageFilter:
+    " Criteria the images must meet to be downloaded; None: any "
+    def __init__(self, minWidth=None, minHeight=None, aspectRatio=None,
+                 aspectTolerance=0.02, maxBytes=None):
+        """
+        aspectRatio: width / height (float, or 'W:H' text),
+        aspectTolerance: allowed relative difference from it
+        """
+        self.minWidth = minWidth
+        self.minHeight = minHeight
+        self.aspectRatio = self.parseAspect(aspectRatio) \
+                                if isinstance(aspectRatio, str) else aspectRatio
+        self.aspectTolerance = aspectTolerance
+        self.maxBytes = maxBytes
+
+    def __bool__(self):
+        return any(criterion is not None for criterion in
+                   (self.minWidth, self.minHeight, self.aspectRatio, self.maxBytes))
+
+    def __repr__(self):
+        return (f'ImageFilter(minWidth={self.minWidth}, minHeight={self.minHeight}, '
+                f'aspectRatio={self.aspectRatio}, maxBytes={self.maxBytes})')
+
+    @staticmethod
+    def parseAspect(text):
+        " Return the ratio of a 'W:H' (or plain number) aspect text "
+        width, sep, height = text.partition(':')
+        try:
+            return float(width) / float(height) if sep else float(width)
+        except (ValueError, ZeroDivisionError):
+            raise ValueError(f'Invalid aspect ratio: {text}') from None
+
+    def rejectResolution(self, record):
+        " Return why the image record is rejected by resolution, None if not "
+        width, height = record.width, record.height
+        if width is None or height is None:
+            return None     # not shown, cannot tell
+        if self.minWidth is not None and width < self.minWidth:
+            return f'width {width} < {self.minWidth}'
+        if self.minHeight is not None and height < self.minHeight:
+            return f'height {height} < {self.minHeight}'
+        if self.aspectRatio is not None and height:
+            if abs(width / height - self.aspectRatio) > self.aspectRatio * self.aspectTolerance:
+                return f'aspect {width}x{height} != {self.aspectRatio:.3f}'
+        return None
+
+    def rejectSize(self, nbytes):
+        " Return why an image of nbytes is rejected, None if not (or unknown) "
+        if self.maxBytes is not None and nbytes is not None and nbytes > self.maxBytes:
+            return f'size {nbytes} > {self.maxBytes} bytes'
+        return None
@@ -6,14 +6,17 @@
 
 # Wildcard imports are fine as this module deals only with
 # tk widgets; use namespaces in the main script
-import sys, os, logging, threading
-from collections import namedtuple
+import sys, os, logging, threading, queue, time
+from collections import namedtuple, OrderedDict
 from tkinter import *
 from tkinter.ttk import *
 from tkinter import messagebox as msgb, filedialog as fldg
 from PIL.ImageTk import Image, PhotoImage
-from exceptions import TopLevelWidgetsOnly
+from exceptions import TopLevelWidgetsOnly, SearchReturnedNone, MaxRetriesCrossed
 from downloader import AlphaDownloader
+from thumbnails import ThumbnailPool, makeThumb
+from thumbcache import ThumbCache
+import pyramid
 from logger import mainlogger
 
 Image.MAX_IMAGE_PIXELS = 1024 * 1024 * 100   # 100 MB max
@@ -41,10 +44,11 @@ class MakeMenu:
     def makeFileMenu(self):
         def quitButton():
             msgb.askyesno(title='Confirmation', 
-                message='Are you sure you want to exit?') and sys.exit(0)
+                message='Are you sure you want to exit?') and self.exitApp()
 
         fileMenu  = Menu(self.menubar, tearoff=False)
         self.menubar.add_cascade(label='File', menu=fileMenu, underline=0)
+        fileMenu.add_command(label='Open Folder', command=self.openFolder, underline=0)
         fileMenu.add_command(label='Import',   command=self.importFile, underline=0)
         fileMenu.add_command(label='Export',   command=self.exportFile, underline=0)
         fileMenu.add_separator()
@@ -56,6 +60,10 @@ class MakeMenu:
         toolMenu.add_command(label='Ping Site', command=self.pingEdit,   underline=0)
         toolMenu.add_command(label='Stop',      command=self.stopEdit,   underline=0)
         toolMenu.add_command(label='Resume',    command=self.resumeEdit, underline=0)
+        toolMenu.add_separator()
+        self.traceVar = BooleanVar(value=False)
+        toolMenu.add_checkbutton(label='Record Trace', variable=self.traceVar,
+                                 command=self.traceEdit, underline=7)
 
     def makeAboutMenu(self):
         self.menubar.add_command(label='About', command=self.aboutDialog, underline=0)
@@ -73,6 +81,9 @@ class MakeMenu:
         msgb.showerror(title='Not Implemented',
                        message='This feature is not yet implemented')
     # Subclass Methods
+    def openFolder(self):
+        self.__notImplemented()
+
     def importFile(self):
         self.__notImplemented()
 
@@ -88,10 +99,16 @@ class MakeMenu:
     def resumeEdit(self):
         self.__notImplemented()
 
+    def traceEdit(self):
+        self.__notImplemented()
+
+    def exitApp(self):
+        sys.exit(0)
+
 # Reusable Frame components
 # Make up the gui input body
 class GuiInput(Frame):
-    fields = ('Directory: ', 'Search Key: ', 'Image Number: ')
+    fields = ('Directory: ', 'Search Key: ', 'Image Number: ', 'Threads: ')
     maxFieldWidth = max(map(len, fields))
     entryWidgetWidth = 30
     padding = dict(
@@ -104,11 +121,13 @@ class GuiInput(Frame):
         self.searchVarPlaceholder = 'Enter Search Key here'
         self.searchVar = StringVar(value=self.searchVarPlaceholder)
         self.numImageVar = IntVar(value=30)
+        self.numWorkersVar = IntVar(value=AlphaDownloader.numWorkers)
 
         self.makeOptionMenu()
         self.makeDirInput()
         self.makeSearchInput()
         self.makeNumImageInput()
+        self.makeNumWorkersInput()
     
     def makeOptionMenu(self):
         optionFrame = Frame(self)
@@ -179,6 +198,16 @@ class GuiInput(Frame):
         Button(numberFrame, text='-', width='2',
             command=numSub).pack(side=LEFT, **self.padding)
 
+    def makeNumWorkersInput(self):
+        workersFrame = Frame(self)
+        workersFrame.pack(expand=True, fill=BOTH)
+
+        Label(workersFrame, text=self.fields[3],
+            width=self.maxFieldWidth).pack(side=LEFT, **self.padding)
+        Spinbox(workersFrame, textvariable=self.numWorkersVar,
+            from_=1, to=64, increment=1,
+            width=self.entryWidgetWidth).pack(side=LEFT, **self.padding)
+
     def getValues(self):
         """
         Fetch the values from the gui fields and perform validation;
@@ -215,12 +244,24 @@ class GuiInput(Frame):
             if imageNum < 0:
                 handleError('Negative Error',
                             'Negative number of images to download is not allowed')
+        # validate number of download threads
+        try:
+            numWorkers = self.numWorkersVar.get()
+        except TclError:
+            handleError('Invalid Input',
+                        'Please enter integer value for number of threads')
+        else:
+            if numWorkers <= 0:
+                handleError('Invalid Threads',
+                            'At least one download thread is required')
 
-        InputField = namedtuple('InputField', ['searchKey', 'dirname', 'imageNum'])
+        InputField = namedtuple('InputField', ['searchKey', 'dirname',
+                                               'imageNum', 'numWorkers'])
         guiLogger.info(f'{invalidField = }')
         return None if invalidField \
                     else InputField(searchKey=searchKey,
-                                dirname=dirname, imageNum=imageNum)
+                                dirname=dirname, imageNum=imageNum,
+                                numWorkers=numWorkers)
 
 # Automatic Scrollbar that hides and returns
 # when associated widget is resized
@@ -239,11 +280,29 @@ class AutoScrollbar(Scrollbar):
        raise (TclError, "Can't use place; only grid")
 
 # Toplevel Widget to display the image in a new window
-# Resize the image to the screen width
+# Fit the image to the screen, zoom into it tile by tile
 class ImageOpener(Toplevel):
+    """
+    Show the image fitted to the screen from a reduced scale decode at
+    once, refined when the full image is decoded in the background;
+    then the wheel (or +/-) zooms through the levels of the image
+    pyramid, of which only the tiles in view are rendered, and dragging
+    pans the image
+    """
+    pollInterval = 30       # ms between checks for the background decode
+
     def __init__(self, parent, imgPath, **kw):
         Toplevel.__init__(self, parent, **kw)
         self.imgPath = imgPath
+        self.screenSize = (self.winfo_screenwidth() - 20, self.winfo_screenheight() - 80)
+        guiLogger.info(f'{self.screenSize = }')
+        self.pyramid = None     # once built
+        self._building = None
+        self.level = None       # pyramid level shown, None: fitted image
+        self.fitPhoto = None
+        self._tileItems = dict()    # (col, row): (canvas item id, photo)
+        self._events = queue.SimpleQueue()
+        self._closed = False
         self.showImage()
         self.focus_set()
         try:
@@ -252,23 +311,14 @@ class ImageOpener(Toplevel):
             self.state('iconic')    # for unix
 
     def showImage(self):
-        " Show the image in fullscreen filling screen "
-        screenWidth, screenHeight = (self.winfo_screenwidth() - 20), (self.winfo_screenheight() - 80)
-        guiLogger.info(f'{screenWidth = }, {screenHeight = }')
-        image = Image.open(self.imgPath)
-        image = image.resize((screenWidth, screenHeight), Image.ANTIALIAS)
-        photo = PhotoImage(image)
-
+        " Create the viewer and start decoding the image in the background "
         yscroll = AutoScrollbar(self)
         xscroll = AutoScrollbar(self, orient='horizontal')
         canv = Canvas(self, yscrollcommand=yscroll.set,
                             xscrollcommand=xscroll.set,
-                            scrollregion=(0, 0, screenWidth, screenHeight))
-        yscroll.config(command=canv.yview)
-        xscroll.config(command=canv.xview)
-        canv.create_image(0, 0, image=photo, anchor=NW)
-        guiLogger.info(f'{photo.width() = }')
-        guiLogger.info(f'{image.width = }')
+                            width=self.screenSize[0], height=self.screenSize[1])
+        yscroll.config(command=lambda *args: self._scroll(canv.yview, args))
+        xscroll.config(command=lambda *args: self._scroll(canv.xview, args))
 
         canv.grid(row=0, column=0, sticky=NSEW)
         yscroll.grid(row=0, column=1, sticky=NS)
@@ -278,7 +328,146 @@ class ImageOpener(Toplevel):
         self.grid_rowconfigure(0, weight=1)
         self.grid_columnconfigure(0, weight=1)
 
-        self.photo = photo  # save from garbage collection
+        canv.bind('<ButtonPress-1>', lambda event: canv.scan_mark(event.x, event.y))
+        canv.bind('<B1-Motion>', self._onDrag)
+        canv.bind('<Configure>', lambda event: self._renderTiles())
+        canv.bind('<MouseWheel>', lambda event: self.zoomBy(1 if event.delta > 0 else -1))
+        canv.bind('<Button-4>', lambda event: self.zoomBy(1))
+        canv.bind('<Button-5>', lambda event: self.zoomBy(-1))
+        self.bind('<plus>', lambda event: self.zoomBy(1))
+        self.bind('<minus>', lambda event: self.zoomBy(-1))
+        self.bind('<Escape>', lambda event: self.close())
+        self.protocol('WM_DELETE_WINDOW', self.close)
+        self.canv = canv
+
+        threading.Thread(target=self._decode, daemon=True,
+                         name='wall-do-viewer').start()
+        self.after(self.pollInterval, self._poll)
+
+    def _decode(self):
+        " Background: post the preview, then build the pyramid and post the refined image "
+        try:
+            image, fullSize = pyramid.preview(self.imgPath, self.screenSize)
+            self._events.put(('fitted', image))
+            imgPyramid = self._building = pyramid.ImagePyramid(self.imgPath,
+                                                               self.screenSize)
+            if self._closed:
+                return imgPyramid.close()
+            self._events.put(('fitted', imgPyramid.build()))
+            self._events.put(('built', imgPyramid))
+        except Exception as exc:
+            if not self._closed:
+                guiLogger.error(f'Error opening image: {self.imgPath}\n{str(exc)}')
+                self._events.put(('error', exc))
+
+    def _poll(self):
+        " Apply the results of the background decode; runs in the tk thread "
+        try:
+            while True:
+                kind, value = self._events.get_nowait()
+                if kind == 'fitted':
+                    self.fitPhoto = PhotoImage(value)
+                    if self.level is None:
+                        self._showFitted()
+                elif kind == 'built':
+                    self.pyramid = value
+                    return
+                elif kind == 'error':
+                    msgb.showerror(title='Cannot Open', message=str(value), parent=self)
+                    return
+        except queue.Empty:
+            pass
+        if not self._closed:
+            self.after(self.pollInterval, self._poll)
+
+    def _showFitted(self):
+        self._clearTiles()
+        self.canv.delete('fitted')
+        self.canv.create_image(0, 0, image=self.fitPhoto, anchor=NW, tags='fitted')
+        self.canv.config(scrollregion=(0, 0, self.fitPhoto.width(), self.fitPhoto.height()))
+
+    def zoomBy(self, steps):
+        """
+        Zoom in (steps > 0) or out by a pyramid level, from the fitted
+        image to the full size one, keeping the center of the view
+        """
+        if self.pyramid is None:    # still decoding
+            return
+        fitLevel = len(self.pyramid.levels) - 1     # no larger than the screen
+        level = fitLevel if self.level is None else self.level
+        level = max(0, min(fitLevel, level - steps))
+        if level == fitLevel:
+            level = None
+        if level == self.level:
+            return
+        # the fraction of the image at the center of the view
+        viewWidth, viewHeight = self.canv.winfo_width(), self.canv.winfo_height()
+        oldWidth, oldHeight = self._shownSize()
+        centerX = self.canv.canvasx(viewWidth / 2) / oldWidth
+        centerY = self.canv.canvasy(viewHeight / 2) / oldHeight
+
+        self.level = level
+        if level is None:
+            self._showFitted()
+        else:
+            self.canv.delete('fitted')
+            self._clearTiles()
+            width, height = self.pyramid.levels[level]
+            self.canv.config(scrollregion=(0, 0, width, height))
+        newWidth, newHeight = self._shownSize()
+        self.canv.xview_moveto(centerX - viewWidth / 2 / newWidth)
+        self.canv.yview_moveto(centerY - viewHeight / 2 / newHeight)
+        self._renderTiles()
+
+    def _shownSize(self):
+        if self.level is None:
+            return self.fitPhoto.width(), self.fitPhoto.height()
+        return self.pyramid.levels[self.level]
+
+    def _scroll(self, view, args):
+        view(*args)
+        self._renderTiles()
+
+    def _onDrag(self, event):
+        self.canv.scan_dragto(event.x, event.y, gain=1)
+        self._renderTiles()
+
+    def _renderTiles(self):
+        " Show the tiles of the current level in view, drop the others "
+        if self.level is None:
+            return
+        tileSize = self.pyramid.tileSize
+        width, height = self.pyramid.levels[self.level]
+        left, top = self.canv.canvasx(0), self.canv.canvasy(0)
+        right = left + self.canv.winfo_width()
+        bottom = top + self.canv.winfo_height()
+        cols = range(max(0, int(left // tileSize)),
+                     min(-(-width // tileSize), int(right // tileSize) + 1))
+        rows = range(max(0, int(top // tileSize)),
+                     min(-(-height // tileSize), int(bottom // tileSize) + 1))
+        for col, row in list(self._tileItems):
+            if col not in cols or row not in rows:
+                self.canv.delete(self._tileItems.pop((col, row))[0])
+        for row in rows:
+            for col in cols:
+                if (col, row) in self._tileItems:
+                    continue
+                photo = PhotoImage(self.pyramid.tile(self.level, col, row))
+                itemId = self.canv.create_image(col * tileSize, row * tileSize,
+                                                image=photo, anchor=NW)
+                self._tileItems[(col, row)] = (itemId, photo)
+
+    def _clearTiles(self):
+        for itemId, photo in self._tileItems.values():
+            self.canv.delete(itemId)
+        self._tileItems.clear()
+
+    def close(self):
+        " Close the window and drop the tiles "
+        self._closed = True
+        if self._building:
+            self._building.close()
+        self.destroy()
 
 """
 GUI oriented Downloader that updates status with tk variables
@@ -286,6 +475,12 @@ Use multiple inheritance for is-a relationships,
 the guidownloader is both a frame and a downloader
 """
 class GuiDownloader(Frame, AlphaDownloader):
+    uiTickInterval = 40         # ms between drains of the ui event queue
+    uiTickBudget   = 0.012      # secs of ui work per tick, the rest waits
+    thumbPadding  = 4           # pixels between the grid cells
+    overscanRows  = 2           # rows rendered above and below the view
+    thumbsInMemory = 512        # decoded thumbnails kept for scrolling back
+
     def __init__(self, parent=None):
         # Base Class Init
         Frame.__init__(self, parent)
@@ -296,29 +491,124 @@ class GuiDownloader(Frame, AlphaDownloader):
         self.progressVar = DoubleVar()
         self.currentVar  = StringVar()
 
+        # only the tk thread touches the widgets; the download threads and
+        # the thumbnail pool post (kind, args) events, drained every tick
+        self.thumbPool = ThumbnailPool(cache=self._openStore(ThumbCache, 'thumbs.sqlite',
+                                                             'Thumbnail cache'))
+        self.uiEvents = queue.SimpleQueue()
+        self._gridChanged = False
+        self.after(self.uiTickInterval, self._uiTick)
+
         self.makeGuiInput()
         self.makeGuiDetails()
         self.makeGuiViewer()
         self.makeDownloadButton()
 
-    def startDownload(self, *args, **kw):
-        self.xoffset = 0    # initialize canvas pixel offsets
-        self.yoffset = 0    # for inserting image buttons
-        self.thumbsaves = []
+    def clearViewer(self):
+        " Remove all the thumbnails from the viewer "
+        self.thumbPaths = []            # grid order
+        self.thumbIndex = dict()        # path: position in the grid
+        self.thumbImages = OrderedDict()    # path: thumbnail, lru
+        self._thumbPending = set()      # paths being made for the grid
+        for itemId, photo in self._cells.values():
+            self._freeCells.append((itemId, photo))
+            self.canv.itemconfigure(itemId, state=HIDDEN)
+        self._cells.clear()
+        self._layoutGrid()
+
+    def showDirectory(self, dirname):
+        """
+        Show the thumbnails of all the images in dirname; the ones not
+        cached are made as their rows come into view
+        """
+        self.clearViewer()
+        for path, thumb in self.thumbPool.loadDirectory(dirname):
+            self.thumbIndex[path] = len(self.thumbPaths)
+            self.thumbPaths.append(path)
+            if thumb and len(self.thumbImages) < self.thumbsInMemory:
+                self._rememberThumb(path, thumb.obj)
+        self._layoutGrid()
+
+    def closeDown(self):
+        " Stop the thumbnail pool on quit, dropping the thumbnails not made yet "
+        self.thumbPool.shutdown(wait=False)
 
-        self.canv.delete(ALL)
-        AlphaDownloader.startDownload(self, *args, **kw)
-        self.sessionVar.set(self.printFormat % self.sessionDict)
-        self.currentVar.set('Finished')
+    def startDownload(self, *args, **kw):
+        " Download in the calling (non tk) thread, reporting through events "
+        self.uiEvents.put(('clear', ()))
+        try:
+            AlphaDownloader.startDownload(self, *args, **kw)
+        except SearchReturnedNone:
+            self.uiEvents.put(('finished', (f'No Images found for {self.searchKey}',)))
+            return
+        except MaxRetriesCrossed as exc:
+            self.uiEvents.put(('finished', (self.printFormat % self.sessionDict
+                                            + f'\n{exc}',)))
+            return
+        self.uiEvents.put(('finished', (self.printFormat % self.sessionDict,)))
 
     def downloadImage(self, link, name=''):
-        AlphaDownloader.downloadImage(self, link, name)
-        with self.mutex:
-            self.currentVar.set(f'Downloaded\n{link}...')
-            self.progressVar.set((self.numDownloaded / self.numImages) * 100)
-            guiLogger.debug(f'{self.numDownloaded = }')
-            # Populate the canvas
-            self.createThumbnailOnCanvas()
+        imgfilename = AlphaDownloader.downloadImage(self, link, name)
+        if imgfilename is None:
+            return None
+        self.uiEvents.put(('progress', (link,)))
+        # Populate the canvas once the thumbnail is made
+        submitted = time.perf_counter()
+        self.thumbPool.submit(imgfilename, lambda thumb:
+                self._postThumb(thumb, True, submitted))
+        return imgfilename
+
+    def _postThumb(self, thumb, append=True, submitted=None):
+        " Post a finished thumbnail to the tk thread; any thread "
+        self.uiEvents.put(('thumb', (thumb, append, submitted)))
+
+    def _uiTick(self):
+        """
+        Apply the posted events in the tk thread, for at most uiTickBudget
+        secs; progress events are merged into a single update and the
+        grid is laid out once for all the thumbnails of the tick; an error
+        is logged and the next tick scheduled all the same
+        """
+        deadline = time.perf_counter() + self.uiTickBudget
+        lastProgress = None
+        try:
+            try:
+                while time.perf_counter() < deadline:
+                    kind, args = self.uiEvents.get_nowait()
+                    if kind == 'progress':
+                        lastProgress = args
+                    elif kind == 'thumb':
+                        self._onThumb(*args)
+                    elif kind == 'clear':
+                        lastProgress = None
+                        self.clearViewer()
+                    elif kind == 'finished':
+                        lastProgress = None
+                        self.sessionVar.set(args[0])
+                        self.currentVar.set('Finished')
+            except queue.Empty:
+                pass
+            if lastProgress:
+                link, = lastProgress
+                self.currentVar.set(f'Downloaded\n{link}...')
+                self.progressVar.set((self.numDownloaded / max(self.numImages, 1)) * 100)
+                guiLogger.debug(f'{self.numDownloaded = }')
+            if self._gridChanged:
+                self._gridChanged = False
+                self._layoutGrid()
+        except Exception:
+            # the event is dropped, the ticks must go on
+            guiLogger.exception('Error applying the ui events')
+        finally:
+            self.after(self.uiTickInterval, self._uiTick)
+
+    def _onThumb(self, thumbTuple, append, submitted):
+        if thumbTuple is None:
+            return
+        if submitted is not None:
+            self.tracer.complete('thumbnail', 'gui', submitted,
+                                 time.perf_counter(), path=thumbTuple.path)
+        self.createThumbnailOnCanvas(thumbTuple, append)
 
     # Downloader Info
     def makeGuiInput(self):
@@ -339,27 +629,156 @@ class GuiDownloader(Frame, AlphaDownloader):
         ).pack()
 
     def makeGuiViewer(self, canvsize=(300,300)):
-        " Create the viewer canvas "
+        """
+        Create the viewer canvas; a virtual grid of thumbnails, only the
+        visible rows (and the overscan) have canvas items, recycled
+        along with their PhotoImage as the view scrolls
+        """
         canvFrame = Frame(self)
         canvFrame.pack(expand=True, fill=BOTH)
         canv = Canvas(canvFrame, bd=2, 
                       width=canvsize[0], 
                       height=canvsize[1], 
                       relief=GROOVE)
-        yscroll = Scrollbar(canvFrame, command=canv.yview)
+        yscroll = Scrollbar(canvFrame, command=self._onScroll)
         canv.config(yscrollcommand=yscroll.set)
 
         yscroll.pack(side=RIGHT, fill=Y)
         canv.pack(side=LEFT, expand=True, fill=BOTH)
 
-        self.idFileDict = dict()    # save button ids and their
-        self.canv = canv            # corresponding image filenames
+        self.canv = canv
         self.canvsize = canvsize
+        thumbWidth, thumbHeight = self.thumbPool.thumbsize
+        self.cellWidth  = thumbWidth  + self.thumbPadding
+        self.cellHeight = thumbHeight + self.thumbPadding
+        self.numColumns = 1
+        self._cells = dict()        # grid position: (canvas item id, photo)
+        self._freeCells = []        # hidden (item id, photo) for reuse
+        self._blankThumb = Image.new('RGB', self.thumbPool.thumbsize, 'gray85')
+
+        canv.bind('<Configure>', lambda event: self._layoutGrid())
+        canv.bind('<Button-1>', self.onLeftClick)
+        canv.bind('<MouseWheel>', lambda event: self._onScroll(
+                                        'scroll', -event.delta // 120, 'units'))
+        canv.bind('<Button-4>', lambda event: self._onScroll('scroll', -1, 'units'))
+        canv.bind('<Button-5>', lambda event: self._onScroll('scroll', 1, 'units'))
+        self.clearViewer()
         self.makeRightClickMenu()
 
+    def _onScroll(self, *args):
+        " Scroll the viewer and render the rows that came into view "
+        self.canv.yview(*args)
+        self._renderVisible()
+
+    def _layoutGrid(self):
+        " Size the grid to the canvas width and the number of thumbnails "
+        width = self.canv.winfo_width()
+        width = width if width > 1 else self.canvsize[0]   # not mapped yet
+        numColumns = max(1, width // self.cellWidth)
+        if numColumns != self.numColumns:
+            self.numColumns = numColumns
+            for index in list(self._cells):      # every cell moves
+                self._releaseCell(index)
+        numRows = -(-len(self.thumbPaths) // self.numColumns)
+        self.canv.config(scrollregion=(0, 0, self.numColumns * self.cellWidth,
+                                       numRows * self.cellHeight),
+                         yscrollincrement=self.cellHeight)
+        self._renderVisible()
+
+    def _visibleRange(self):
+        " Return the grid positions to render: the visible rows and the overscan "
+        top = self.canv.canvasy(0)
+        bottom = top + max(self.canv.winfo_height(), self.canvsize[1])
+        firstRow = max(0, int(top // self.cellHeight) - self.overscanRows)
+        lastRow = int(bottom // self.cellHeight) + 1 + self.overscanRows
+        return range(firstRow * self.numColumns,
+                     min(lastRow * self.numColumns, len(self.thumbPaths)))
+
+    def _renderVisible(self):
+        " Give the grid positions in view a canvas item, free the others "
+        visible = self._visibleRange()
+        for index in [index for index in self._cells if index not in visible]:
+            self._releaseCell(index)
+        for index in visible:
+            if index not in self._cells:
+                self._renderCell(index)
+
+    def _releaseCell(self, index):
+        itemId, photo = self._cells.pop(index)
+        self.canv.itemconfigure(itemId, state=HIDDEN)
+        self._freeCells.append((itemId, photo))
+
+    def _renderCell(self, index):
+        " Show the thumbnail at grid position index, recycling a free cell "
+        row, column = divmod(index, self.numColumns)
+        x, y = column * self.cellWidth, row * self.cellHeight
+        if self._freeCells:
+            itemId, photo = self._freeCells.pop()
+            self.canv.coords(itemId, x, y)
+            self.canv.itemconfigure(itemId, state=NORMAL)
+        else:
+            photo = PhotoImage(self._blankThumb)
+            itemId = self.canv.create_image(x, y, image=photo, anchor=NW)
+        self._cells[index] = (itemId, photo)
+        photo.paste(self._cellImage(self.thumbPaths[index]))
+
+    def _cellImage(self, path):
+        """
+        Return the thumbnail of path padded to the cell size; from memory,
+        else the thumbnail cache, else blank until the pool makes it
+        """
+        thumbObj = self.thumbImages.get(path)
+        if thumbObj is not None:
+            self.thumbImages.move_to_end(path)
+        else:
+            cache = self.thumbPool.cache
+            thumb = cache and cache.get(path, self.thumbPool.thumbsize)
+            if not thumb:
+                if path not in self._thumbPending:
+                    self._thumbPending.add(path)
+                    submitted = time.perf_counter()
+                    self.thumbPool.submit(path, lambda thumb:
+                            self._postThumb(thumb, False, submitted))
+                return self._blankThumb
+            thumbObj = self._rememberThumb(path, thumb.obj)
+        cellImage = self._blankThumb.copy()
+        cellImage.paste(thumbObj, ((cellImage.width - thumbObj.width) // 2,
+                                   (cellImage.height - thumbObj.height) // 2))
+        return cellImage
+
+    def _rememberThumb(self, path, thumbObj):
+        " Keep a decoded thumbnail in memory, dropping the least recently used "
+        thumbObj = thumbObj.convert('RGB')
+        self.thumbImages[path] = thumbObj
+        self.thumbImages.move_to_end(path)
+        while len(self.thumbImages) > self.thumbsInMemory:
+            self.thumbImages.popitem(last=False)
+        return thumbObj
+
+    def _thumbAt(self, x, y):
+        """ 
+        Return the image path of the thumbnail at window position x, y,
+        or None; the grid position follows from the (scrolled) canvas
+        coordinates
+        """
+        canvX, canvY = self.canv.canvasx(x), self.canv.canvasy(y)
+        column, row = int(canvX // self.cellWidth), int(canvY // self.cellHeight)
+        if canvX < 0 or canvY < 0 or column >= self.numColumns:
+            return None
+        index = row * self.numColumns + column
+        return self.thumbPaths[index] if index < len(self.thumbPaths) else None
+
+    def onLeftClick(self, event):
+        " Open the clicked thumbnail's image "
+        imgPath = self._thumbAt(event.x, event.y)
+        if imgPath:
+            ImageOpener(self.canv, imgPath)
+
     def onRightClick(self, event):
         " Right click popup; handler for bind calls "
-        self.rightClickEvent = event
+        self.rightClickPath = self._thumbAt(event.x, event.y)
+        if self.rightClickPath is None:
+            return
         try:
             self.rightClickMenu.tk_popup(event.x_root, event.y_root)
         finally:
@@ -375,62 +794,68 @@ class GuiDownloader(Frame, AlphaDownloader):
                                    command=self.rightDelete)
         rightClickMenu.add_command(label='Delete All', 
                                    command=self.rightDeleteAll)
+        self.rightClickMenu = rightClickMenu
         self.canv.bind('<Button-3>', self.onRightClick)
 
-    def _getButtonId(self, x, y):
-        """ 
-        find the (actual) position of the button relative to the
-        canvas scrollregion-start, not just the viewing region,
-        and return its tk canvas id
-        """
-        return self.canv.find_closest(self.canv.canvasx(x),
-                self.canv.canvasy(y))
-
     def rightDefaultApp(self):
         " Open the image in system native image viewer "
         import webbrowser
-        canvId = self._getButtonId(event.x, event.y)
-        webbrowser.open(self.idFileDict[canvId])
+        webbrowser.open(self.rightClickPath)
 
     def rightDelete(self):
         " Delete the selected image "
-        canvId = self._getButtonId(event.x, event.y)
         # may use send2trash to delete to recycle bin
-        os.unlink(self.idFileDict[canvId])
+        self._deleteImage(self.rightClickPath)
+        self.removeThumbnail(self.rightClickPath)
 
     def rightDeleteAll(self):
-        " Delete the all downloaded images "
-        for filename in self.idFileDict.values():
-            os.unlink(filename)
+        """
+        Delete all the images shown, after confirmation (the grid may
+        show a whole folder opened, not just the downloads)
+        """
+        if not self.thumbPaths or not msgb.askyesno(title='Confirmation',
+                message=f'Delete all the {len(self.thumbPaths)} images shown?'):
+            return
+        for filename in self.thumbPaths:
+            self._deleteImage(filename)
+        self.clearViewer()
 
-    def createThumbnailOnCanvas(self):
-        " Create a thumbnail entry on canvas viewer "
-        thumbTuple = self.makeThumb(self.imgfilename)
-        # create imagebutton
-        thumbPhoto = PhotoImage(thumbTuple.obj)
-        handler = lambda: ImageOpener(self.canv, 
-                          thumbTuple.path).mainloop()
-        imgButtonWidth, imgButtonHeight = thumbTuple.width, thumbTuple.height
-        imgButton = Button(self.canv, command=handler, image=thumbPhoto,
-                    width=imgButtonWidth, cursor='hand2')
-        imgButton.pack(fill=BOTH)
-        buttonID = self.canv.create_window(self.xoffset, self.yoffset, 
-                    window=imgButton, width=imgButtonWidth, 
-                    height=imgButtonHeight, anchor=NW)
-
-        self.idFileDict[buttonID] = thumbTuple.path
-        self.canv.tag_bind(buttonID, '<Button-3>', self.onRightClick)
-        self.thumbsaves.append(thumbPhoto)
-
-        self.xoffset += imgButtonWidth
-        self.canv.config(scrollregion =
-                (0, 0, self.canvsize[0], self.yoffset))
-        # save room for one image button to prevent clipping
-        insertUptoCanvasWidth = self.canvsize[0] - imgButtonWidth
-        if self.xoffset > insertUptoCanvasWidth:        # if width exceeds canvas
-            self.yoffset += imgButtonHeight             # reset col offset and increase
-            guiLogger.debug(f'{self.xoffset = }, {self.yoffset = }') # row offset, increase
-            self.xoffset = 0                            # scrollregion accordingly
+    @staticmethod
+    def _deleteImage(filename):
+        " Delete an image file, already missing is fine "
+        try:
+            os.unlink(filename)
+        except FileNotFoundError:
+            guiLogger.warning(f'{filename} already deleted')
+
+    def removeThumbnail(self, path):
+        " Take the thumbnail of path out of the grid "
+        del self.thumbPaths[self.thumbIndex.pop(path)]
+        self.thumbIndex = {path: index for index, path in enumerate(self.thumbPaths)}
+        self.thumbImages.pop(path, None)
+        for index in list(self._cells):     # positions after it shift
+            self._releaseCell(index)
+        self._layoutGrid()
+
+    def createThumbnailOnCanvas(self, thumbTuple, append=True):
+        """
+        Add a Thumb at the end of the grid, laid out on the next ui tick,
+        or if not append fill in the one already there if in view
+        """
+        path = thumbTuple.path
+        self._thumbPending.discard(path)
+        index = self.thumbIndex.get(path)
+        if index is None:
+            if not append:      # removed from the grid meanwhile
+                return
+            index = self.thumbIndex[path] = len(self.thumbPaths)
+            self.thumbPaths.append(path)
+            self._rememberThumb(path, thumbTuple.obj)
+            self._gridChanged = True
+            return
+        self._rememberThumb(path, thumbTuple.obj)
+        if index in self._cells:
+            self._cells[index][1].paste(self._cellImage(path))
 
     def makeDownloadButton(self):
         " Create the download button for the gui downloader "
@@ -440,47 +865,11 @@ class GuiDownloader(Frame, AlphaDownloader):
                 threading.Thread(
                     target=self.startDownload, 
                     args=(inputs.searchKey,
-                        inputs.imageNum, inputs.dirname)
+                        inputs.imageNum, inputs.dirname),
+                    kwargs=dict(numWorkers=inputs.numWorkers),
                 ).start()
 
         Button(self, text='Start', command=handler).pack(side=BOTTOM)
 
-    @staticmethod
-    def makeThumb(imgPath, thumbsize=(90,60), cachedir='.cache', enableCache=True):
-        """
-        Create thumbnail of the given image path and return
-        a named tuple of (imgpath, imgobj, width, height) resized to given size;
-        thumbsize is a tuple containing (width, height) of thumbnail
-        """
-        Thumb = namedtuple('Thumb', ['path', 'obj', 'width', 'height'])
-
-        cachedir = os.path.join(os.path.dirname(imgPath), cachedir)
-        os.makedirs(cachedir, exist_ok=True)
-        thumbNameSpec = '%(fname)s_thumb%(width)dx%(height)d%(ext)s'
-
-        head, ext = os.path.splitext(os.path.basename(imgPath))
-        thumbname = thumbNameSpec % dict(
-            fname=head, width=thumbsize[0], height=thumbsize[1], ext=ext,
-        )
-        thumbpath = os.path.join(cachedir, thumbname)
-        guiLogger.debug(f'{thumbpath = }')
-
-        # if cache exists
-        if os.path.exists(thumbpath):
-            thumbObj = Image.open(thumbpath)
-        # create cache
-        else:
-            try:
-                thumbObj = Image.open(imgPath)
-                thumbObj.thumbnail(thumbsize, Image.ANTIALIAS)
-                if enableCache:
-                    thumbObj.save(thumbpath)
-            except Exception as exc:
-                guiLogger.error(f'Error creating thumbnail: {imgPath}'
-                                f'\nTraceback Details: {str(exc)}')
-                return None
-        # Path to original file and resized thumbnail image object
-        return Thumb(path=imgPath, obj=thumbObj,
-                     width=thumbObj.width,
-                     height=thumbObj.height)
-
+    # kept on the class for callers of GuiDownloader.makeThumb
+    makeThumb = staticmethod(makeThumb)
@@ -0,0 +1,95 @@
+"""
+ This module contains the metadata journal of the downloads.
+
+ Every finished image is appended to a json lines file in its download
+ directory as soon as it is saved: its name, link, path, size and the
+ sha256 of its content. Nothing is rewritten, so a crash loses at most
+ the line being written, which the reader skips. An image deleted
+ afterwards (replaced by a better near duplicate) gets a removal line.
+ A journal is restored by streaming it line by line into the download
+ workers in a single pass, the images still on disk (same size,
+ optionally same hash) are skipped; an image restored before its
+ removal line is read is deleted again once the restore is done.
+
+"""
+
+import os, json, logging, threading, time, hashlib
+from collections import namedtuple
+from logger import mainlogger
+
+# get module logger
+journalLogger = logging.getLogger('main.journal')
+
+JournalEntry = namedtuple('JournalEntry', ['name', 'link', 'path', 'size', 'sha256',
+                                           'removed'], defaults=(False,))
+
+class MetadataJournal:
+    " Append only json lines journal of the finished images "
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # line buffered: every entry reaches the os once written
+        self._file = open(path, 'a', buffering=1, encoding='utf-8')
+        journalLogger.info(f'{self.path = }')
+
+    def append(self, name, link, path, size, sha256):
+        line = json.dumps(dict(name=name, link=link, path=os.path.abspath(path),
+                               size=size, sha256=sha256, time=round(time.time(), 3)))
+        self._write(line)
+
+    def remove(self, path):
+        " Record the image at path as deleted, not to be restored "
+        self._write(json.dumps(dict(path=os.path.abspath(path), removed=True,
+                                    time=round(time.time(), 3))))
+
+    def _write(self, line):
+        with self._lock:
+            self._file.write(line + '\n')
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+def readJournal(path, withRemovals=False):
+    """
+    Generate the JournalEntry of every line of the journal at path, as
+    long as it was when opened (not the lines appended while reading);
+    lines that cannot be parsed (cut short by a crash) are skipped;
+    withRemovals: generate the removal lines too, in journal order, as
+    entries with removed set and only the path
+    """
+    with open(path, 'rb') as journalFile:
+        journalFile.seek(0, os.SEEK_END)
+        end = journalFile.tell()
+        journalFile.seek(0)
+        offset = 0
+        for lineNum, line in enumerate(journalFile, 1):
+            offset += len(line)
+            if offset > end:
+                break
+            try:
+                entry = json.loads(line)
+                if entry.get('removed'):
+                    if withRemovals:
+                        yield JournalEntry(None, None, entry['path'], None, None, True)
+                    continue
+                yield JournalEntry(entry['name'], entry['link'], entry['path'],
+                                   entry['size'], entry.get('sha256'))
+            except (ValueError, KeyError, TypeError, AttributeError):
+                if line.strip():
+                    journalLogger.warning(f'Skipping bad line {lineNum} of {path}')
+
+def fileMatches(path, entry, verifyHash=False):
+    " Return whether the file at path has the size (and hash) of the entry "
+    try:
+        if os.path.getsize(path) != entry.size:
+            return False
+    except OSError:
+        return False
+    if not verifyHash or not entry.sha256:
+        return True
+    digest = hashlib.sha256()
+    with open(path, 'rb') as imgFile:
+        for chunk in iter(lambda: imgFile.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest() == entry.sha256
@@ -1,15 +1,22 @@
 # Create a master logger
 import logging
 
-logging.basicConfig(level=logging.DEBUG, datefmt='%d/%m/%Y %I:%M:%S %p',
-                    format='%(asctime)s - %(name)s - %(levelname)s - %(lineno)d - %(message)s',
-                    filename='wall-do.log', filemode='w',
-)
+def setupLogging(filename='wall-do.log'):
+    """
+    Log to filename, truncated; called by the main script only, the
+    spawned worker processes (thumbnail pool) import the modules again
+    and would truncate the log of the parent
+    """
+    logging.basicConfig(level=logging.DEBUG, datefmt='%d/%m/%Y %I:%M:%S %p',
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(lineno)d - %(message)s',
+                        filename=filename, filemode='w',
+    )
 
 #logging.disable(logging.CRITICAL)
 
-# disable the connection library logger from urllib module
-logging.getLogger('urllib3.connectionpool').disabled = True
+# keep only the warnings of the connection library from urllib module
+# (a full connection pool means the pools are undersized)
+logging.getLogger('urllib3.connectionpool').setLevel(logging.WARNING)
 # disable logging from Pillow module
 logging.getLogger('PIL.TiffImagePlugin').disabled = True
 logging.getLogger('PIL.PngImagePlugin').disabled = True
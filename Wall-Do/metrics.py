@@ -0,0 +1,195 @@
+"""
+ This module contains the timing and counter metrics of the downloader.
+
+ Every request is split in phases: connect (dns, tcp and tls, only for
+ new connections), ttfb (request sent to response headers), transfer
+ (reading the body), write (disk writes and the final rename) and parse
+ (search pages), each recorded per kind of request (page or image) in a
+ fixed bucket histogram; along with request, byte and error counters by
+ kind and error class. The totals can be exported as json or in the
+ prometheus text format, so a slow run shows if it was bound by the
+ network, the parser or the disk.
+
+"""
+
+import json, time, bisect, threading
+from contextlib import contextmanager
+
+class Histogram:
+    " Fixed bucket histogram of durations in secs "
+    # upper bounds, from sub millisecond parses to slow transfers
+    buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+               0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.buckets) + 1)    # last one: +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """
+        Estimate the q quantile (0 <= q <= 1), interpolating linearly
+        inside the bucket it falls in; None if nothing was observed
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+    def asDict(self):
+        return dict(count=self.count, sum=self.sum, max=self.max,
+                    mean=self.sum / self.count if self.count else None,
+                    p50=self.quantile(0.5), p90=self.quantile(0.9),
+                    p99=self.quantile(0.99),
+                    buckets=dict(zip(map(str, self.buckets + ('+Inf',)),
+                                     self.counts)))
+
+class Metrics:
+    """
+    Thread safe store of phase histograms and counters; a phase is
+    recorded for a kind of request ('page' or 'image'), counters are
+    keyed by name, kind and (for errors) the error class
+    """
+    phases = ('connect', 'ttfb', 'transfer', 'write', 'parse')
+    kinds  = ('page', 'image')
+    # counter: (prometheus name, help)
+    counterHelp = dict(requests=('requests', 'Completed requests'),
+                       bytes=('bytes', 'Body bytes read'),
+                       errors=('errors', 'Failed requests by error class'),
+                       cacheHits=('cache_hits', 'Requests served from the page cache'),
+                       dedupHits=('dedup_hits', 'Images reused from the dedup index'),
+                       filtered=('filtered', 'Images skipped by the image filter'))
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._histograms = dict()   # (phase, kind): Histogram
+            self._counters = dict()     # (name, kind, errorClass): value
+            self.startTime = time.time()
+
+    def observe(self, phase, kind, seconds):
+        " Record seconds spent in phase by a request of kind "
+        with self._lock:
+            histogram = self._histograms.get((phase, kind))
+            if histogram is None:
+                histogram = self._histograms[phase, kind] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timed(self, phase, kind):
+        " Record the time spent in the with block as phase "
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(phase, kind, time.perf_counter() - start)
+
+    def count(self, name, kind, value=1, errorClass=None):
+        " Add value to the counter name of kind "
+        key = (name, kind, errorClass)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def countRequest(self, kind, nbytes=0):
+        " Count a completed request of kind and the body bytes it read "
+        self.count('requests', kind)
+        if nbytes:
+            self.count('bytes', kind, nbytes)
+
+    def countError(self, kind, exc):
+        " Count a failed request of kind by the class of its error "
+        self.count('errors', kind, errorClass=self.errorClass(exc))
+
+    @staticmethod
+    def errorClass(exc):
+        " Return 'http_<status>' for http errors, else the exception name "
+        response = getattr(exc, 'response', None)
+        status = getattr(response, 'status_code', None) or getattr(exc, 'status', None)
+        return f'http_{status}' if status else type(exc).__name__
+
+    def snapshot(self):
+        """
+        Return the metrics as a dict of:
+        phases: {kind: {phase: histogram dict}}, requests, bytes,
+        cacheHits, dedupHits and filtered: {kind: total}, errors: {kind: {error class: total}}
+        """
+        with self._lock:
+            histograms = {key: histogram.asDict()
+                          for key, histogram in self._histograms.items()}
+            counters = dict(self._counters)
+        snapshot = dict(startTime=self.startTime, elapsed=time.time() - self.startTime,
+                        phases={}, requests={}, bytes={}, errors={},
+                        cacheHits={}, dedupHits={}, filtered={})
+        for (phase, kind), histogram in sorted(histograms.items()):
+            snapshot['phases'].setdefault(kind, {})[phase] = histogram
+        for (name, kind, errorClass), value in sorted(counters.items(),
+                                                     key=lambda item: str(item[0])):
+            if name == 'errors':
+                snapshot['errors'].setdefault(kind, {})[errorClass] = value
+            else:
+                snapshot.setdefault(name, {})[kind] = value
+        return snapshot
+
+    def toJSON(self, indent=None):
+        return json.dumps(self.snapshot(), indent=indent)
+
+    def toPrometheus(self, prefix='walldo'):
+        " Return the metrics in the prometheus text exposition format "
+        with self._lock:
+            histograms = {key: (list(histogram.counts), histogram.count, histogram.sum)
+                          for key, histogram in self._histograms.items()}
+            counters = dict(self._counters)
+        lines = [f'# HELP {prefix}_phase_seconds Time spent per request phase',
+                 f'# TYPE {prefix}_phase_seconds histogram']
+        for (phase, kind), (counts, count, total) in sorted(histograms.items()):
+            labels = f'kind="{kind}",phase="{phase}"'
+            cumulative = 0
+            for bound, bucketCount in zip(Histogram.buckets + ('+Inf',), counts):
+                cumulative += bucketCount
+                lines.append(f'{prefix}_phase_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{prefix}_phase_seconds_sum{{{labels}}} {total}')
+            lines.append(f'{prefix}_phase_seconds_count{{{labels}}} {count}')
+        for name, (metricName, helpText) in self.counterHelp.items():
+            metricName = f'{prefix}_{metricName}_total'
+            lines += [f'# HELP {metricName} {helpText}',
+                      f'# TYPE {metricName} counter']
+            for (counterName, kind, errorClass), value in sorted(counters.items(),
+                                                key=lambda item: str(item[0])):
+                if counterName != name:
+                    continue
+                labels = f'kind="{kind}"' + (f',error="{errorClass}"' if errorClass else '')
+                lines.append(f'{metricName}{{{labels}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def formatTable(self):
+        " Return a text table of mean/p50/p99 (ms) per kind and phase "
+        snapshot = self.snapshot()
+        lines = [f'{"":<16}{"count":>8}{"mean":>10}{"p50":>10}{"p99":>10}  (ms)']
+        for kind, phases in snapshot['phases'].items():
+            for phase in self.phases:
+                histogram = phases.get(phase)
+                if histogram:
+                    lines.append(f'{kind + " " + phase:<16}{histogram["count"]:>8}'
+                                 + ''.join(f'{histogram[stat] * 1e3:>10.1f}'
+                                           for stat in ('mean', 'p50', 'p99')))
+        for kind, errors in snapshot['errors'].items():
+            lines.append(f'{kind} errors: ' + ', '.join(f'{errorClass} {value}'
+                                            for errorClass, value in errors.items()))
+        return '\n'.join(lines)
@@ -0,0 +1,96 @@
+"""
+ This module contains the on-disk cache of the search result pages.
+
+ Only what the downloader needs from a page is stored: the image
+ records (name, link, resolution) and the served query string, keyed by
+ the page url, along with the validators (ETag/Last-Modified) of the response.
+ Within the ttl a page is served without any request, after that it is
+ revalidated with a conditional request, so an unchanged page costs a
+ 304 and neither a download nor a parse. The cache is a single sqlite
+ database capped in size, evicting the least recently used pages.
+
+"""
+
+import logging, json, time
+from collections import namedtuple
+from sqlitestore import SqliteStore
+from logger import mainlogger
+from extractor import ImageRecord
+
+# get module logger
+cacheLogger = logging.getLogger('main.pagecache')
+
+CachedPage = namedtuple('CachedPage', ['imgList', 'queryStrServed',
+                                       'etag', 'lastModified', 'fresh'])
+
+class PageCache(SqliteStore):
+    schema = """
+        CREATE TABLE IF NOT EXISTS pages (
+            url          TEXT PRIMARY KEY,
+            data         TEXT NOT NULL,
+            etag         TEXT,
+            lastModified TEXT,
+            fetchedAt    REAL NOT NULL,
+            accessedAt   REAL NOT NULL,
+            size         INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS pagesByAccess ON pages (accessedAt);
+    """
+
+    def __init__(self, path, ttl=6 * 3600, maxBytes=32 * 1024 * 1024):
+        " path: sqlite file, ttl: secs a page is used without revalidation "
+        SqliteStore.__init__(self, path)
+        self.ttl = ttl
+        self.maxBytes = maxBytes
+        self._totalSize = self._db.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM pages').fetchone()[0]
+        cacheLogger.info(f'{self.path = }, {self._totalSize = }')
+
+    def get(self, url):
+        " Return the CachedPage for url or None if not cached "
+        with self._lock:
+            row = self._db.execute('SELECT data, etag, lastModified, fetchedAt '
+                                   'FROM pages WHERE url = ?', (url,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute('UPDATE pages SET accessedAt = ? WHERE url = ?',
+                             (time.time(), url))
+            self._db.commit()
+        data, etag, lastModified, fetchedAt = row
+        data = json.loads(data)
+        return CachedPage(imgList=[ImageRecord(*img) for img in data['imgList']],
+                          queryStrServed=data['queryStrServed'],
+                          etag=etag, lastModified=lastModified,
+                          fresh=time.time() - fetchedAt < self.ttl)
+
+    def put(self, url, imgList, queryStrServed, etag=None, lastModified=None):
+        " Store the parsed page for url, evicting old pages if over the cap "
+        data = json.dumps(dict(imgList=imgList, queryStrServed=queryStrServed))
+        size = len(url) + len(data)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute('SELECT size FROM pages WHERE url = ?',
+                                   (url,)).fetchone()
+            self._db.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (url, data, etag, lastModified, now, now, size))
+            self._totalSize += size - (row[0] if row else 0)
+            self._evict()
+            self._db.commit()
+
+    def touch(self, url):
+        " Mark the page for url fresh again (revalidated by a 304) "
+        with self._lock:
+            self._db.execute('UPDATE pages SET fetchedAt = ? WHERE url = ?',
+                             (time.time(), url))
+            self._db.commit()
+
+    def _evict(self):
+        " Drop the least recently used pages until under the cap; lock held "
+        while self._totalSize > self.maxBytes:
+            row = self._db.execute('SELECT url, size FROM pages '
+                                   'ORDER BY accessedAt LIMIT 1').fetchone()
+            if row is None:
+                break
+            self._db.execute('DELETE FROM pages WHERE url = ?', (row[0],))
+            self._totalSize -= row[1]
+            cacheLogger.debug(f'Evicted {row[0]}')
@@ -0,0 +1,278 @@
+"""
+ This module contains the near-duplicate detection of the downloaded images.
+
+ The same artwork is often uploaded again resized, recompressed or
+ slightly cropped under another image id, which the exact dedup index
+ cannot see. Here every image gets a 64 bit perceptual hash (dHash: the
+ sign of the horizontal gradients of a 9x8 grayscale thumbnail, or
+ pHash: the low DCT frequencies of a 32x32 one), computed with numpy on
+ a reduced size decode (JPEG draft mode, no full resolution decode), and
+ indexed in a multi-index hash table so that the images within a hamming
+ distance are found without comparing every pair; the hashes are kept
+ in sqlite by path, mtime and size so a library is decoded only once.
+
+ Usage: python phash.py DIRECTORY [-t THRESHOLD] [-a dhash|phash]
+ prints the groups of near duplicates, highest resolution first
+
+"""
+
+import os, logging, threading, itertools
+from collections import namedtuple
+import numpy as np
+from PIL import Image
+from sqlitestore import SqliteStore
+from logger import mainlogger
+
+# get module logger
+phashLogger = logging.getLogger('main.phash')
+
+HashedImage = namedtuple('HashedImage', ['path', 'hash', 'width', 'height'])
+imageExtensions = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp')
+
+def _grayThumb(path, size):
+    " Return (grayscale array of size (w, h), original width, height) of an image "
+    with Image.open(path) as image:
+        width, height = image.size
+        # let the jpeg decoder scale down (1/2..1/8) instead of decoding
+        # the full image; no-op for other formats
+        image.draft('L', (size[0] * 4, size[1] * 4))
+        thumb = image.convert('L').resize(size, Image.BILINEAR)
+    return np.asarray(thumb, dtype=np.float32), width, height
+
+def _packBits(bits):
+    " Return the boolean array as an int, first element most significant "
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+
+def dHash(path):
+    " Return (64 bit difference hash, width, height) of an image "
+    pixels, width, height = _grayThumb(path, (9, 8))
+    return _packBits(pixels[:, 1:] > pixels[:, :-1]), width, height
+
+def _dctMatrix(n):
+    " DCT-II basis, the 2d transform of X is D @ X @ D.T "
+    k = np.arange(n)[:, None]
+    basis = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n))
+    basis[0] *= np.sqrt(1 / 2)
+    return basis * np.sqrt(2 / n)
+
+_dct32 = _dctMatrix(32)
+
+def pHash(path):
+    " Return (64 bit DCT hash, width, height) of an image "
+    pixels, width, height = _grayThumb(path, (32, 32))
+    lowFreqs = (_dct32 @ pixels @ _dct32.T)[:8, :8]
+    # the DC term (mean brightness) would dominate the median
+    median = np.median(lowFreqs.ravel()[1:])
+    return _packBits(lowFreqs > median), width, height
+
+hashFunctions = dict(dhash=dHash, phash=pHash)
+
+def hammingDistance(hash1, hash2):
+    return bin(hash1 ^ hash2).count('1')    # int.bit_count needs 3.10
+
+class MultiIndexHash:
+    """
+    Multi-index hash table over hamming distance; the 64 bit hashes are
+    split in 4 chunks of 16 bits, each indexed in its own dict. Two hashes
+    within r bits agree within r // 4 bits on at least one chunk
+    (pigeonhole), so a search looks up only the chunk values that close
+    and verifies the few candidates found; the cost does not grow with
+    the threshold as long as r // 4 stays small
+    """
+    numChunks = 4
+    chunkBits = 16
+
+    def __init__(self):
+        self.tables = [dict() for _ in range(self.numChunks)]
+        self.size = 0
+        self._flipMasks = dict()    # radius: masks of up to radius bits
+
+    def __len__(self):
+        return self.size
+
+    def _chunks(self, imgHash):
+        mask = (1 << self.chunkBits) - 1
+        return [(imgHash >> (index * self.chunkBits)) & mask
+                for index in range(self.numChunks)]
+
+    def _masks(self, radius):
+        masks = self._flipMasks.get(radius)
+        if masks is None:
+            masks = [sum(1 << bit for bit in bits)
+                     for flips in range(radius + 1)
+                     for bits in itertools.combinations(range(self.chunkBits), flips)]
+            self._flipMasks[radius] = masks
+        return masks
+
+    def add(self, imgHash, item):
+        entry = (imgHash, item)
+        for table, chunk in zip(self.tables, self._chunks(imgHash)):
+            table.setdefault(chunk, []).append(entry)
+        self.size += 1
+
+    def search(self, imgHash, maxDistance):
+        " Return [(distance, item)] of the items within maxDistance of imgHash "
+        masks = self._masks(maxDistance // self.numChunks)
+        seen = set()
+        found = []
+        for table, chunk in zip(self.tables, self._chunks(imgHash)):
+            for mask in masks:
+                for entry in table.get(chunk ^ mask, ()):
+                    if id(entry) in seen:
+                        continue
+                    seen.add(id(entry))
+                    distance = hammingDistance(imgHash, entry[0])
+                    if distance <= maxDistance:
+                        found.append((distance, entry[1]))
+        return sorted(found, key=lambda match: match[0])
+
+class HashStore(SqliteStore):
+    " sqlite store of the image hashes by path, valid while mtime and size match "
+    schema = """
+        CREATE TABLE IF NOT EXISTS hashes (
+            path      TEXT NOT NULL,
+            algorithm TEXT NOT NULL,
+            mtime     REAL NOT NULL,
+            size      INTEGER NOT NULL,
+            hash      TEXT NOT NULL,
+            width     INTEGER NOT NULL,
+            height    INTEGER NOT NULL,
+            PRIMARY KEY (path, algorithm)
+        );
+    """
+    useWal = True       # a commit per image hashed
+
+    def load(self, algorithm, directory=None):
+        """
+        Return {path: (mtime, size, HashedImage)} of the stored hashes,
+        of the images under directory if given
+        """
+        query = 'SELECT path, mtime, size, hash, width, height FROM hashes WHERE algorithm = ?'
+        params = [algorithm]
+        if directory:
+            query += " AND path LIKE ? ESCAPE '\\'"
+            prefix = os.path.join(os.path.abspath(directory), '')
+            params.append(prefix.replace('\\', '\\\\').replace('%', '\\%')
+                                .replace('_', '\\_') + '%')
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+        return {path: (mtime, size, HashedImage(path, int(hash, 16), width, height))
+                for path, mtime, size, hash, width, height in rows}
+
+    def put(self, algorithm, stat, hashed):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (hashed.path, algorithm, stat.st_mtime, stat.st_size,
+                              f'{hashed.hash:016x}', hashed.width, hashed.height))
+            self._db.commit()
+
+class NearDuplicateIndex:
+    """
+    Index of the hashed images in a MultiIndexHash; add() returns the
+    indexed images within threshold bits of the new one. Thread safe, the
+    images are hashed outside the lock
+    """
+    def __init__(self, threshold=10, algorithm='dhash', store=None):
+        self.threshold = threshold
+        self.algorithm = algorithm
+        self.hashImage = hashFunctions[algorithm]
+        self.store = store
+        self.index = MultiIndexHash()
+        self._stored = dict()       # path: (mtime, size, HashedImage)
+        self._indexed = set()       # paths in the index
+        self._removed = set()       # paths deleted since (the tables keep them)
+        self._lock = threading.Lock()
+
+    def hash(self, path):
+        " Return the HashedImage of path, from the store if still valid "
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        stored = self._stored.get(path)
+        if stored and stored[:2] == (stat.st_mtime, stat.st_size):
+            return stored[2]
+        hashed = HashedImage(path, *self.hashImage(path))
+        if self.store:
+            self.store.put(self.algorithm, stat, hashed)
+        return hashed
+
+    def add(self, path):
+        " Hash and index the image, return (HashedImage, [(distance, HashedImage)]) "
+        hashed = self.hash(path)
+        with self._lock:
+            matches = [match for match in self.index.search(hashed.hash, self.threshold)
+                       if match[1].path != hashed.path
+                       and match[1].path not in self._removed]
+            if hashed.path not in self._indexed:
+                self.index.add(hashed.hash, hashed)
+                self._indexed.add(hashed.path)
+            self._removed.discard(hashed.path)
+        return hashed, matches
+
+    def remove(self, path):
+        " Leave the image out of the matches from now on "
+        with self._lock:
+            self._removed.add(os.path.abspath(path))
+
+    def addDirectory(self, directory):
+        """
+        Index the images of directory (recursively, skipping the thumbnail
+        caches); return the groups of near duplicates found, each a list
+        of HashedImage sorted by resolution, highest first
+        """
+        if self.store:
+            self._stored.update(self.store.load(self.algorithm, directory))
+        parents = dict()    # union-find over the matched images
+
+        def find(path):
+            while parents.get(path, path) != path:
+                path = parents[path]
+            return path
+
+        members = dict()
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for filename in files:
+                if not filename.lower().endswith(imageExtensions):
+                    continue
+                try:
+                    hashed, matches = self.add(os.path.join(root, filename))
+                except (OSError, ValueError, Image.DecompressionBombError) as exc:
+                    phashLogger.warning(f'Cannot hash {filename}: {str(exc)}')
+                    continue
+                members[hashed.path] = hashed
+                for distance, match in matches:
+                    members[match.path] = match
+                    newRoot, matchRoot = find(hashed.path), find(match.path)
+                    parents.setdefault(matchRoot, matchRoot)
+                    if newRoot != matchRoot:
+                        parents[newRoot] = matchRoot
+        groups = dict()
+        for path in parents:
+            groups.setdefault(find(path), []).append(members[path])
+        return [sorted(group, key=resolution, reverse=True)
+                for group in groups.values()]
+
+def resolution(hashed):
+    return hashed.width * hashed.height
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Find near duplicate images')
+    parser.add_argument('directory',         help='Image library to scan')
+    parser.add_argument('-t', '--threshold', help='Max differing bits of 64', default=10, type=int)
+    parser.add_argument('-a', '--algorithm', help='Perceptual hash', default='dhash',
+                        choices=hashFunctions)
+    args = parser.parse_args()
+
+    from downloader import AlphaDownloader
+    store = HashStore(os.path.join(AlphaDownloader.cacheDir, 'phash.sqlite'))
+    nearDupIndex = NearDuplicateIndex(args.threshold, args.algorithm, store)
+    groups = nearDupIndex.addDirectory(args.directory)
+    for group in groups:
+        print(f'{len(group)} near duplicates:')
+        for hashed in group:
+            print(f'  {hashed.width}x{hashed.height}  {hashed.path}')
+    print(f'{len(nearDupIndex.index)} images, {len(groups)} groups of near duplicates')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+ This module contains the tiled image pyramid of the image viewer.
+
+ A wallpaper is first shown from a reduced scale decode (jpeg draft
+ mode), fitted to the screen. The full image is then decoded once in
+ the background and cut into tiles at every level of the pyramid (full
+ size, half, quarter ... down to the screen size), which are written to
+ a temporary directory as raw pixels, after which the decoded image is
+ dropped. The viewer asks for the tiles in view only and keeps the last
+ used ones in memory, so once the pyramid is built its memory depends
+ on the screen size, not the image size.
+
+"""
+
+import os, logging, tempfile, shutil, threading, weakref
+from collections import OrderedDict
+from PIL import Image
+from logger import mainlogger
+
+Image.MAX_IMAGE_PIXELS = 1024 * 1024 * 100   # 100 MB max
+
+# get module logger
+pyramidLogger = logging.getLogger('main.pyramid')
+
+def fitSize(size, maxSize):
+    " Return size scaled down (or up) to fit maxSize, keeping its aspect "
+    scale = min(maxSize[0] / size[0], maxSize[1] / size[1])
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+def preview(imgPath, maxSize):
+    """
+    Return the image fitted to maxSize from a reduced scale decode, and
+    the size of the full image
+    """
+    image = Image.open(imgPath)
+    fullSize = image.size
+    image.draft('RGB', fitSize(fullSize, maxSize))
+    return image.convert('RGB').resize(fitSize(fullSize, maxSize), Image.BILINEAR), fullSize
+
+class ImagePyramid:
+    tileSize = 256
+    tilesInMemory = 96      # about 18 MiB of rgb tiles
+
+    def __init__(self, imgPath, minSize):
+        """
+        minSize: (width, height) the smallest level must fit in, the
+        screen; call build() to decode the image and cut the tiles
+        """
+        self.imgPath = imgPath
+        self.minSize = minSize
+        self.levels = []        # (width, height) of level 0 (full size), 1 ...
+        self._tileDir = tempfile.mkdtemp(prefix='wall-do-tiles-')
+        # removed on close, when collected, or at exit (the gui quits
+        # with sys.exit, the viewer may never be closed)
+        self._removeTiles = weakref.finalize(self, shutil.rmtree, self._tileDir,
+                                             ignore_errors=True)
+        self._tiles = OrderedDict()     # (level, col, row): image, lru
+        self._lock = threading.Lock()
+
+    def build(self):
+        """
+        Decode the full image and write the tiles of every level; return
+        the full image fitted to minSize, the refined preview
+        """
+        image = Image.open(self.imgPath).convert('RGB')
+        level = 0
+        while True:
+            self._writeTiles(level, image)
+            self.levels.append(image.size)
+            if image.width <= self.minSize[0] and image.height <= self.minSize[1]:
+                break
+            image = image.reduce(2)     # box filter, cheap and good at 2x
+            level += 1
+        pyramidLogger.info(f'{self.imgPath = }, {self.levels = }')
+        return image.resize(fitSize(image.size, self.minSize), Image.LANCZOS)
+
+    def _writeTiles(self, level, image):
+        for row in range(0, -(-image.height // self.tileSize)):
+            for col in range(0, -(-image.width // self.tileSize)):
+                left, top = col * self.tileSize, row * self.tileSize
+                tile = image.crop((left, top, min(left + self.tileSize, image.width),
+                                   min(top + self.tileSize, image.height)))
+                with open(self._tilePath(level, col, row), 'wb') as tileFile:
+                    tileFile.write(tile.tobytes())
+
+    def _tilePath(self, level, col, row):
+        return os.path.join(self._tileDir, f'{level}_{col}_{row}.rgb')
+
+    def tileBox(self, level, col, row):
+        " Return the (left, top, right, bottom) of a tile in its level "
+        width, height = self.levels[level]
+        left, top = col * self.tileSize, row * self.tileSize
+        return left, top, min(left + self.tileSize, width), min(top + self.tileSize, height)
+
+    def tile(self, level, col, row):
+        " Return the tile image at col, row of level "
+        key = (level, col, row)
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is not None:
+                self._tiles.move_to_end(key)
+                return tile
+        left, top, right, bottom = self.tileBox(level, col, row)
+        with open(self._tilePath(level, col, row), 'rb') as tileFile:
+            tile = Image.frombytes('RGB', (right - left, bottom - top), tileFile.read())
+        with self._lock:
+            self._tiles[key] = tile
+            while len(self._tiles) > self.tilesInMemory:
+                self._tiles.popitem(last=False)
+        return tile
+
+    def close(self):
+        " Drop the tiles "
+        with self._lock:
+            self._tiles.clear()
+        self._removeTiles()
@@ -0,0 +1,44 @@
+"""
+ This module contains the base of the sqlite stores of the downloader,
+ the caches and indexes it keeps across runs in its cacheDir.
+
+ A store is a single sqlite file (its directory made if missing) with
+ one connection shared by the threads under the lock of the store. The
+ stores are optional, one that cannot be opened (read only or full
+ disk, corrupt file) is left out with a warning instead of failing the
+ download.
+
+"""
+
+import os, logging, sqlite3, threading
+from logger import mainlogger
+
+# get module logger
+storeLogger = logging.getLogger('main.sqlitestore')
+
+class SqliteStore:
+    schema = ''         # run on open, CREATE ... IF NOT EXISTS statements
+    useWal = False      # write ahead log, for a commit per image or thumbnail
+
+    def __init__(self, path):
+        " path: sqlite file "
+        os.makedirs(os.path.dirname(path) or os.curdir, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()   # connection shared by the threads
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        if self.useWal:     # without a sync on every commit
+            self._db.execute('PRAGMA journal_mode = WAL')
+            self._db.execute('PRAGMA synchronous = NORMAL')
+        self._db.executescript(self.schema)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+def openStore(storeClass, path, description, **kw):
+    " Return storeClass(path, **kw), None if it cannot be opened "
+    try:
+        return storeClass(path, **kw)
+    except (OSError, sqlite3.Error) as exc:
+        storeLogger.warning(f'{description} disabled: {str(exc)}')
+        return None
@@ -0,0 +1,60 @@
+"""
+ This module contains the index of the images seen by the sync runs.
+
+ A sync run downloads only the images added to the results of a search
+ key since its last sync. The search results list the newest images
+ first, so the ids of the images a sync run finished are recorded per
+ search key, and the next sync crawls in site order only until it meets
+ one of them: everything before it is new, everything after it was seen
+ before. Only the most recently seen ids of a key are kept, they are all
+ the crawl ever needs to meet.
+
+"""
+
+import logging, time
+from sqlitestore import SqliteStore
+from logger import mainlogger
+
+# get module logger
+syncLogger = logging.getLogger('main.syncindex')
+
+class SyncIndex(SqliteStore):
+    schema = """
+        CREATE TABLE IF NOT EXISTS seen (
+            searchKey  TEXT NOT NULL,
+            imageId    TEXT NOT NULL,
+            seenAt     REAL NOT NULL,
+            PRIMARY KEY (searchKey, imageId)
+        );
+        CREATE INDEX IF NOT EXISTS seenByKey ON seen (searchKey, seenAt);
+    """
+
+    def __init__(self, path, keepIds=1000):
+        " path: sqlite file, keepIds: ids kept per search key "
+        SqliteStore.__init__(self, path)
+        self.keepIds = keepIds
+        syncLogger.info(f'{self.path = }')
+
+    @staticmethod
+    def _key(searchKey):
+        return ' '.join(searchKey.lower().split())
+
+    def seenIds(self, searchKey):
+        " Return the set of image ids seen by the sync runs of searchKey "
+        with self._lock:
+            rows = self._db.execute('SELECT imageId FROM seen WHERE searchKey = ?',
+                                    (self._key(searchKey),)).fetchall()
+        return {row[0] for row in rows}
+
+    def addSeen(self, searchKey, imageIds):
+        " Record imageIds as seen for searchKey, dropping the oldest over keepIds "
+        searchKey, now = self._key(searchKey), time.time()
+        with self._lock:
+            self._db.executemany('INSERT OR REPLACE INTO seen VALUES (?, ?, ?)',
+                                 ((searchKey, imageId, now) for imageId in imageIds))
+            self._db.execute('DELETE FROM seen WHERE searchKey = ? AND imageId NOT IN '
+                             '(SELECT imageId FROM seen WHERE searchKey = ? '
+                             'ORDER BY seenAt DESC LIMIT ?)',
+                             (searchKey, searchKey, self.keepIds))
+            self._db.commit()
+        syncLogger.debug(f'{searchKey = }, {len(imageIds) = }')
@@ -0,0 +1,162 @@
+"""
+ This module contains the on-disk cache of the gui thumbnails.
+
+ All the thumbnails live in a single sqlite database instead of a file
+ each, stored as raw pixels so a hit costs neither a file open nor an
+ image decode; the database is memory mapped, so reading a thumbnail
+ is a copy out of the page cache. A thumbnail is keyed by the path of
+ its image along with the size and modification time of the file, a
+ changed or replaced image misses and its stale entry is dropped. The
+ cache is capped in size, evicting the least recently used thumbnails,
+ and the thumbnails of a whole directory load with a single query.
+
+"""
+
+import os, logging, time
+from PIL import Image
+from thumbnails import Thumb
+from sqlitestore import SqliteStore
+from logger import mainlogger
+
+# get module logger
+thumbCacheLogger = logging.getLogger('main.thumbcache')
+
+class ThumbCache(SqliteStore):
+    schema = """
+        CREATE TABLE IF NOT EXISTS thumbs (
+            path       TEXT NOT NULL,
+            thumbsize  TEXT NOT NULL,
+            directory  TEXT NOT NULL,
+            mtime      INTEGER NOT NULL,
+            fileSize   INTEGER NOT NULL,
+            mode       TEXT NOT NULL,
+            width      INTEGER NOT NULL,
+            height     INTEGER NOT NULL,
+            pixels     BLOB NOT NULL,
+            accessedAt REAL NOT NULL,
+            PRIMARY KEY (path, thumbsize)
+        );
+        CREATE INDEX IF NOT EXISTS thumbsByDirectory ON thumbs (directory);
+        CREATE INDEX IF NOT EXISTS thumbsByAccess    ON thumbs (accessedAt);
+    """
+    useWal = True       # a commit per thumbnail
+
+    def __init__(self, path, maxBytes=128 * 1024 * 1024):
+        " path: sqlite file, maxBytes: cap of the stored pixels "
+        SqliteStore.__init__(self, path)
+        self.maxBytes = maxBytes
+        self._db.execute(f'PRAGMA mmap_size = {2 * maxBytes}')
+        self._totalSize = self._db.execute(
+                'SELECT COALESCE(SUM(LENGTH(pixels)), 0) FROM thumbs').fetchone()[0]
+        thumbCacheLogger.info(f'{self.path = }, {self._totalSize = }')
+
+    @staticmethod
+    def _key(imgPath, thumbsize):
+        return os.path.abspath(imgPath), '%dx%d' % tuple(thumbsize)
+
+    @staticmethod
+    def _makeThumb(imgPath, row):
+        " Return the Thumb of a (mode, width, height, pixels) row "
+        mode, width, height, pixels = row
+        return Thumb(path=imgPath, obj=Image.frombuffer(mode, (width, height), pixels,
+                                                        'raw', mode, 0, 1),
+                     width=width, height=height)
+
+    def get(self, imgPath, thumbsize, stat=None):
+        """
+        Return the cached Thumb of imgPath or None if not cached or the
+        image changed since; stat: os.stat of imgPath if known
+        """
+        path, thumbsize = self._key(imgPath, thumbsize)
+        try:
+            stat = stat or os.stat(path)
+        except OSError:
+            return None
+        with self._lock:
+            row = self._db.execute('SELECT mtime, fileSize, mode, width, height, pixels '
+                                   'FROM thumbs WHERE path = ? AND thumbsize = ?',
+                                   (path, thumbsize)).fetchone()
+            if row is None:
+                return None
+            if row[:2] != (stat.st_mtime_ns, stat.st_size):
+                self._remove(path)
+                self._db.commit()
+                return None
+            self._db.execute('UPDATE thumbs SET accessedAt = ? WHERE path = ? '
+                             'AND thumbsize = ?', (time.time(), path, thumbsize))
+            self._db.commit()
+        return self._makeThumb(imgPath, row[2:])
+
+    def put(self, thumb, thumbsize, stat=None):
+        " Store a Thumb, evicting old thumbnails if over the cap "
+        path, thumbsize = self._key(thumb.path, thumbsize)
+        try:
+            stat = stat or os.stat(path)
+        except OSError:
+            return
+        image = thumb.obj
+        if image.mode not in ('RGB', 'RGBA', 'L'):
+            image = image.convert('RGB')
+        pixels = image.tobytes()
+        with self._lock:
+            row = self._db.execute('SELECT LENGTH(pixels) FROM thumbs WHERE path = ? '
+                                   'AND thumbsize = ?', (path, thumbsize)).fetchone()
+            self._db.execute('INSERT OR REPLACE INTO thumbs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                             (path, thumbsize, os.path.dirname(path), stat.st_mtime_ns,
+                              stat.st_size, image.mode, image.width, image.height,
+                              pixels, time.time()))
+            self._totalSize += len(pixels) - (row[0] if row else 0)
+            self._evict()
+            self._db.commit()
+
+    def loadDirectory(self, directory, thumbsize):
+        """
+        Return a dict of image path: Thumb of the cached thumbnails of
+        the images in directory that are unchanged; stale ones are dropped
+        """
+        directory = os.path.abspath(directory)
+        try:
+            stats = {entry.path: entry.stat() for entry in os.scandir(directory)
+                     if entry.is_file()}
+        except OSError:
+            return dict()
+        thumbs, stale = dict(), []
+        with self._lock:
+            rows = self._db.execute('SELECT path, mtime, fileSize, mode, width, height, pixels '
+                                    'FROM thumbs WHERE directory = ? AND thumbsize = ?',
+                                    (directory, self._key(directory, thumbsize)[1])).fetchall()
+            for row in rows:
+                stat = stats.get(row[0])
+                if stat is None or row[1:3] != (stat.st_mtime_ns, stat.st_size):
+                    stale.append(row[0])
+                else:
+                    thumbs[row[0]] = self._makeThumb(row[0], row[3:])
+            for path in stale:
+                self._remove(path)
+            self._db.execute('UPDATE thumbs SET accessedAt = ? WHERE directory = ?',
+                             (time.time(), directory))
+            self._db.commit()
+        thumbCacheLogger.debug(f'{directory = }, {len(thumbs) = }, {len(stale) = }')
+        return thumbs
+
+    def _remove(self, path):
+        " Drop the thumbnails of path; lock held "
+        size = self._db.execute('SELECT COALESCE(SUM(LENGTH(pixels)), 0) FROM thumbs '
+                                'WHERE path = ?', (path,)).fetchone()[0]
+        self._db.execute('DELETE FROM thumbs WHERE path = ?', (path,))
+        self._totalSize -= size
+
+    def _evict(self):
+        " Drop the least recently used thumbnails until under the cap; lock held "
+        while self._totalSize > self.maxBytes:
+            rows = self._db.execute('SELECT path, thumbsize, LENGTH(pixels) FROM thumbs '
+                                    'ORDER BY accessedAt LIMIT 64').fetchall()
+            if not rows:
+                break
+            for path, thumbsize, size in rows:
+                self._db.execute('DELETE FROM thumbs WHERE path = ? AND thumbsize = ?',
+                                 (path, thumbsize))
+                self._totalSize -= size
+                if self._totalSize <= self.maxBytes:
+                    break
+            thumbCacheLogger.debug(f'Evicted down to {self._totalSize} bytes')
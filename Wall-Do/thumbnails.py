@@ -0,0 +1,153 @@
+"""
+ This module contains the thumbnail stage of the gui downloader.
+
+ Decoding a wallpaper and scaling it down is cpu bound, so it runs in a
+ pool of worker processes instead of the download threads. Jpegs are
+ decoded at a reduced scale (draft mode lets the decoder skip most of
+ the DCT work for a 1/2, 1/4 or 1/8 sized image), then resized to the
+ thumbnail size. Thumbnails found in the thumbnail cache (thumbcache)
+ skip the pool, new ones are stored there. The finished thumbnails are
+ handed to a callback in a thread of the pool; the gui queues them for
+ its own thread, as only it may touch the tk widgets. The gui submits
+ only the thumbnails coming into view, and on quit the pool drops the
+ ones not started.
+
+"""
+
+import os, logging, multiprocessing, threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from PIL import Image
+from logger import mainlogger
+
+Image.MAX_IMAGE_PIXELS = 1024 * 1024 * 100   # 100 MB max
+
+# get module logger
+thumbLogger = logging.getLogger('main.thumbnails')
+
+imageExtensions = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp')
+
+Thumb = namedtuple('Thumb', ['path', 'obj', 'width', 'height'])
+
+def makeThumb(imgPath, thumbsize=(90,60)):
+    """
+    Create thumbnail of the given image path and return
+    a named tuple of (imgpath, imgobj, width, height) resized to given size,
+    or None if the image cannot be read;
+    thumbsize is a tuple containing (width, height) of thumbnail
+    """
+    try:
+        thumbObj = Image.open(imgPath)
+        thumbObj.draft('RGB', thumbsize)    # reduced scale jpeg decode
+        thumbObj.thumbnail(thumbsize, Image.LANCZOS)
+    except Exception as exc:
+        thumbLogger.error(f'Error creating thumbnail: {imgPath}'
+                          f'\nTraceback Details: {str(exc)}')
+        return None
+    # Path to original file and resized thumbnail image object
+    return Thumb(path=imgPath, obj=thumbObj,
+                 width=thumbObj.width,
+                 height=thumbObj.height)
+
+class ThumbnailPool:
+    """
+    Make thumbnails in worker processes (threads if useProcesses is
+    False), calling back with each Thumb (or None) in a pool thread, or
+    in the caller if it was cached
+    """
+    useProcesses = True
+    numWorkers = max(1, min(4, (os.cpu_count() or 2) - 1))
+
+    def __init__(self, thumbsize=(90,60), cache=None):
+        " cache: thumbcache.ThumbCache or None "
+        self.thumbsize = thumbsize
+        self.cache = cache
+        self._executor = None
+        self._executorLock = threading.Lock()   # submitted from many threads
+        self._pending = set()   # futures not done, cancelled on shutdown
+        self._closed = False
+
+    def _startThumb(self, imgPath):
+        """
+        Submit the thumbnail of imgPath to the pool, started on first use;
+        return the future, None once the pool is shut down
+        """
+        with self._executorLock:
+            if self._closed:
+                return None
+            if self._executor is None:
+                if self.useProcesses:
+                    # spawn: forking a process running tk and download
+                    # threads may copy held locks into the child
+                    self._executor = ProcessPoolExecutor(self.numWorkers,
+                                        mp_context=multiprocessing.get_context('spawn'))
+                else:
+                    self._executor = ThreadPoolExecutor(self.numWorkers,
+                                        thread_name_prefix='wall-do-thumbs')
+                thumbLogger.info(f'{self.numWorkers = }, {self.useProcesses = }')
+            future = self._executor.submit(makeThumb, imgPath, self.thumbsize)
+            self._pending.add(future)
+            return future
+
+    def submit(self, imgPath, callback):
+        """
+        Make the thumbnail of imgPath in the pool, then call callback(thumb);
+        return the future, or None if the thumbnail was cached (or the
+        pool shut down)
+        """
+        try:
+            stat = os.stat(imgPath)
+        except OSError:
+            stat = None
+        thumb = self.cache and stat and self.cache.get(imgPath, self.thumbsize, stat)
+        if thumb:
+            callback(thumb)
+            return None
+
+        def onDone(future):
+            with self._executorLock:
+                self._pending.discard(future)
+            if future.cancelled():      # shut down
+                return
+            try:
+                thumb = future.result()
+            except Exception as exc:     # worker died, pool broken
+                thumbLogger.error(f'Thumbnail worker failed: {imgPath}\n{str(exc)}')
+                thumb = None
+            if thumb and self.cache and stat:
+                self.cache.put(thumb, self.thumbsize, stat)
+            callback(thumb)
+        future = self._startThumb(imgPath)
+        if future:
+            future.add_done_callback(onDone)
+        return future
+
+    def loadDirectory(self, directory):
+        """
+        Return the images of directory in name order, as a list of
+        (path, cached Thumb or None); nothing is submitted, the missing
+        thumbnails are made as they are needed
+        """
+        cached = self.cache.loadDirectory(directory, self.thumbsize) if self.cache else {}
+        try:
+            entries = sorted(entry.path for entry in os.scandir(directory)
+                             if entry.is_file() and entry.name.lower().endswith(imageExtensions))
+        except OSError as exc:
+            thumbLogger.error(f'Cannot list {directory}: {str(exc)}')
+            return []
+        images = []
+        for imgPath in entries:
+            thumb = cached.get(os.path.abspath(imgPath))
+            images.append((imgPath, thumb and thumb._replace(path=imgPath)))
+        return images
+
+    def shutdown(self, wait=True):
+        " Stop the pool, cancelling the thumbnails not started "
+        with self._executorLock:
+            self._closed = True
+            executor, self._executor = self._executor, None
+            pending, self._pending = self._pending, set()
+        for future in pending:      # cancel_futures needs Python 3.9
+            future.cancel()
+        if executor is not None:
+            executor.shutdown(wait=wait)
@@ -0,0 +1,130 @@
+"""
+ This module contains the trace recorder of the downloader.
+
+ A Tracer records spans (page fetch, parse, image transfer, file write,
+ thumbnail, waits for the download mutex) per thread and saves them in
+ the Chrome trace-event json format, to be opened in chrome://tracing
+ or https://ui.perfetto.dev as a timeline of what every worker was
+ doing. Coroutines of the async engine get a row per task, as their
+ spans interleave on the single loop thread. A disabled tracer records
+ nothing and costs a flag check per span.
+
+"""
+
+import os, json, time, asyncio, threading, itertools, weakref
+from contextlib import contextmanager, nullcontext
+
+class Tracer:
+    def __init__(self, enabled=False):
+        self._lock = threading.Lock()
+        self.enabled = False
+        if enabled:
+            self.start()
+
+    def start(self):
+        " Drop the recorded events and start recording "
+        with self._lock:
+            self._events = []
+            self._threadNames = dict()      # tid: name
+            self._taskIds = weakref.WeakKeyDictionary()    # asyncio task: tid
+            self._nextTaskId = itertools.count(1)
+            self._origin = time.perf_counter()
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    def _tid(self):
+        " Return the row of the caller: its asyncio task if any, else its thread "
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:    # no running loop
+            task = None
+        if task is None:
+            thread = threading.current_thread()
+            tid = thread.ident
+            if tid not in self._threadNames:
+                self._threadNames[tid] = thread.name
+            return tid
+        tid = self._taskIds.get(task)
+        if tid is None:
+            # above any thread id; rows sorted after the threads
+            tid = self._taskIds[task] = 1 << 48 | next(self._nextTaskId)
+            self._threadNames[tid] = f'task {tid & 0xffffffff}'
+        return tid
+
+    def complete(self, name, cat, start, end, **args):
+        """
+        Record a span from start to end (time.perf_counter values) on the
+        row of the caller
+        """
+        if not self.enabled:
+            return
+        event = dict(name=name, cat=cat, ph='X', pid=os.getpid(), tid=self._tid(),
+                     ts=(start - self._origin) * 1e6, dur=(end - start) * 1e6)
+        if args:
+            event['args'] = args
+        self._events.append(event)      # atomic, no lock needed
+
+    def span(self, name, cat, **args):
+        " Return a context manager recording the time spent in its block "
+        if not self.enabled:
+            return nullcontext()
+        return self._span(name, cat, args)
+
+    @contextmanager
+    def _span(self, name, cat, args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.complete(name, cat, start, time.perf_counter(), **args)
+
+    def events(self):
+        " Return the recorded events, with the thread name metadata events "
+        pid = os.getpid()
+        with self._lock:
+            events = list(self._events)
+            threadNames = dict(self._threadNames)
+        metadata = [dict(name='process_name', ph='M', pid=pid,
+                         args=dict(name='wall-do'))]
+        metadata += [dict(name='thread_name', ph='M', pid=pid, tid=tid,
+                          args=dict(name=threadName))
+                     for tid, threadName in threadNames.items()]
+        return metadata + events
+
+    def save(self, filename):
+        " Save the recorded events as a Chrome trace-event json file "
+        with open(filename, 'w') as traceFile:
+            json.dump(dict(traceEvents=self.events(), displayTimeUnit='ms'),
+                      traceFile)
+
+class TracedLock:
+    """
+    threading.Lock recording the time spent waiting to acquire it
+    as 'lock wait' spans of the tracer
+    """
+    def __init__(self, tracer, name='mutex'):
+        self._lock = threading.Lock()
+        self.tracer = tracer
+        self.name = name
+
+    def acquire(self, blocking=True, timeout=-1):
+        if not self.tracer.enabled:
+            return self._lock.acquire(blocking, timeout)
+        start = time.perf_counter()
+        acquired = self._lock.acquire(blocking, timeout)
+        self.tracer.complete('lock wait', 'lock', start, time.perf_counter(),
+                             lock=self.name)
+        return acquired
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    __enter__ = acquire
+
+    def __exit__(self, *excinfo):
+        self._lock.release()
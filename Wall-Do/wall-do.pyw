@@ -8,9 +8,11 @@ from tkinter import ttk
 from tkinter import messagebox as msgb, filedialog as fldg
 from gui_components import MakeMenu, GuiDownloader
 from downloader import AlphaDownloader
-from exceptions import SearchReturnedNone
+from filters import ImageFilter
+from batch import BatchDownloader, makeQuery, readBatchFile
+from exceptions import SearchReturnedNone, MaxRetriesCrossed
 
-from logger import mainlogger
+from logger import mainlogger, setupLogging
 walldologger = logging.getLogger('main.walldo')
 walldologger.info('Entry Point: Wall-Do')
 
@@ -23,17 +25,38 @@ class MakeMenuHandlers(MakeMenu):
     def config(downloader):
         self.downloaderObj = downloader
 
+    def exitApp(self):
+        " Stop the downloader's thumbnail pool and exit "
+        self.downloaderObj.closeDown()
+        MakeMenu.exitApp(self)
+
+    def openFolder(self):
+        " Show the thumbnails of the images in a folder chosen by the user "
+        dirname = fldg.askdirectory(title='Open Folder', mustexist=True)
+        if dirname:
+            self.downloaderObj.showDirectory(os.path.normpath(dirname))
+
     def importFile(self):
         """
-        Get a json filename from the user and save a dict of image names
-        and links to self dict reference if entered
+        Get a json filename from the user and restore the dict of image
+        names and links in it in the background; a metadata journal
+        (.jsonl) of a download directory is streamed in the background,
+        restoring the images missing from it
         """
         imgMetaFile = fldg.askopenfile(title='Enter Import Data',
                                        filetypes=(('JSON Metadata', '*.json'),
+                                                  ('Metadata Journal', '*.jsonl'),
                                                   ('All', '*')))
         if not imgMetaFile:
             msgb.showerror(title='No Files Imported', 
                            message='Please enter metadata from a previous run')
+        elif imgMetaFile.name.endswith('.jsonl'):
+            imgMetaFile.close()
+            threading.Thread(target=self.downloaderObj.restoreJournal,
+                             args=(imgMetaFile.name,), daemon=True).start()
+            msgb.showinfo(title='Importing',
+                          message='Restoring the images missing from '
+                                  f'{os.path.dirname(imgMetaFile.name)}')
         else:
             try:
                 imageMetaDict = json.load(imgMetaFile)
@@ -41,7 +64,10 @@ class MakeMenuHandlers(MakeMenu):
                 msgb.showerror(title='Invalid File',
                                message='Parse Error, is it a valid json file?')
             else:
-                self.downloaderObj.restoreMetadata(imageMetaDict)
+                threading.Thread(target=self.downloaderObj.restoreMetadata,
+                                 args=(imageMetaDict,), daemon=True).start()
+                msgb.showinfo(title='Importing',
+                              message='Restoring the images of the previous session')
 
 
     def exportFile(self):
@@ -58,27 +84,162 @@ class MakeMenuHandlers(MakeMenu):
     def pingEdit(self):
         " Ping the site for links for a single page and return status "
         startTime = time.perf_counter_ns()
-        self.downloaderObj.fetchLinks('iron man', 1)  # ping for generic search term
+        # ping for generic search term; always ask the site, a cached
+        # page only saves the parse (304)
+        list(self.downloaderObj.fetchLinks('iron man', 1, revalidate=True))
         msgb.showinfo(title='Ping', message='Website pinged in '
                       f'{time.perf_counter_ns() - startTime} ns')
 
+    def traceEdit(self):
+        """
+        Start recording a trace of the downloads when checked, save it
+        as a Chrome trace-event file when unchecked
+        """
+        tracer = self.downloaderObj.tracer
+        if self.traceVar.get():
+            tracer.start()
+            return
+        tracer.stop()
+        traceFile = fldg.asksaveasfilename(defaultextension='.json',
+                initialfile='wall-do-trace.json',
+                filetypes=(('Chrome Trace', '*.json'), ('All', '*')))
+        if traceFile:
+            tracer.save(traceFile)
+            msgb.showinfo(title='Success', message=f"Saved trace as '{traceFile}'\n"
+                          'open it in chrome://tracing or ui.perfetto.dev')
+
 def interactive():
     """
     Handle commandline arguments if invoked as commandline tool
     """
     import argparse
     parser = argparse.ArgumentParser()
-    parser.add_argument('searchKey',           help='Search String')
+    parser.add_argument('searchKeys',          help='Search String(s); more than one runs a batch',
+                        nargs='*', metavar='searchKey')
+    parser.add_argument('-b', '--batch',       help="Batch file, a line per search key: "
+                        "'search key[, number[, directory]]'", type=argparse.FileType('r'),
+                        default=None)
+    parser.add_argument('--restore',           help='Download the images of a metadata journal '
+                        '(wall-do.jsonl) missing from its directory (or --downloadDir)',
+                        metavar='JOURNAL', default=None)
+    parser.add_argument('--verify',            help='With --restore: also check the sha256 of '
+                        'the images on disk', action='store_true')
     parser.add_argument('-n', '--number',      help='Number of wallpapers to download', default=30, type=int)
-    parser.add_argument('-t', '--threads',     help='Number of images per thread',      default=5,  type=int)
-    parser.add_argument('-d', '--downloadDir', help='Save Directory',                   default=None)
+    parser.add_argument('-s', '--sync',        help='Only download the wallpapers new since the last '
+                        '--sync of the search key(s), up to --number', action='store_true')
+    parser.add_argument('-t', '--threads',     help='Number of concurrent downloads',   default=None, type=int)
+    parser.add_argument('-d', '--downloadDir', help='Save Directory (parent directory of '
+                        'the search keys in a batch)',                                    default=None)
+    parser.add_argument('-r', '--retries',     help='Retries per failed image',         default=3,    type=int)
+    parser.add_argument('-e', '--engine',      help='Download engine',                  default='threads',
+                        choices=('threads', 'async'))
+    parser.add_argument('--no-adaptive',       help='Always run --threads transfers, do not adapt to the server',
+                        dest='adaptive', action='store_false')
+    parser.add_argument('--no-cache',          help='Do not use the search page cache',
+                        dest='pageCache', action='store_false')
+    parser.add_argument('--dedup',             help='Images downloaded before: link them into the '
+                        'directory, skip them, or download them again (off)', default='link',
+                        choices=('link', 'skip', 'off'))
+    parser.add_argument('--near-duplicates',   help='Flag images looking like one already downloaded, '
+                        'or skip them keeping the highest resolution copy', default=None,
+                        choices=('flag', 'skip'))
+    parser.add_argument('--near-threshold',    help='Max differing bits (of 64) of near duplicates',
+                        default=AlphaDownloader.nearDupThreshold, type=int)
+    parser.add_argument('--min-width',         help='Skip images narrower than this', default=None, type=int)
+    parser.add_argument('--min-height',        help='Skip images shorter than this',  default=None, type=int)
+    parser.add_argument('--aspect',            help="Only download images of this aspect ratio ('16:9')",
+                        default=None)
+    parser.add_argument('--max-size',          help='Skip images larger than this (MiB)', default=None, type=float)
+    parser.add_argument('--metrics-out',       help='Save the timing metrics as json '
+                        '(prometheus text if the name ends with .prom)', default=None)
+    parser.add_argument('--trace-out',         help='Save a Chrome trace-event timeline of the run',
+                        default=None)
+    parser.add_argument('--profile',           help='Save a cProfile dump of the run (main thread, '
+                        'the whole run with --engine async)', default=None)
 
     args = parser.parse_args()
-    downloadDir = args.search if args.downloadDir is None else args.downloadDir
+    if args.threads is not None and args.threads <= 0:
+        parser.error('number of threads must be positive')
+    queries = None
+    if args.restore:
+        if args.batch or args.searchKeys or args.sync:
+            parser.error('--restore takes no search keys, batch or --sync')
+        if not os.path.isfile(args.restore):
+            parser.error(f'no journal {args.restore}')
+    elif args.batch or len(args.searchKeys) > 1:
+        if args.engine == 'async':
+            parser.error('batch mode runs on the threads engine')
+        queries = [makeQuery(searchKey, args.number, downloadDir=args.downloadDir)
+                   for searchKey in args.searchKeys]
+        if args.batch:
+            try:
+                queries += readBatchFile(args.batch, args.number, args.downloadDir)
+            except ValueError as exc:
+                parser.error(f'{args.batch.name}: {exc}')
+        if not queries:
+            parser.error(f'no search keys in {args.batch.name}')
+    elif not args.searchKeys:
+        parser.error('a search key or a batch file is required')
+    try:
+        imageFilter = ImageFilter(args.min_width, args.min_height, args.aspect,
+                    maxBytes=None if args.max_size is None else int(args.max_size * 2**20))
+    except ValueError as exc:
+        parser.error(str(exc))
+    if args.engine == 'async':
+        from async_downloader import AsyncAlphaDownloader as Downloader
+    elif queries:
+        Downloader = BatchDownloader
+    else:
+        Downloader = AlphaDownloader
+    Downloader.usePageCache = args.pageCache
+    Downloader.useDedupIndex = args.dedup != 'off'
+    downloader = Downloader(trace=True)
+    downloader.adaptive = args.adaptive
+    downloader.dedupMode = args.dedup
+    downloader.nearDuplicates = args.near_duplicates
+    downloader.nearDupThreshold = args.near_threshold
+    if args.trace_out:
+        downloader.tracer.start()
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
     try:
-        AlphaDownloader(args.searchKey, args.number, downloadDir, trace=True).startDownload(args.threads)
-    except SearchReturnedNone:
-        sys.exit(f"No Images found for {args.search}")
+        if args.restore:
+            downloader.restoreJournal(args.restore, numWorkers=args.threads,
+                                      downloadDir=args.downloadDir,
+                                      verifyHash=args.verify)
+        elif queries:
+            downloader.startBatch(queries, maxretries=args.retries,
+                                  numWorkers=args.threads, imageFilter=imageFilter,
+                                  sync=args.sync)
+        else:
+            searchKey, = args.searchKeys
+            downloadDir = searchKey if args.downloadDir is None else args.downloadDir
+            downloader.startDownload(searchKey, args.number,
+                                     downloadDir, maxretries=args.retries,
+                                     numWorkers=args.threads,
+                                     imageFilter=imageFilter,
+                                     sync=args.sync)
+    except SearchReturnedNone as exc:
+        sys.exit(f"No Images found: {exc}")
+    except MaxRetriesCrossed as exc:
+        sys.exit(str(exc))
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if args.trace_out:
+            downloader.tracer.save(args.trace_out)
+        if args.metrics_out:
+            saveMetrics(downloader, args.metrics_out)
+
+def saveMetrics(downloader, filename):
+    " Save the downloader metrics, in prometheus text for .prom files "
+    fmt = 'prometheus' if filename.endswith('.prom') else 'json'
+    with open(filename, 'w') as metricsFile:
+        metricsFile.write(downloader.exportMetrics(fmt))
 
 def makeGUI():
     """
@@ -87,14 +248,15 @@ def makeGUI():
     root = tk.Tk()
     root.title('Wall-Do! - A Wallpaper Downloader')
     root.geometry('400x760')
-    root.protocol('WM_DELETE_WINDOW', lambda: sys.exit(0))
 
     guiDownloader = GuiDownloader(root)
     guiDownloader.pack(expand=True)
-    MakeMenuHandlers(root, downloaderObj=guiDownloader)
+    menu = MakeMenuHandlers(root, downloaderObj=guiDownloader)
+    root.protocol('WM_DELETE_WINDOW', menu.exitApp)
     tk.mainloop()
 
 if __name__ == '__main__':
+    setupLogging()
     if len(sys.argv) > 1: interactive()
     else: makeGUI()
 
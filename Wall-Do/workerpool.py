@@ -0,0 +1,192 @@
+"""
+ This module contains the worker pool that drives the downloads.
+
+ A fixed number of worker threads consume jobs from a bounded queue,
+ so the concurrency is decided by the caller and not by the number
+ of images requested; the bounded queue gives backpressure to the
+ producer (page crawler) so that memory stays flat for large runs.
+ Within that ceiling, an AIMD limiter adapts the number of concurrent
+ transfers to what the server can take.
+
+"""
+
+import logging, queue, threading, time
+from logger import mainlogger
+
+# get module logger
+poolLogger = logging.getLogger('main.workerpool')
+
+class WorkerPool:
+    """
+    Fixed size pool of worker threads calling target(*job) for
+    every job submitted; use as a context manager or call start()
+    and join() explicitly
+    """
+    def __init__(self, target, numWorkers=8, queueSize=None):
+        if numWorkers <= 0:
+            raise ValueError(f'Invalid number of workers: {numWorkers}')
+        self.target = target
+        self.numWorkers = numWorkers
+        # keep a couple of jobs ready for every worker
+        self.jobQueue = queue.Queue(maxsize=queueSize or numWorkers * 2)
+        self.threads  = []
+        # jobs submitted (or scheduled) but not yet finished
+        self._unfinished = 0
+        self._allDone = threading.Condition()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *excinfo):
+        self.join()
+
+    def start(self):
+        " Start the worker threads "
+        for num in range(self.numWorkers):
+            thread = threading.Thread(target=self._worker, daemon=True,
+                                      name=f'wall-do-worker-{num}')
+            thread.start()
+            self.threads.append(thread)
+        poolLogger.info(f'{self.numWorkers = }')
+
+    def submit(self, *job):
+        " Queue a job, blocks while the queue is full "
+        with self._allDone:
+            self._unfinished += 1
+        self.jobQueue.put(job)
+
+    def submitLater(self, delay, *job):
+        """
+        Queue a job after delay seconds without blocking the caller
+        (a worker re-queuing a failed job); join() waits for it
+        """
+        with self._allDone:
+            self._unfinished += 1
+        timer = threading.Timer(delay, self.jobQueue.put, args=(job,))
+        timer.daemon = True
+        timer.start()
+
+    def join(self):
+        " Wait for the queued and scheduled jobs to finish and stop the workers "
+        with self._allDone:
+            self._allDone.wait_for(lambda: not self._unfinished)
+        for _ in self.threads:
+            self.jobQueue.put(None)     # one sentinel per worker
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def _worker(self):
+        " Worker loop; run jobs until a sentinel is received "
+        while True:
+            job = self.jobQueue.get()
+            if job is None:
+                break
+            try:
+                self.target(*job)
+            except Exception as exc:
+                poolLogger.error(f'Unhandled error in worker: {job}\n{str(exc)}')
+            finally:
+                with self._allDone:
+                    self._unfinished -= 1
+                    if not self._unfinished:
+                        self._allDone.notify_all()
+
+class AIMDController:
+    """
+    Additive increase / multiplicative decrease of a concurrency limit;
+    the limit grows by one after every window (limit completions) in which
+    the throughput did not drop, and is cut by the decrease factor on
+    throttling (429/503), connection resets or a time to first byte rising
+    above ttfbFactor times its best average (and by at least ttfbSlack
+    secs, ignoring jitter on fast links); at most one cut per window
+    """
+    def __init__(self, maxLimit, minLimit=1, initLimit=None, decrease=0.5,
+                 ttfbFactor=3.0, ttfbSlack=0.1, tolerance=0.1):
+        self.maxLimit = maxLimit
+        self.minLimit = min(minLimit, maxLimit)
+        self.limit = initLimit or max(self.minLimit, maxLimit // 2)
+        self.decrease = decrease
+        self.ttfbFactor = ttfbFactor
+        self.ttfbSlack  = ttfbSlack
+        self.tolerance = tolerance      # throughput noise ignored
+        self._lock = threading.Lock()
+        self._ttfbAvg  = None           # moving average of ttfb
+        self._ttfbBest = None           # best moving average seen
+        self._lastThroughput = 0
+        self._resetWindow()
+
+    def _resetWindow(self):
+        self._windowCount = 0
+        self._windowBytes = 0
+        self._windowStart = time.perf_counter()
+        self._cutInWindow = False
+
+    def onSuccess(self, nbytes, ttfb=None):
+        " Feed a completed transfer of nbytes with its time to first byte "
+        with self._lock:
+            if ttfb is not None:
+                self._ttfbAvg = ttfb if self._ttfbAvg is None \
+                                     else 0.8 * self._ttfbAvg + 0.2 * ttfb
+                if self._ttfbBest is None or self._ttfbAvg < self._ttfbBest:
+                    self._ttfbBest = self._ttfbAvg
+                elif self._ttfbAvg > max(self._ttfbBest * self.ttfbFactor,
+                                         self._ttfbBest + self.ttfbSlack):
+                    self._cut('rising ttfb')
+                    return
+            self._windowCount += 1
+            self._windowBytes += nbytes
+            if self._windowCount < self.limit:
+                return
+            elapsed = time.perf_counter() - self._windowStart
+            throughput = self._windowBytes / elapsed if elapsed else 0
+            if throughput >= self._lastThroughput * (1 - self.tolerance) \
+                    and self.limit < self.maxLimit:
+                self.limit += 1
+                poolLogger.debug(f'Concurrency raised: {self.limit = }')
+            self._lastThroughput = throughput
+            self._resetWindow()
+
+    def onCongestion(self, reason=''):
+        " Feed a throttling response or a connection reset "
+        with self._lock:
+            self._cut(reason)
+
+    def _cut(self, reason):
+        " Multiplicative decrease, once per window; call with the lock held "
+        if self._cutInWindow:
+            return
+        self.limit = max(self.minLimit, int(self.limit * self.decrease))
+        # forget the history measured at the higher concurrency
+        self._ttfbBest = self._ttfbAvg
+        self._lastThroughput = 0
+        self._resetWindow()
+        self._cutInWindow = True
+        poolLogger.info(f'Concurrency cut ({reason}): {self.limit = }')
+
+class AdaptiveLimiter(AIMDController):
+    """
+    AIMD controller gating the worker threads; use as a context manager
+    around a transfer, blocks while the current limit is reached
+    """
+    def __init__(self, *args, **kw):
+        AIMDController.__init__(self, *args, **kw)
+        self.active = 0
+        self._slotFree = threading.Condition()
+
+    def __enter__(self):
+        with self._slotFree:
+            self._slotFree.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+        return self
+
+    def __exit__(self, *excinfo):
+        with self._slotFree:
+            self.active -= 1
+            self._slotFree.notify_all()     # the limit may have grown
+
+    def onSuccess(self, nbytes, ttfb=None):
+        AIMDController.onSuccess(self, nbytes, ttfb)
+        with self._slotFree:
+            self._slotFree.notify_all()
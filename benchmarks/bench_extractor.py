@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+ Micro-benchmark of the search page link extraction.
+
+ Compares extractor.extractLinks (lxml xpath on the response bytes)
+ with the BeautifulSoup path it replaced (decode to text, build the
+ soup, css select), after checking that both return the same links and
+ served query string for every fixture page.
+
+ Usage: python benchmarks/bench_extractor.py [-n REPEATS]
+
+"""
+
+import os, sys, glob, timeit, argparse
+
+benchDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(benchDir, os.pardir, 'Wall-Do'))
+
+from extractor import extractLinks, extractLinksSoup
+from downloader import AlphaDownloader
+
+fixtureDir = os.path.join(benchDir, 'fixtures')
+
+def loadFixtures():
+    " Return a dict of fixture name: page bytes "
+    fixtures = dict()
+    for path in sorted(glob.glob(os.path.join(fixtureDir, '*.html'))):
+        with open(path, 'rb') as page:
+            fixtures[os.path.basename(path)] = page.read()
+    return fixtures
+
+def checkParity(fixtures, prefixes):
+    " Exit with an error if the extractors disagree on any fixture "
+    for name, content in fixtures.items():
+        fast = extractLinks(content, prefixes)
+        reference = extractLinksSoup(content.decode('utf-8'), prefixes)
+        if fast != reference:
+            sys.exit(f'Parity check failed for {name}:\n{fast}\n!=\n{reference}')
+        print(f'{name:<24} parity ok, {len(fast[0])} links')
+
+def main():
+    parser = argparse.ArgumentParser(description='Link extraction micro-benchmark')
+    parser.add_argument('-n', '--repeats', help='Parses per fixture', default=200, type=int)
+    args = parser.parse_args()
+
+    prefixes = AlphaDownloader.prefixes
+    fixtures = loadFixtures()
+    checkParity(fixtures, prefixes)
+
+    print(f'\n{"fixture":<24} {"soup (ms)":>10} {"lxml (ms)":>10} {"speedup":>8}')
+    for name, content in fixtures.items():
+        soupTime = timeit.timeit(
+                lambda: extractLinksSoup(content.decode('utf-8'), prefixes),
+                number=args.repeats) / args.repeats
+        fastTime = timeit.timeit(lambda: extractLinks(content, prefixes),
+                                 number=args.repeats) / args.repeats
+        print(f'{name:<24} {soupTime * 1e3:>10.3f} {fastTime * 1e3:>10.3f} '
+              f'{soupTime / fastTime:>7.1f}x')
+
+if __name__ == '__main__':
+    main()
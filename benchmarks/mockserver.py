@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+ Local stand-in for wall.alphacoders.com used by the benchmarks.
+
+ Serves search pages with the markup the downloader scrapes
+ (div.page_container[data-url] and img.img-responsive thumbnails) and
+ synthetic images, with a configurable profile: image size, latency
+ before the first byte, per-connection bandwidth and error rate.
+ Search pages are served from 127.0.0.1 and images from localhost, so
+ the page and image connection pools are exercised separately.
+
+ Usage: python benchmarks/mockserver.py [--port N] [profile options]
+ prints 'PORT <n>' once listening
+
+"""
+
+import time, random, socket, argparse, threading
+import http.server, urllib.parse
+
+RESOLUTIONS = ('3840x2160', '1920x1080', '2560x1440', '1920x1200', '1366x768')
+
+class Profile:
+    " Server behaviour, shared by all the handler threads "
+    def __init__(self, imageSize=500 * 1024, latency=0.0, bandwidth=0,
+                 errorRate=0.0, numResults=10000, perPage=30, seed=1149):
+        self.imageSize = imageSize      # bytes per image
+        self.latency   = latency        # secs before the first byte
+        self.bandwidth = bandwidth      # bytes/sec per connection, 0: unlimited
+        self.errorRate = errorRate      # share of image requests failing
+        self.numResults = numResults
+        self.perPage = perPage
+        self.random = random.Random(seed)
+        self.randomLock = threading.Lock()
+        # one image body shared by every id, a jpeg header and filler
+        self.imageBody = b'\xff\xd8\xff\xe0' + bytes(range(256)) * (imageSize // 256 + 1)
+        self.imageBody = self.imageBody[:imageSize]
+
+    def failure(self):
+        " Return the status of a failed image request or None "
+        with self.randomLock:
+            roll = self.random.random()
+        if roll >= self.errorRate:
+            return None
+        # mostly transient failures, a few permanent ones
+        return 404 if roll < self.errorRate / 10 else 503
+
+class MockHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'   # keep-alive, as the real site
+    profile = Profile()
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        http.server.BaseHTTPRequestHandler.setup(self)
+        # headers and body go out in separate writes; without this
+        # nagle and delayed acks add ~40ms to every response
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if self.profile.latency:
+            time.sleep(self.profile.latency)
+        if url.path == '/search.php':
+            self.sendPage(urllib.parse.parse_qs(url.query))
+        elif url.path.startswith('/images/'):
+            self.sendImage()
+        else:
+            self.sendStatus(404)
+
+    def do_HEAD(self):
+        " Headers of an image only, as asked by the size filter "
+        url = urllib.parse.urlsplit(self.path)
+        if self.profile.latency:
+            time.sleep(self.profile.latency)
+        if not url.path.startswith('/images/'):
+            return self.sendStatus(404)
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('ETag', '"mock"')
+        self.send_header('Content-Length', str(len(self.profile.imageBody)))
+        self.end_headers()
+
+    def sendStatus(self, status, headers=()):
+        self.send_response(status)
+        for header in headers:
+            self.send_header(*header)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def sendPage(self, query):
+        searchKey = query.get('search', [''])[0]
+        pageNum = int(query.get('page', ['1'])[0])
+        perPage = self.profile.perPage
+        imageIds = range((pageNum - 1) * perPage,
+                         min(pageNum * perPage, self.profile.numResults))
+        pageHost, port = self.server.server_address[:2]
+        dataUrl = f'http://{pageHost}:{port}/search.php?search={urllib.parse.quote_plus(searchKey)}'
+        thumbs = ''.join(
+            f'<div class="thumb-container-big"><div class="boxgrid">'
+            f'<a href="big.php?i={imageId}"><img width="600" height="375" '
+            f'class="img-responsive big-thumb" '
+            f'src="http://localhost:{port}/images/thumbbig-{imageId}.jpg" '
+            f'alt="Movie {searchKey} {imageId} HD Wallpaper | Background Image"></a></div>'
+            f'<div class="thumb-info-big"><span>{RESOLUTIONS[imageId % len(RESOLUTIONS)]}</span>'
+            f'</div></div>\n'
+            for imageId in imageIds)
+        body = (f'<!DOCTYPE html><html><head><title>{searchKey}</title></head><body>'
+                f'<div class="page_container center" data-url="{dataUrl}">{thumbs}</div>'
+                f'</body></html>').encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def sendImage(self):
+        status = self.profile.failure()
+        if status:
+            return self.sendStatus(status, [('Retry-After', '0')] if status == 503 else ())
+        body = self.profile.imageBody
+        start = 0
+        rangeHeader = self.headers.get('Range', '')
+        if rangeHeader.startswith('bytes=') and self.headers.get('If-Range', '"mock"') == '"mock"':
+            start = int(rangeHeader[6:].split('-')[0])
+            if start >= len(body):
+                return self.sendStatus(416)
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(body) - 1}/{len(body)}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('ETag', '"mock"')
+        self.send_header('Content-Length', str(len(body) - start))
+        self.end_headers()
+        self.writeThrottled(memoryview(body)[start:])
+
+    def writeThrottled(self, data, chunk=64 * 1024):
+        " Write data, holding the connection to the profile bandwidth "
+        if not self.profile.bandwidth:
+            return self.wfile.write(data)
+        start = time.perf_counter()
+        for offset in range(0, len(data), chunk):
+            self.wfile.write(data[offset:offset + chunk])
+            ahead = (offset + chunk) / self.profile.bandwidth - (time.perf_counter() - start)
+            if ahead > 0:
+                time.sleep(ahead)
+
+class MockServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+def serve(profile, port=0):
+    " Start the mock server in a daemon thread, return the server "
+    handler = type('ProfiledHandler', (MockHandler,), dict(profile=profile))
+    server = MockServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True,
+                     name='mockserver').start()
+    return server
+
+def addProfileArgs(parser):
+    " Add the server profile options to an argument parser "
+    parser.add_argument('--image-size', help='Image size in KiB',            default=500,  type=int)
+    parser.add_argument('--latency',    help='Secs before the first byte',   default=0.0,  type=float)
+    parser.add_argument('--bandwidth',  help='KiB/sec per connection, 0: unlimited', default=0, type=int)
+    parser.add_argument('--error-rate', help='Share of failing image requests', default=0.0, type=float)
+    parser.add_argument('--results',    help='Number of search results',     default=10000, type=int)
+
+def profileFromArgs(args):
+    return Profile(imageSize=args.image_size * 1024, latency=args.latency,
+                   bandwidth=args.bandwidth * 1024, errorRate=args.error_rate,
+                   numResults=args.results)
+
+def main():
+    parser = argparse.ArgumentParser(description='Mock wall.alphacoders.com server')
+    parser.add_argument('--port', help='Port to listen on, 0: any free port', default=0, type=int)
+    addProfileArgs(parser)
+    args = parser.parse_args()
+    server = serve(profileFromArgs(args), args.port)
+    print(f'PORT {server.server_address[1]}', flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+ Offline benchmark of the downloader against the local mock server.
+
+ Starts benchmarks/mockserver.py with the chosen profile and runs every
+ scenario (startDownload on both engines, fetchLinks, restoreMetadata)
+ in a fresh interpreter, so the peak rss of one does not leak into the
+ next; reports images/s, MiB/s, p50/p99 per-image latency and peak rss,
+ and saves the results as json to compare versions with --compare.
+
+ Usage: python benchmarks/run_benchmark.py [--profile wan] [-n 300]
+                [-o results.json] [--compare baseline.json]
+
+"""
+
+import os, sys, json, time, math, shutil, tempfile
+import argparse, statistics, subprocess, platform
+
+benchDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(benchDir, os.pardir, 'Wall-Do'))
+
+from mockserver import addProfileArgs
+
+# server profiles: image size (KiB), latency (secs),
+# bandwidth (KiB/s per connection), error rate
+PROFILES = {
+    'lan':   dict(image_size=500,   latency=0.0,  bandwidth=0,    error_rate=0.0),
+    'wan':   dict(image_size=2048,  latency=0.05, bandwidth=4096, error_rate=0.0),
+    'flaky': dict(image_size=500,   latency=0.02, bandwidth=0,    error_rate=0.05),
+    '4k':    dict(image_size=12288, latency=0.01, bandwidth=0,    error_rate=0.0),
+}
+SCENARIOS = ('startDownload', 'startDownload-async', 'fetchLinks', 'restoreMetadata')
+# reported metrics, True if higher is better
+METRICS = dict(imagesPerSec=True, mibPerSec=True, latencyP50=False,
+               latencyP99=False, peakRssMiB=False)
+
+def timedDownloader(async_=False):
+    " Return a downloader class recording the latency of every image transfer "
+    if async_:
+        from async_downloader import AsyncAlphaDownloader as Downloader
+    else:
+        from downloader import AlphaDownloader as Downloader
+
+    class TimedDownloader(Downloader):
+        usePageCache = False    # measure the site, not the caches
+        useDedupIndex = False
+        latencies = []
+
+        def _fetchImage(self, link, imgfilename):
+            start = time.perf_counter()
+            imgSize = Downloader._fetchImage(self, link, imgfilename)
+            self.latencies.append(time.perf_counter() - start)
+            return imgSize
+
+        async def _fetchImageAsync(self, session, link, imgfilename):
+            start = time.perf_counter()
+            imgSize = await Downloader._fetchImageAsync(self, session, link, imgfilename)
+            self.latencies.append(time.perf_counter() - start)
+            return imgSize
+
+    return TimedDownloader
+
+def peakRssMiB():
+    " Peak resident set size of this process in MiB, None if unknown "
+    try:
+        import resource
+    except ImportError:     # windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def runScenario(scenario, port, numImages, numWorkers):
+    " Run a single scenario in this process and return its result dict "
+    from exceptions import MaxRetriesCrossed
+    Downloader = timedDownloader(async_=scenario.endswith('-async'))
+    Downloader.queryStr = \
+        f'http://127.0.0.1:{port}/search.php?search=%(searchKey)s&page=%(pageNo)d'
+    downloader = Downloader()
+    downloadDir = tempfile.mkdtemp(prefix='wall-do-bench-')
+    result = dict(scenario=scenario)
+    try:
+        if scenario == 'restoreMetadata':
+            # links gathered up front, only the downloads are timed
+            imageMetaDict = {record.name: record.link for record in
+                             downloader.fetchLinks('benchmark', 1,
+                                    1 + math.ceil(numImages / 30))}
+            imageMetaDict = dict(list(imageMetaDict.items())[:numImages])
+        start = time.perf_counter()
+        if scenario.startswith('startDownload'):
+            try:
+                downloader.startDownload('benchmark', numImages, downloadDir,
+                                         numWorkers=numWorkers)
+            except MaxRetriesCrossed:
+                pass        # abandoned images are part of the result
+        elif scenario == 'fetchLinks':
+            numLinks = sum(1 for _ in downloader.fetchLinks('benchmark', 1,
+                                            1 + math.ceil(numImages / 30)))
+        else:
+            downloader.restoreMetadata(imageMetaDict, numWorkers, downloadDir)
+        elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(downloadDir, ignore_errors=True)
+
+    if scenario == 'fetchLinks':
+        result.update(links=numLinks, seconds=elapsed,
+                      linksPerSec=numLinks / elapsed)
+    else:
+        latencies = Downloader.latencies
+        quantiles = statistics.quantiles(latencies, n=100) \
+                        if len(latencies) > 1 else latencies * 99 or [0] * 99
+        result.update(images=downloader.numDownloaded,
+                      abandoned=len(downloader.abandonedLinks),
+                      seconds=elapsed,
+                      imagesPerSec=downloader.numDownloaded / elapsed,
+                      mibPerSec=downloader.bytesToMiB(downloader.downloadSize) / elapsed,
+                      latencyP50=quantiles[49], latencyP99=quantiles[98],
+                      **downloader.connectionStats())
+    result['peakRssMiB'] = peakRssMiB()
+    return result
+
+def startServer(args):
+    " Start the mock server subprocess, return (process, port) "
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(benchDir, 'mockserver.py'),
+         '--image-size', str(args.image_size), '--latency', str(args.latency),
+         '--bandwidth', str(args.bandwidth), '--error-rate', str(args.error_rate),
+         '--results', str(args.results)],
+        stdout=subprocess.PIPE, text=True)
+    line = server.stdout.readline()
+    if not line.startswith('PORT '):
+        server.kill()
+        sys.exit('Mock server did not start')
+    return server, int(line.split()[1])
+
+def gitRevision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=benchDir,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def printResults(results, baseline=None):
+    " Print the results table, with the change against the baseline if given "
+    baseResults = {result['scenario']: result
+                   for result in (baseline or {}).get('results', [])}
+    for result in results:
+        print(f"\n{result['scenario']}:")
+        baseResult = baseResults.get(result['scenario'], {})
+        for key, value in result.items():
+            if key == 'scenario' or value is None:
+                continue
+            line = f'  {key:<18} {value:>12.4f}' if isinstance(value, float) \
+                        else f'  {key:<18} {value:>12}'
+            baseValue = baseResult.get(key)
+            if key in METRICS and baseValue:
+                change = (value - baseValue) / baseValue * 100
+                better = (change > 0) == METRICS[key]
+                line += f'  {change:+7.1f}% {"better" if better else "worse"}'
+            print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline downloader benchmark')
+    parser.add_argument('--profile', help='Server profile, overridden by the options below',
+                        choices=PROFILES, default='lan')
+    addProfileArgs(parser)
+    parser.add_argument('-n', '--images',  help='Images per scenario',   default=300,  type=int)
+    parser.add_argument('-t', '--threads', help='Concurrent downloads',  default=None, type=int)
+    parser.add_argument('-s', '--scenario', help='Scenarios to run (default: all)',
+                        choices=SCENARIOS, action='append')
+    parser.add_argument('-o', '--output',  help='Save the results as json', default=None)
+    parser.add_argument('--compare',       help='Json results to compare against', default=None)
+    parser.add_argument('--port',          help=argparse.SUPPRESS, type=int)
+    parser.add_argument('--run-scenario',  help=argparse.SUPPRESS)
+    # profile values apply unless given explicitly
+    parser.set_defaults(**PROFILES[parser.parse_known_args()[0].profile])
+    args = parser.parse_args()
+
+    if args.run_scenario:       # child process
+        print(json.dumps(runScenario(args.run_scenario, args.port,
+                                     args.images, args.threads)))
+        return
+
+    server, port = startServer(args)
+    results = []
+    try:
+        for scenario in args.scenario or SCENARIOS:
+            command = [sys.executable, os.path.abspath(__file__),
+                       '--run-scenario', scenario, '--port', str(port),
+                       '--images', str(args.images)]
+            if args.threads:
+                command += ['--threads', str(args.threads)]
+            child = subprocess.run(command, capture_output=True, text=True,
+                                   cwd=tempfile.gettempdir())   # keep the log out
+            if child.returncode:
+                sys.exit(f'{scenario} failed:\n{child.stderr}')
+            results.append(json.loads(child.stdout.splitlines()[-1]))
+    finally:
+        server.kill()
+
+    report = dict(
+        revision=gitRevision(),
+        timestamp=time.strftime('%Y-%m-%dT%H:%M:%S'),
+        python=platform.python_version(),
+        profile=dict(name=args.profile, imageSizeKiB=args.image_size,
+                     latency=args.latency, bandwidthKiB=args.bandwidth,
+                     errorRate=args.error_rate),
+        images=args.images, threads=args.threads,
+        results=results,
+    )
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baselineFile:
+            baseline = json.load(baselineFile)
+    printResults(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as outputFile:
+            json.dump(report, outputFile, indent=4)
+        print(f'\nSaved results as {args.output}')
+
+if __name__ == '__main__':
+    main()
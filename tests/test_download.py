@@ -0,0 +1,117 @@
+"""
+ Tests of whole downloads against the mock alphacoders server.
+
+"""
+
+import os, sys, shutil, tempfile, unittest
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(testDir, os.pardir, 'Wall-Do'))
+sys.path.insert(0, os.path.join(testDir, os.pardir, 'benchmarks'))
+
+import mockserver
+from downloader import AlphaDownloader
+from async_downloader import AsyncAlphaDownloader
+from filters import ImageFilter
+from exceptions import ResultsExhausted
+from journal import MetadataJournal, readJournal
+
+class DownloadTest(unittest.TestCase):
+    engine = AlphaDownloader
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = mockserver.serve(mockserver.Profile(imageSize=4 * 1024, perPage=10))
+        cls.cacheDir = tempfile.mkdtemp()
+        port = cls.server.server_address[1]
+        cls.Downloader = type('Downloader', (cls.engine,), dict(
+                queryStr=f'http://127.0.0.1:{port}/search.php?search=%(searchKey)s&page=%(pageNo)d',
+                usePageCache=False, useDedupIndex=False, cacheDir=cls.cacheDir))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        shutil.rmtree(cls.cacheDir)
+
+    def setUp(self):
+        self.downloadDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.downloadDir)
+
+    def images(self):
+        return sorted(filename for filename in os.listdir(self.downloadDir)
+                      if filename.endswith('.jpg'))
+
+    def testRestoreJournaledTwice(self):
+        self.Downloader().startDownload('key', 5, self.downloadDir)
+        journalPath = os.path.join(self.downloadDir, self.Downloader.journalName)
+        with open(journalPath) as journalFile:
+            lines = journalFile.readlines()
+        with open(journalPath, 'a') as journalFile:
+            journalFile.writelines(lines)       # a second run journaling the same images
+        for filename in self.images():
+            os.unlink(os.path.join(self.downloadDir, filename))
+        downloader = self.Downloader()
+        downloader.restoreJournal(journalPath)
+        self.assertEqual(downloader.numDownloaded, 5)
+        self.assertEqual(downloader.abandonedLinks, {})
+        self.assertEqual(len(self.images()), 5)
+        self.assertFalse([filename for filename in os.listdir(self.downloadDir)
+                          if filename.endswith('.part')])
+
+    def testRestoreRemovedImage(self):
+        self.Downloader().startDownload('key', 5, self.downloadDir)
+        journalPath = os.path.join(self.downloadDir, self.Downloader.journalName)
+        removed = os.path.join(self.downloadDir, self.images()[0])
+        journal = MetadataJournal(journalPath)
+        journal.remove(removed)     # deleted as a near duplicate
+        journal.close()
+        for filename in self.images():
+            os.unlink(os.path.join(self.downloadDir, filename))
+        downloader = self.Downloader()
+        downloader.restoreJournal(journalPath)
+        self.assertEqual(len(self.images()), 4)
+        self.assertFalse(os.path.exists(removed))
+        restored = [entry for entry in readJournal(journalPath, withRemovals=True)
+                    if entry.path == removed]
+        self.assertTrue(restored[-1].removed)   # not restored by the next restore
+
+    def testRerunIntoSameDirectory(self):
+        self.Downloader().startDownload('key', 5, self.downloadDir)
+        os.unlink(os.path.join(self.downloadDir, self.images()[0]))
+        downloader = self.Downloader()
+        downloader.startDownload('key', 5, self.downloadDir)
+        self.assertEqual(downloader.numDownloaded, 5)
+        self.assertEqual(len(self.images()), 9)
+
+    def testFilterCountsExaminedOnly(self):
+        # ids 0, 2, 5, 7 of the first page are 2560 wide or more
+        downloader = self.Downloader()
+        downloader.startDownload('key', 4, self.downloadDir,
+                                 imageFilter=ImageFilter(minWidth=2560))
+        self.assertEqual(downloader.numDownloaded, 4)
+        self.assertEqual(len(downloader.filteredLinks), 4)
+
+    def testResultsExhaustedByFilter(self):
+        server = mockserver.serve(mockserver.Profile(imageSize=1024, numResults=10))
+        try:
+            port = server.server_address[1]
+            downloader = type('Downloader', (self.Downloader,), dict(
+                queryStr=f'http://127.0.0.1:{port}/search.php?search=%(searchKey)s&page=%(pageNo)d'))()
+            with self.assertRaises(ResultsExhausted) as raised:
+                downloader.startDownload('key', 5, self.downloadDir,
+                                         imageFilter=ImageFilter(minWidth=3840))
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(downloader.numDownloaded, 2)
+        self.assertEqual(str(raised.exception),
+                         'Results ran out 3 images short; 8 images filtered out')
+
+class AsyncDownloadTest(DownloadTest):
+    engine = AsyncAlphaDownloader
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+"""
+ Tests of the link extraction: extractLinks against its BeautifulSoup
+ reference, on the benchmark fixtures and on malformed markup.
+
+"""
+
+import os, sys, glob, unittest
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(testDir, os.pardir, 'Wall-Do'))
+
+from extractor import extractLinks, extractLinksSoup
+from downloader import AlphaDownloader
+
+fixtureDir = os.path.join(testDir, os.pardir, 'benchmarks', 'fixtures')
+
+THUMB = ('<div class="thumb-container-big"><div class="boxgrid">'
+         '<img class="img-responsive" alt="%(alt)s" src="%(src)s"></div>'
+         '<div class="thumb-info-big"><span>%(res)s</span><span>other</span></div></div>')
+
+# malformed pages, as a server (or a truncated transfer) could serve them
+MALFORMED = {
+    'unclosed tags': '<html><body><div class="page_container" data-url="q?page=2">'
+                     '<div class="thumb-container-big"><img class="img-responsive" '
+                     'alt="Nature Image HD Wallpaper" src="x/thumbbig-1.jpg">'
+                     '<div class="thumb-info-big"><span>1920x1080',
+    'truncated tag': THUMB % dict(alt='Cut', src='x/thumbbig-2.jpg', res='800x600')
+                     + '<div class="thumb-container-big"><img class="img-respo',
+    'missing attributes': '<div class="thumb-container-big"><img class="img-responsive">'
+                          '<div class="thumb-info-big"><span>640x480</span></div></div>',
+    'no resolution': THUMB % dict(alt='A', src='x/thumbbig-3.jpg', res='')
+                     + THUMB % dict(alt='B', src='x/thumbbig-4.jpg', res='large'),
+    'no thumb container': '<p><img class="img-responsive" alt="Lone" src="x/thumbbig-5.jpg">',
+    'odd class spacing': '<div class="  thumb-container-big\tx "><img class="a  img-responsive" '
+                         'alt="Spaced" src="x/thumbbig-6.jpg"><div class="thumb-info-big ">'
+                         '<span> 2560 x 1440 </span></div></div>',
+    'nested containers': '<div class="thumb-container-big"><div class="thumb-info-big">'
+                         '<span>100x100</span></div><div class="thumb-container-big">'
+                         + THUMB % dict(alt='Inner', src='x/thumbbig-7.jpg', res='300x200')
+                         + '</div></div>',
+    'entities and unicode': THUMB % dict(alt='Caf&eacute; &amp; Mötley &#x2603;',
+                                         src='x/thumbbig-8.jpg?a=1&amp;b=2', res='1x1'),
+    'two page containers': '<div class="page_container" data-url="first"></div>'
+                           '<div class="page_container" data-url="second"></div>',
+}
+
+class ExtractorParityTest(unittest.TestCase):
+    prefixes = AlphaDownloader.prefixes
+
+    def assertParity(self, content):
+        fast = extractLinks(content, self.prefixes)
+        reference = extractLinksSoup(content.decode('utf-8'), self.prefixes)
+        self.assertEqual(fast, reference)
+        return fast
+
+    def testFixtures(self):
+        paths = sorted(glob.glob(os.path.join(fixtureDir, '*.html')))
+        self.assertEqual(len(paths), 4)
+        for path in paths:
+            with self.subTest(fixture=os.path.basename(path)), open(path, 'rb') as page:
+                self.assertParity(page.read())
+
+    def testSearchPage(self):
+        with open(os.path.join(fixtureDir, 'search_page.html'), 'rb') as page:
+            imgList, queryStrServed = self.assertParity(page.read())
+        self.assertTrue(imgList)
+        self.assertIsNotNone(queryStrServed)
+        self.assertTrue(all(record.width and record.height for record in imgList))
+        self.assertFalse([record for record in imgList if 'thumbbig-' in record.link])
+
+    def testNoResults(self):
+        with open(os.path.join(fixtureDir, 'no_results.html'), 'rb') as page:
+            self.assertEqual(self.assertParity(page.read()), ([], None))
+
+    def testMalformed(self):
+        for name, markup in MALFORMED.items():
+            with self.subTest(page=name):
+                self.assertParity(markup.encode('utf-8'))
+
+    def testMalformedResolution(self):
+        imgList, _ = self.assertParity(MALFORMED['no resolution'].encode('utf-8'))
+        self.assertEqual([(record.width, record.height) for record in imgList],
+                         [(None, None), (None, None)])
+        imgList, _ = self.assertParity(MALFORMED['odd class spacing'].encode('utf-8'))
+        self.assertEqual([(record.width, record.height) for record in imgList], [(2560, 1440)])
+
+    def testEmptyPage(self):
+        self.assertEqual(extractLinks(b''), ([], None))
+        self.assertParity(b'<html></html>')
+
+if __name__ == '__main__':
+    unittest.main()
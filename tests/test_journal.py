@@ -0,0 +1,86 @@
+"""
+ Tests of the metadata journal of the downloads.
+
+"""
+
+import os, sys, hashlib, tempfile, unittest
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(testDir, os.pardir, 'Wall-Do'))
+
+from journal import MetadataJournal, JournalEntry, readJournal, fileMatches
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempDir.name, 'wall-do.jsonl')
+
+    def tearDown(self):
+        self.tempDir.cleanup()
+
+    def writeEntries(self, count):
+        journal = MetadataJournal(self.path)
+        for num in range(count):
+            journal.append(f'image {num}', f'http://host/images/{num}.jpg',
+                           os.path.join(self.tempDir.name, f'image {num}_{num}.jpg'),
+                           num * 100, f'{num:064x}')
+        return journal
+
+    def testRoundTrip(self):
+        self.writeEntries(3).close()
+        entries = list(readJournal(self.path))
+        self.assertEqual(len(entries), 3)
+        self.assertIsInstance(entries[0], JournalEntry)
+        self.assertEqual(entries[2].name, 'image 2')
+        self.assertEqual(entries[2].link, 'http://host/images/2.jpg')
+        self.assertEqual(entries[2].size, 200)
+        self.assertTrue(os.path.isabs(entries[2].path))
+
+    def testTruncatedLastLineSkipped(self):
+        self.writeEntries(2).close()
+        with open(self.path, 'a') as journalFile:
+            journalFile.write('{"name": "image 2", "link": "http://ho')   # crash
+        self.assertEqual([entry.name for entry in readJournal(self.path)],
+                         ['image 0', 'image 1'])
+
+    def testBadLinesSkipped(self):
+        self.writeEntries(1).close()
+        with open(self.path, 'a') as journalFile:
+            journalFile.write('\n[1, 2]\n{"name": "no link"}\nnot json\n')
+        self.writeEntries(1).close()
+        self.assertEqual(len(list(readJournal(self.path))), 2)
+
+    def testLinesAppendedWhileReadingIgnored(self):
+        journal = self.writeEntries(2)
+        entries = readJournal(self.path)
+        first = next(entries)
+        journal.append('late', 'http://host/images/9.jpg', 'late_9.jpg', 1, '')
+        journal.close()
+        self.assertEqual([first.name] + [entry.name for entry in entries],
+                         ['image 0', 'image 1'])
+
+    def testRemovedImages(self):
+        journal = self.writeEntries(3)
+        removed = list(readJournal(self.path))[1].path
+        journal.remove(removed)
+        journal.close()
+        self.assertEqual(len(list(readJournal(self.path))), 3)
+        entries = list(readJournal(self.path, withRemovals=True))
+        self.assertEqual([entry.removed for entry in entries], [False] * 3 + [True])
+        self.assertEqual(entries[-1].path, removed)
+
+    def testFileMatches(self):
+        imgPath = os.path.join(self.tempDir.name, 'image.jpg')
+        with open(imgPath, 'wb') as imgFile:
+            imgFile.write(b'pixels')
+        entry = JournalEntry('image', 'link', imgPath, 6,
+                             hashlib.sha256(b'pixels').hexdigest())
+        self.assertTrue(fileMatches(imgPath, entry, verifyHash=True))
+        self.assertFalse(fileMatches(imgPath, entry._replace(size=7)))
+        self.assertTrue(fileMatches(imgPath, entry._replace(sha256='0' * 64)))
+        self.assertFalse(fileMatches(imgPath, entry._replace(sha256='0' * 64),
+                                     verifyHash=True))
+        self.assertFalse(fileMatches(imgPath + '.gone', entry))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+"""
+ Tests of the near duplicate index of the perceptual hashes.
+
+"""
+
+import os, sys, random, unittest
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(testDir, os.pardir, 'Wall-Do'))
+
+from phash import MultiIndexHash, hammingDistance
+
+class HammingDistanceTest(unittest.TestCase):
+    def testDistance(self):
+        self.assertEqual(hammingDistance(0, 0), 0)
+        self.assertEqual(hammingDistance(0b1011, 0b0001), 2)
+        self.assertEqual(hammingDistance(0, (1 << 64) - 1), 64)
+
+class MultiIndexHashTest(unittest.TestCase):
+    def setUp(self):
+        rand = random.Random(1149)
+        # clusters of near hashes, a few bits flipped from their base
+        self.hashes = []
+        for _ in range(40):
+            base = rand.getrandbits(64)
+            for _ in range(20):
+                flips = rand.sample(range(64), rand.randrange(12))
+                self.hashes.append(base ^ sum(1 << bit for bit in flips))
+        self.index = MultiIndexHash()
+        for item, imgHash in enumerate(self.hashes):
+            self.index.add(imgHash, item)
+
+    def testMatchesBruteForce(self):
+        for threshold in (0, 3, 7, 10, 13):
+            for query in self.hashes[::37]:
+                expected = sorted(item for item, imgHash in enumerate(self.hashes)
+                                  if hammingDistance(query, imgHash) <= threshold)
+                found = self.index.search(query, threshold)
+                self.assertEqual(sorted(item for _, item in found), expected)
+
+    def testSortedByDistance(self):
+        found = self.index.search(self.hashes[0], 12)
+        distances = [distance for distance, _ in found]
+        self.assertEqual(distances, sorted(distances))
+        self.assertEqual(found[0][0], 0)
+
+    def testLength(self):
+        self.assertEqual(len(self.index), len(self.hashes))
+        self.assertEqual(MultiIndexHash().search(0, 10), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+"""
+ Tests of the resumable image downloads: the part file and its sidecar.
+
+"""
+
+import os, sys, json, tempfile, unittest
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(testDir, os.pardir, 'Wall-Do'))
+
+from downloader import AlphaDownloader
+from exceptions import ImageDownloadError
+
+class Downloader(AlphaDownloader):
+    usePageCache = False
+    useDedupIndex = False
+
+link = 'http://host/images/1149.jpg'
+
+class ResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.TemporaryDirectory()
+        self.downloader = Downloader()
+        self.imgfilename = os.path.join(self.tempDir.name, 'image_1149.jpg')
+        self.partfilename, self.metafilename = Downloader._partPaths(self.imgfilename)
+
+    def tearDown(self):
+        self.tempDir.cleanup()
+
+    def writePart(self, size, **partMeta):
+        with open(self.partfilename, 'wb') as partfile:
+            partfile.write(b'x' * size)
+        with open(self.metafilename, 'w') as metafile:
+            json.dump(dict(dict(link=link, etag=None, lastModified=None,
+                                length=None), **partMeta), metafile)
+
+    def openPart(self, status, headers, offset):
+        imgfile, offset, expected = self.downloader._openPart(
+                self.imgfilename, link, status, headers, offset)
+        imgfile.close()
+        return imgfile.mode, offset, expected
+
+    def testNothingToResume(self):
+        self.assertEqual(self.downloader._resumeState(self.imgfilename, link), (0, {}, None))
+
+    def testPartOfAnotherLink(self):
+        self.writePart(100, link='http://host/images/1.jpg')
+        self.assertEqual(self.downloader._resumeState(self.imgfilename, link), (0, {}, None))
+
+    def testEmptyPart(self):
+        self.writePart(0)
+        self.assertEqual(self.downloader._resumeState(self.imgfilename, link), (0, {}, None))
+
+    def testResumeWithEtag(self):
+        self.writePart(100, etag='"abc"', lastModified='Mon, 01 Jan 2024 00:00:00 GMT',
+                       length=500)
+        offset, headers, expected = self.downloader._resumeState(self.imgfilename, link)
+        self.assertEqual((offset, expected), (100, 500))
+        self.assertEqual(headers, {'Range': 'bytes=100-', 'If-Range': '"abc"'})
+
+    def testWeakEtagFallsBackToLastModified(self):
+        self.writePart(100, etag='W/"abc"', lastModified='Mon, 01 Jan 2024 00:00:00 GMT')
+        headers = self.downloader._resumeState(self.imgfilename, link)[1]
+        self.assertEqual(headers['If-Range'], 'Mon, 01 Jan 2024 00:00:00 GMT')
+
+    def testRangeHonoured(self):
+        self.writePart(100)
+        result = self.openPart(206, {'Content-Range': 'bytes 100-499/500',
+                                     'ETag': '"abc"'}, 100)
+        self.assertEqual(result, ('ab', 100, 500))
+        with open(self.metafilename) as metafile:
+            self.assertEqual(json.load(metafile)['etag'], '"abc"')
+
+    def testRangeIgnored(self):
+        self.writePart(100)
+        self.assertEqual(self.openPart(200, {'Content-Length': '500'}, 100), ('wb', 0, 500))
+        self.assertEqual(os.path.getsize(self.partfilename), 0)
+
+    def testEncodedLengthNotExpected(self):
+        result = self.openPart(200, {'Content-Length': '300',
+                                     'Content-Encoding': 'gzip'}, 0)
+        self.assertEqual(result, ('wb', 0, None))
+
+    def testRangeNotAskedForRejected(self):
+        self.writePart(100)
+        for offset in (100, 0):
+            with self.assertRaises(ImageDownloadError):
+                self.downloader._openPart(self.imgfilename, link, 206,
+                        {'Content-Range': 'bytes 0-99/500', 'Content-Length': '100'}, offset)
+            self.assertFalse(os.path.exists(self.partfilename))
+            self.assertFalse(os.path.exists(self.metafilename))
+
+    def testShortPartKept(self):
+        self.writePart(100)
+        with self.assertRaises(ImageDownloadError):
+            self.downloader._finishPart(self.imgfilename, link, 100, 500)
+        self.assertTrue(os.path.exists(self.partfilename))
+        self.assertFalse(os.path.exists(self.imgfilename))
+
+    def testFinishedPartRenamed(self):
+        self.writePart(500)
+        self.downloader._finishPart(self.imgfilename, link, 500, 500)
+        self.assertEqual(os.path.getsize(self.imgfilename), 500)
+        self.assertFalse(os.path.exists(self.metafilename))
+
+if __name__ == '__main__':
+    unittest.main()
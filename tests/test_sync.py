@@ -0,0 +1,169 @@
+"""
+ Tests of the sync runs: the index of the seen images and the crawl
+ stopping at them, against a mock server listing the newest images first.
+
+"""
+
+import os, sys, shutil, tempfile, threading, unittest
+from unittest import mock
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(testDir, os.pardir, 'Wall-Do'))
+sys.path.insert(0, os.path.join(testDir, os.pardir, 'benchmarks'))
+
+import mockserver
+from syncindex import SyncIndex
+from extractor import ImageRecord
+from downloader import AlphaDownloader
+from async_downloader import AsyncAlphaDownloader
+
+class NewestFirstHandler(mockserver.MockHandler):
+    " Search pages listing the ids from newest down to 0, as the site does "
+    newest = 99
+    pageHits = 0
+
+    def sendPage(self, query):
+        type(self).pageHits += 1
+        pageNum = int(query.get('page', ['1'])[0])
+        perPage = self.profile.perPage
+        imageIds = range(self.newest - (pageNum - 1) * perPage,
+                         max(-1, self.newest - pageNum * perPage), -1)
+        pageHost, port = self.server.server_address[:2]
+        thumbs = ''.join(
+            f'<div class="thumb-container-big"><img class="img-responsive" '
+            f'src="http://localhost:{port}/images/thumbbig-{imageId}.jpg" '
+            f'alt="Movie sync {imageId} HD Wallpaper"></div>'
+            for imageId in imageIds)
+        body = (f'<html><body><div class="page_container" '
+                f'data-url="http://{pageHost}:{port}/search.php?search=sync">'
+                f'{thumbs}</div></body></html>').encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class SyncIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.TemporaryDirectory()
+        self.index = SyncIndex(os.path.join(self.tempDir.name, 'sync.sqlite'), keepIds=3)
+
+    def tearDown(self):
+        self.index.close()
+        self.tempDir.cleanup()
+
+    def testSeenPerKey(self):
+        self.index.addSeen('Iron  Man', ['1', '2'])
+        self.index.addSeen('other', ['3'])
+        self.assertEqual(self.index.seenIds('iron man'), {'1', '2'})
+        self.assertEqual(self.index.seenIds('other'), {'3'})
+        self.assertEqual(self.index.seenIds('unknown'), set())
+
+    def testOldestTrimmed(self):
+        with mock.patch('syncindex.time.time', side_effect=[1.0, 2.0, 3.0]):
+            self.index.addSeen('key', ['1', '2'])
+            self.index.addSeen('key', ['3'])
+            self.index.addSeen('key', ['4', '5'])
+        self.assertEqual(self.index.seenIds('key'), {'3', '4', '5'})
+
+    def testReopened(self):
+        self.index.addSeen('key', ['1'])
+        self.index.close()
+        self.index = SyncIndex(self.index.path)
+        self.assertEqual(self.index.seenIds('key'), {'1'})
+
+class SyncRunTest(unittest.TestCase):
+    engine = AlphaDownloader
+
+    @classmethod
+    def setUpClass(cls):
+        cls.handler = type('Handler', (NewestFirstHandler,), dict(
+                                profile=mockserver.Profile(imageSize=1024, perPage=10)))
+        cls.server = mockserver.MockServer(('127.0.0.1', 0), cls.handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.queryStr = (f'http://127.0.0.1:{cls.server.server_address[1]}'
+                        '/search.php?search=%(searchKey)s&page=%(pageNo)d')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.cacheDir = tempfile.mkdtemp()
+        self.downloadDir = tempfile.mkdtemp()
+        self.handler.newest = 99
+        self.Downloader = type('Downloader', (self.engine,), dict(
+                queryStr=self.queryStr, usePageCache=False, useDedupIndex=False,
+                cacheDir=self.cacheDir))
+
+    def tearDown(self):
+        shutil.rmtree(self.cacheDir)
+        shutil.rmtree(self.downloadDir)
+
+    def sync(self, numImages):
+        " Run a sync, return (downloader, pages fetched) "
+        self.handler.pageHits = 0
+        downloader = self.Downloader()
+        downloader.startDownload('sync', numImages, self.downloadDir, sync=True)
+        downloader.syncIndex.close()
+        return downloader, self.handler.pageHits
+
+    def images(self):
+        return [filename for filename in os.listdir(self.downloadDir)
+                if filename.endswith('.jpg')]
+
+    def testFirstSyncThenNothingNew(self):
+        downloader, pages = self.sync(25)
+        self.assertEqual(downloader.numDownloaded, 25)
+        self.assertEqual(pages, 3)
+        downloader, pages = self.sync(25)
+        self.assertEqual(downloader.numDownloaded, 0)
+        self.assertEqual(pages, 1)
+        self.assertEqual(len(self.images()), 25)
+
+    def testOnlyNewImages(self):
+        self.sync(25)
+        self.handler.newest = 106       # 7 images added
+        downloader, pages = self.sync(25)
+        self.assertEqual(downloader.numDownloaded, 7)
+        self.assertEqual(pages, 1)
+        self.assertEqual(len(self.images()), 32)
+
+    def testUnseenImages(self):
+        downloader = self.Downloader()
+        downloader._resetRun(5, self.downloadDir)
+        downloader.seenIds = {'3'}
+        records = [ImageRecord(f'image {imageId}', f'http://host/images/{imageId}.jpg')
+                   for imageId in (5, 4, 3, 2)]
+        open(downloader._imagePath(records[1].link, records[1].name), 'wb').close()
+        unseen, numOnDisk, seenReached = downloader._unseenImages(records)
+        self.assertEqual(unseen, records[:1])
+        self.assertEqual(numOnDisk, 1)
+        self.assertTrue(seenReached)
+        self.assertEqual(downloader._syncedIds, ['4'])   # on disk, recorded as seen
+        self.assertEqual(downloader._unseenImages(records[-1:]), (records[-1:], 0, False))
+
+    def testIncompleteSyncNotRecorded(self):
+        downloader = self.Downloader()
+        downloader.searchKey = 'sync'
+        downloader._resetRun(2, self.downloadDir)
+        downloader._startSync()
+        downloader._syncedIds = ['1']
+        downloader.numDownloaded = 1
+        downloader._syncComplete = True
+        downloader._endSync()           # an image short
+        self.assertEqual(downloader.syncIndex.seenIds('sync'), set())
+        downloader.numDownloaded = 2
+        downloader._syncComplete = False
+        downloader._endSync()           # a page failed
+        self.assertEqual(downloader.syncIndex.seenIds('sync'), set())
+        downloader._syncComplete = True
+        downloader._endSync()
+        self.assertEqual(downloader.syncIndex.seenIds('sync'), {'1'})
+        downloader.syncIndex.close()
+
+class AsyncSyncRunTest(SyncRunTest):
+    engine = AsyncAlphaDownloader
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+"""
+ Tests of the download worker pool and the AIMD concurrency limit.
+
+"""
+
+import os, sys, time, threading, unittest
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(testDir, os.pardir, 'Wall-Do'))
+
+from workerpool import WorkerPool, AIMDController, AdaptiveLimiter
+
+class WorkerPoolTest(unittest.TestCase):
+    def testRunsEveryJob(self):
+        done = []
+        lock = threading.Lock()
+        def target(num):
+            with lock:
+                done.append(num)
+        with WorkerPool(target, numWorkers=4) as pool:
+            for num in range(100):
+                pool.submit(num)
+        self.assertEqual(sorted(done), list(range(100)))
+        self.assertEqual(pool.threads, [])
+
+    def testConcurrencyBoundedByWorkers(self):
+        active, peak = [0], [0]
+        lock = threading.Lock()
+        def target():
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.01)
+            with lock:
+                active[0] -= 1
+        with WorkerPool(target, numWorkers=3) as pool:
+            for _ in range(20):
+                pool.submit()
+        self.assertLessEqual(peak[0], 3)
+
+    def testJoinWaitsForScheduledJobs(self):
+        done = []
+        with WorkerPool(done.append, numWorkers=2) as pool:
+            pool.submitLater(0.05, 'retried')
+        self.assertEqual(done, ['retried'])
+
+    def testFailedJobDoesNotStopTheWorker(self):
+        done = []
+        def target(num):
+            if num == 0:
+                raise RuntimeError('failed job')
+            done.append(num)
+        with WorkerPool(target, numWorkers=1) as pool:
+            for num in range(3):
+                pool.submit(num)
+        self.assertEqual(done, [1, 2])
+
+    def testInvalidNumberOfWorkers(self):
+        with self.assertRaises(ValueError):
+            WorkerPool(print, numWorkers=0)
+
+class AIMDControllerTest(unittest.TestCase):
+    def testStartsAtHalf(self):
+        self.assertEqual(AIMDController(8).limit, 4)
+        self.assertEqual(AIMDController(1).limit, 1)
+        self.assertEqual(AIMDController(8, initLimit=6).limit, 6)
+
+    def testGrowsAfterASteadyWindow(self):
+        controller = AIMDController(8)
+        for _ in range(controller.limit):
+            controller.onSuccess(1000)
+        self.assertEqual(controller.limit, 5)
+
+    def testNeverAboveMax(self):
+        controller = AIMDController(2, initLimit=2)
+        for _ in range(10):
+            controller.onSuccess(1000)
+        self.assertEqual(controller.limit, 2)
+
+    def testCongestionCutsOncePerWindow(self):
+        controller = AIMDController(16, initLimit=8)
+        controller.onCongestion('503')
+        controller.onCongestion('503')
+        self.assertEqual(controller.limit, 4)
+
+    def testCutsDownToMin(self):
+        controller = AIMDController(16, minLimit=3, initLimit=4)
+        for _ in range(5):
+            controller.onCongestion('reset')
+            controller._cutInWindow = False     # next window
+        self.assertEqual(controller.limit, 3)
+
+    def testRisingTtfbCuts(self):
+        controller = AIMDController(16, initLimit=8)
+        controller.onSuccess(1000, ttfb=0.05)
+        for _ in range(5):
+            controller.onSuccess(1000, ttfb=2.0)
+        self.assertEqual(controller.limit, 4)
+
+    def testTtfbJitterIgnored(self):
+        controller = AIMDController(16, initLimit=8)
+        controller.onSuccess(1000, ttfb=0.001)
+        controller.onSuccess(1000, ttfb=0.01)   # 10x, but within the slack
+        self.assertEqual(controller.limit, 8)
+
+class AdaptiveLimiterTest(unittest.TestCase):
+    def testBlocksAtTheLimit(self):
+        limiter = AdaptiveLimiter(4, initLimit=1)
+        entered = threading.Event()
+        def transfer():
+            with limiter:
+                entered.set()
+        with limiter:
+            thread = threading.Thread(target=transfer)
+            thread.start()
+            self.assertFalse(entered.wait(0.05))
+        self.assertTrue(entered.wait(1))
+        thread.join()
+        self.assertEqual(limiter.active, 0)
+
+if __name__ == '__main__':
+    unittest.main()